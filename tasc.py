@@ -2,16 +2,34 @@
 
 import subprocess # For running commands on host CLIs
 import getpass # For obscuring password inputs
-import IPy # IP address verifier
 import datetime # for getting system time
 import re # regex for input sanitation
-import paramiko # ssh methods
+import select # for waiting on SSH channels
 ### import netmiko ### - reserved for future use, including additional devices
 import time # for waiting
+import math # for lining events up on interval boundaries
+import collections # for scheduler ticks
 import sys # for the big red 'terminate' button
 import os, os.path #for creating the logging fsys
 import argparse #for CLI arguments
-import progressbar #for the progress bar
+import json, csv # for inventory files
+import zlib # for compressed log segments
+import sqlite3 # for the optional output database
+import queue # for handing records to background writers
+import hashlib, difflib # for the deduplicated output history
+import array, bisect # for time series
+import socket, socketserver # for the daemon's control socket
+import http.server # for the metrics endpoint
+import contextlib, itertools # for tracing spans
+import shutil, tempfile # for spooling commands that run side by side
+import threading # for running many devices at once
+import concurrent.futures # worker pool for inventory mode
+import importlib # for deferring the heavy imports below
+import atexit # for flushing background log writers
+import struct # for writing pcap files
+import mmap # for searching logs without reading them in
+# IPy (IP address verifier), paramiko (ssh methods) and progressbar (for the progress bar) are imported
+# the first time they're used; see LazyModule.
 
 # SSH Task Scheduler (TaSc)
 # Purpose: Provide users with the ability to ssh into network devices and run commands at regular intervals.
@@ -86,6 +104,38 @@ tascDate = 'July 4th, 2016'
 # -Allow users to select interval between sessions; integrate this improvement with progressbar.
 # -Further improvements to pcap
 #
+# v0.3.7 (in development):
+# -SSH sessions persist between events instead of reconnecting and logging in every time
+# -Commands finish when the device prompt comes back rather than after a fixed 45/60 second sleep
+# -Inventory mode: run the same commands against many devices at once ('tasc.py inventory devices.json')
+# -Command output is streamed to the log in chunks as it arrives (no more 10 MB limit per command)
+# -Events start on fixed, clock-aligned intervals, with a choice of what to do when one overruns
+# -Ring buffer keeps a manifest, always evicts the oldest file, and can retain by file count, size or age
+# -Optional gzip log segments with a timestamp index ('tasc.py extract' pulls single events back out)
+# -Optional SQLite store with a row per command ('tasc.py query' searches it)
+# -Optional deduplicated output history: content-addressed blobs plus line deltas ('tasc.py history')
+# -Parsers turn show cpu/memory/conn count/asp drop/interface output into time series ('tasc.py series')
+# -Daemon mode: 'tasc.py daemon' takes capture jobs over a local socket ('tasc.py ctl submit/status/cancel')
+# -Importing tasc.py no longer creates log folders or imports paramiko; TaScJob runs captures from other tools
+# -Live metrics (connect/enable/command times, bytes, errors, schedule slip) over local HTTP, Prometheus or JSON
+# -Tracing spans for every phase of an event (JSONL with --trace, or your own callbacks; 'tasc.py trace')
+# -Continuous debug capture into rotating logs, with rate and time caps that send undebug all ('tasc.py debug')
+# -Unix/SFR commands can run side by side on several channels of one connection (--parallel)
+# -Logs are written by a background thread in batches, so slow disks no longer hold up the SSH reads
+# -Per-command cost model kept across runs: learned timeouts, event length and ETA, overrun warnings ('tasc.py costs')
+# -Load-aware throttle: heavy commands are skipped while a device is busy; per-device and global command rates
+# -Trigger rules (regex, parsed counter threshold, changed output) escalate a device to a heavier command set,
+#       shorter interval or debug window for a few events, then drop it back to the baseline (--triggers)
+# -ASA packet capture finished: bounded capture buffer, packets streamed back over the SSH session into
+#       rotating pcap files, no TFTP server needed ('tasc.py pcap', or the interactive prompt)
+# -SSH broker: one authenticated connection per device shared by every TaSc process on the host, channels
+#       opened through a Unix socket like OpenSSH's ControlMaster ('tasc.py broker', then --broker)
+# -Indexed search across the log ring buffers: event boundaries (and optionally words) kept in an SQLite index
+#       that only reads what's new, logs read through mmap ('tasc.py search')
+# -Process pool for the CPU-heavy work on captured output (time series parsing; history hashing, diffing and
+#       compression), fed through shared memory, in order per device, with backpressure (--offload)
+# -Benchmarks against local mock ASA/IOS/SFR/Unix SSH servers (tasc_bench.py; JSON results to compare versions)
+#
 # v0.4:
 # -Support for arguments on the CLI (-v verbosity, -i interval, -ip address,
 #       -u username -p password, -e enable password, -t device type, -l loop count,
@@ -130,51 +180,92 @@ ssh info and ask the user to confirm.
 '''
 
 
+#
+# LAZY IMPORTS
+#
+
+# When this module started loading, and how long (seconds) each part of startup took; see startupTimes()
+importStarted = time.time()
+importTimes = {}
+
+class LazyModule(object):
+    '''
+    Input: Module name (string).
+    Action: Stand-in for a module that imports it the first time one of its attributes is used, and
+    records how long the import took in importTimes. paramiko alone takes longer to import than the rest
+    of TaSc put together, and the log tools (extract, query, history...) never touch it.
+    '''
+    def __init__(self,name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self,attr):
+        if self.module is None:
+            started = time.time()
+            self.module = importlib.import_module(self.name)
+            importTimes[self.name] = time.time() - started
+        return getattr(self.module,attr)
+
+IPy = LazyModule('IPy')
+paramiko = LazyModule('paramiko')
+progressbar = LazyModule('progressbar')
+multiprocessing = LazyModule('multiprocessing')
+shared_memory = LazyModule('multiprocessing.shared_memory')
+
+def startupTimes():
+    '''
+    Output: Dict of seconds spent loading TaSc itself ('tasc') and each heavy module imported so far.
+    '''
+    times = dict(importTimes)
+    times['tasc'] = importTime
+    return times
+
 #
 # GLOBAL VARIABLES
 #
-disclaimer = ('\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n'+
+def ringLimits():
+    '''
+    Output: The ring buffer's retention limits as they're set right now, in words (string).
+    '''
+    limits = []
+    if ringMaxFiles > 0:
+        limits.append(str(ringMaxFiles) + ' log files')
+    if ringMaxBytes > 0:
+        limits.append(str(round(ringMaxBytes / 1000000.0,1)) + ' MB')
+    if ringMaxAge > 0:
+        limits.append(str(round(ringMaxAge / 3600.0,1)) + ' hours')
+    if len(limits) == 0:
+        return 'every file (no limit on their number, size or age)'
+    if len(limits) > 1:
+        limits = [', '.join(limits[:-1]) + ' or ' + limits[-1]]
+    return 'at most ' + limits[0] + ' per device (the oldest file goes first)'
+
+def disclaimerText():
+    '''
+    Output: The banner TaSc prints when it starts, with the ring buffer settings in effect (string).
+    '''
+    return ('\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n'+
             'SSH Task Scheduler (TaSc) '+ tascVersion +'\nScott Reu, Cisco Systems - RTP Firewall TAC'
             '\nCompiled '+ tascDate +'\n\nFOR USE BY CISCO TAC ENGINEERS ONLY \n\nCisco Systems '
             'assumes no responsibility for consequences of unauthorized or improper use of this '
             'application.\n\nVersion '+ tascVersion +' Notes:'
             '\n-TaSc DOES NOT validate command syntax, so be sure to check your inputs in advance!' +
-            '\n-TaSc maintains a ring buffer with a fixed number of files (120).' +
+            '\n-TaSc maintains a ring buffer that keeps ' + ringLimits() + '.' +
             '\n-ASA Packet capture is currently only functional for single-context ASAs; in multiple mode, captures will fail.'
             '\n\n\nDEBUG Command Guidelines:\n-If a DEBUG command is used, UNDEBUG ALL will automatically '
-            'be executed after each session.\n-TaSc will give you roughly 60 seconds of debug output each time ' 
-            'the command is run.\n\n\n')
+            'be executed after each session.\n-In the event loop, each DEBUG command collects ' +
+            str(debugWindow) + ' seconds of output per event (the debug window).\n-For debugs with no gaps, stream '
+            'them continuously instead (\'tasc.py debug\', or answer y when asked): output goes into rotating logs '
+            'until a time or rate cap, or Ctrl+C, sends UNDEBUG ALL.\n\n\n')
 # Logging File Setup
-logfileprefix = ('TaSc-log-' + str(datetime.datetime.now().year) + '-' + str(datetime.datetime.now().month)
-               + '-' + str(datetime.datetime.now().day) + '_' + str(datetime.datetime.now().time())[0:2]
-               + '-' + str(datetime.datetime.now().time())[3:5])
-logfilename = logfileprefix + '.log'
-# Create a log folder on the Desktop
+# Logs go in a timestamped folder under TaScLog on the Desktop. The folder is made by newLogFolder() when
+# a run starts, not when TaSc is imported.
 # This should actually work on windows, too, because reasons (Python's ~ is translated to %HOMEPATH% in Windows)
-logloc = os.path.join(os.path.expanduser('~'), 'Desktop')
-if not os.path.exists(logloc+'/TaScLog'):
-    os.makedirs(logloc+'/TaScLog')
-os.chdir(logloc+'/TaScLog/')
-if not os.path.exists(logloc+'/TaScLog/'+logfileprefix):
-    os.makedirs(logloc+'/TaScLog/'+logfileprefix)
-else:
-    n = 1
-    dupFolder = True
-    while dupFolder == True:
-        logfileprefix += ('-' + str(n))
-        n +=1
-        if not os.path.exists(logloc+'/TaScLog/'+logfileprefix):
-            os.makedirs(logloc+'/TaScLog/'+logfileprefix)
-        else:
-            pass
-os.chdir(logloc+'/TaScLog/'+logfileprefix+'/')
-logger = open(logfilename,'a',1)
+logloc = os.path.join(os.path.expanduser('~'), 'Desktop', 'TaScLog')
 # Initialize list of commands to be run.
 commandlist = []
 # Verbose output - default to False
 verbose = False
-# Initialize parser for argparse
-#parser = argparse.ArgumentParser(description='Process command line arguments to run TaSc from CLI.')
 
 #
 # REGEX IS FOR SUCKERS
@@ -204,522 +295,5854 @@ iosList = ['ios','Ios','iOS','IOS']
 nixList = ['unix','Unix','uni','Uni','un','Un','U','u']
 sfrList = ['s','S','sf','SF','sfr','SFR']
 sfrclishList = ['s','S','sf','SF','sfr','SFR','sfrclish']
+showlist = ['sh','Sh','sho','Sho','show','Show']
+
+# Per-device-type prompt patterns, matched against the last line of output to decide that a command
+# has finished. ASA/IOS: 'asa>', 'asa#', 'asa/ctx#', 'asa(config)#', 'asa/pri/act#' etc.
+# Unix and SFR expert shells don't print a prompt on an exec channel, so those use an echoed marker instead.
+promptPatterns = {'asa':re.compile(r'^[^\s#>]+[#>] ?$'),
+                  'ios':re.compile(r'^[^\s#>]+[#>] ?$'),
+                  'sfrclish':re.compile(r'^> ?$')}
+markerDevices = ['unix','sfr']
+
+# Timers (in seconds)
+# How long a show/clear command gets to bring the prompt back before TaSc stops waiting for it
+defaultCmdTimeout = 300
+# Commands known to need longer than that, matched against the start of the command with 'sh'/'sho' expanded
+slowCmdTimeouts = {'show tech':1800, 'show conn':900, 'show asp':600}
+# Debugs never finish on their own, so each debug command gets a fixed window of output
+debugWindow = 60
+# Cost model (see CostModel): how long and how big each command has been on each device type, kept across
+# runs in costModelPath. Once a command has costMinSamples finished runs, its timeout is costTimeoutFactor
+# times the slowest of its last costSamples runs plus costTimeoutMargin seconds (at least costMinTimeout).
+# A command that times out gets twice as long the next time, up to costMaxTimeout.
+adaptiveTimeouts = True
+costModelPath = os.path.join(os.path.expanduser('~'),'.tasc-costs.json')
+costSamples = 20
+costMinSamples = 3
+costTimeoutFactor = 3.0
+costTimeoutMargin = 10
+costMinTimeout = 30
+costMaxTimeout = 7200
+# How often (seconds) the cost model is written back to disk while TaSc runs
+costSaveSeconds = 60
+# Load-aware throttle (see TaScThrottle). With throttling on, a device is busy once the CPU in the show cpu output
+# TaSc collects reaches throttleCpuBusy percent, or its commands run throttleLatencyBusy times slower than
+# usual (see CostModel); it stops being busy below throttleCpuClear and throttleLatencyClear. While it's busy,
+# heavy commands (the slowCmdTimeouts ones, or any that usually take longer than throttleHeavySeconds or print
+# more than throttleHeavyBytes) are skipped and TaSc waits throttleBusyPause seconds before each command. Every
+# throttleProbeSeconds one heavy command is let through anyway, to see whether the device has recovered, and the
+# slowdown fades by half over the same time, so a device that only runs heavy commands can't stay busy forever.
+throttling = False
+throttleCpuBusy = 80
+throttleCpuClear = 60
+throttleLatencyBusy = 3.0
+throttleLatencyClear = 1.5
+throttleHeavySeconds = 30
+throttleHeavyBytes = 1000000
+throttleBusyPause = 5
+throttleProbeSeconds = 300
+# Commands per minute per device and across every device (0 = no limit); a busy device gets half its rate
+deviceRate = 0
+globalRate = 0
+# Escalation triggers (see TriggerWatch): how many events a device stays on a rule's heavier command set before it
+# drops back to the baseline, unless the rule says otherwise
+triggerEvents = 5
+# ASA packet capture (see TaScPacketCapture): the capture's buffer on the ASA (bytes; the ASA allows up to 32 MB)
+# and how much of each packet it keeps. Every pcapPoll seconds the new packets are read back, pcapBatch at a
+# time, and once the buffer is pcapDrainPercent full it's cleared so it never stops capturing. Local pcap files
+# are rotated at pcapRotateBytes, keeping the newest pcapKeepFiles (0 = keep them all).
+pcapName = 'TASC-CAP'
+pcapBuffer = 4194304
+pcapPacketLength = 1522
+pcapPoll = 5
+pcapBatch = 500
+pcapDrainPercent = 50
+pcapRotateBytes = 100000000
+pcapKeepFiles = 0
+# Continuous debug capture (see TaScDebugCapture): start a new log file every debugRotateSeconds or
+# debugRotateBytes, and send 'undebug all' once the debug has run for debugMaxSeconds or printed more than
+# debugMaxRate bytes/second averaged over debugRateWindow seconds. 0 turns a limit off.
+debugRotateSeconds = 60
+debugRotateBytes = 10000000
+debugMaxSeconds = 3600
+debugMaxRate = 500000
+debugRateWindow = 10
+# Chunks of debug output that can be waiting on the disk before TaSc stops reading from the device
+debugQueueChunks = 256
+# Unix and SFR expert shells: run an event's commands side by side on up to this many channels of the one
+# SSH connection (1 = one after another). OpenSSH allows 10 sessions per connection by default.
+parallelChannels = 1
+parallelDefault = 4
+# Log files are written by a background thread (see LogWriter), which writes once it has logBatchBytes of
+# output waiting or logFlushSeconds after the last write, whichever comes first. At logQueueItems writes
+# behind, the capture waits for the disk rather than queueing more.
+asyncLogs = True
+logBatchBytes = 65536
+logFlushSeconds = 1.0
+logQueueItems = 4096
+# Size of each read from an SSH channel (bytes). Output is written to the log one chunk at a time.
+readChunk = 32768
+# How late (seconds) an event can start before the scheduler counts its boundary as overrun
+lateTolerance = 1.0
+# What the scheduler does when an event overruns the next boundary (see TaScScheduler)
+overrunPolicies = ['skip','coalesce','late']
+# Ring buffer retention: number of files, total bytes and age in seconds (0 = no limit)
+ringMaxFiles = 120
+ringMaxBytes = 0
+ringMaxAge = 0
+# Write each event's log as a gzip segment with a sparse index instead of plain text
+logCompression = False
+gzipLevel = 6
+# How much of each command's output is kept in memory for recorders (SQLite store etc.), in characters.
+# Anything bigger is only in the log, and recorders get a pointer to it.
+captureLimit = 1000000
+# Worker processes for the CPU-heavy work done on captured output (see OffloadPool): parsing it into time series,
+# and hashing, diffing and compressing it for the history. 0 does that work in TaSc's own process, as before.
+# Up to offloadInFlight outputs can be waiting on the workers before whoever hands over the next one has to
+# wait, and outputs of offloadShareBytes or more reach the workers through shared memory instead of a pipe.
+offloadWorkers = 0
+offloadInFlight = 64
+offloadShareBytes = 262144
+# Default file name for the SQLite output store
+sqliteName = 'tasc.sqlite3'
+# Default folder name for the deduplicated output history, and how many deltas in a row before a full copy
+historyName = 'history'
+historyKeyframe = 100
+# Default file name for the JSONL trace of every phase of every event
+traceName = 'trace.jsonl'
+# Default file name for the search index 'tasc.py search' keeps in the folder it searches
+searchIndexName = '.tasc-search.db'
+# Default file name for the time series parsed out of show commands, and how often (seconds) it's rewritten
+# while TaSc runs
+seriesName = 'series.json'
+seriesSaveSeconds = 60
+# Outputs up to this size are stored inline in the SQLite database; bigger ones are stored as a pointer
+sqliteInlineLimit = 65536
+# Inventory mode: connect timeout per device, and how long to wait before retrying one that's unreachable
+inventoryConnectTimeout = 10
+inventoryRetryDelay = 30
+# Daemon mode: control socket, and how long (seconds) a device's session stays open with no jobs using it
+daemonSocket = os.path.join(os.path.expanduser('~'),'.tasc.sock')
+daemonIdleClose = 600
+# SSH broker (see TaScBroker): socket it listens on, and how long (seconds) it keeps a device's connection up with
+# no channels open on it. With useBroker on, sessions open their channels on the broker's connection to the
+# device instead of each logging in on their own.
+brokerSocket = os.path.join(os.path.expanduser('~'),'.tasc-broker.sock')
+brokerIdleClose = 600
+useBroker = False
+# Histogram buckets for the metrics endpoint: seconds, and bytes of output per command
+metricTimeBuckets = [0.01,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120,300,900,1800]
+metricByteBuckets = [1000,10000,100000,1000000,10000000,100000000]
 
 #
 # PRIMARY FUNCTIONS
 #
 
-def newLog():
-    loglist = [name for name in os.listdir('.') if os.path.isfile(name)]
-    logfilename = ('TaSc-log-' + str(datetime.datetime.now().year) + '-' + str(datetime.datetime.now().month)
-               + '-' + str(datetime.datetime.now().day) + '_' + str(datetime.datetime.now().time())[0:2]
-               + '-' + str(datetime.datetime.now().time())[3:5] + '.log')
-    n = 1
-    while str(logfilename) in loglist:
-        logfilename = logfilename[:-4]
-        logfilename += '_'
-        logfilename += str(n)
-        logfilename += '.log'
-        n +=1
-    logger = open(logfilename,'a',1)
-    numlogs = len(loglist)
-    if numlogs >= 121:
-        os.remove(loglist[0])
-    else:
-        pass
-    return logger
+class GzipSegment(object):
+    '''
+    Input: Path of the segment to create (string, ending in .gz), compression level (int, 1-9).
+    Action: Stand-in for a log file that compresses as it goes. Every command's output becomes its own
+    gzip member (so the segment is still an ordinary .gz file that zcat/gunzip/gzip.open read end to
+    end), and the byte offset where each member starts is written to a sidecar index (path + '.idx',
+    one JSON line per member with its timestamp and command). readSegmentMember() can then jump
+    straight to one command's output without decompressing anything in front of it.
+    Output: A file-like object with write()/flush()/close().
+    '''
+    def __init__(self,path,level=gzipLevel):
+        self.path = path
+        self.level = level
+        self.f = open(path,'ab')
+        self.index = open(path + '.idx','a',1)
+        self.compressor = None
+        self.closed = False
+        self.mark(str(datetime.datetime.now()),None)
 
+    def mark(self,stamp,cmd):
+        '''
+        Input: Timestamp (string), command the next output belongs to (string, or None for TaSc's own notes).
+        Action: Finish the current gzip member and start a new one, and add it to the index.
+        '''
+        self.finishMember()
+        self.memberOffset = self.f.tell()
+        self.index.write(json.dumps({'offset':self.memberOffset,'time':stamp,'cmd':cmd}) + '\n')
+        # wbits=31: zlib writes the gzip header and trailer for us
+        self.compressor = zlib.compressobj(self.level,zlib.DEFLATED,31)
 
-# ssh() is adapted from the work of Kirk Byers
-# see: https://pynet.twb-tech.com/blog/python/paramiko-ssh-part1.html
-def ssh(ip,user,pw,enpw,cmds,dtype,dbug,vb,port,tvalue,log):
+    def finishMember(self):
+        if self.compressor is not None:
+            self.f.write(self.compressor.flush(zlib.Z_FINISH))
+            self.f.flush()
+            self.compressor = None
+
+    def write(self,text):
+        self.f.write(self.compressor.compress(text.encode('utf-8')))
+
+    def flush(self):
+        # Only sync what's been compressed so far; a full flush on every write would wreck the ratio
+        self.f.flush()
+
+    def sync(self):
+        '''
+        Action: Push everything written so far out of the compressor as well (a sync flush, which costs a little
+        ratio), so the current member can be read back up to here before it's finished.
+        '''
+        if self.compressor is not None:
+            self.f.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.f.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.finishMember()
+        self.f.close()
+        self.index.close()
+        self.closed = True
+
+def readSegmentIndex(path):
     '''
-    Input: IP address (string), username (string), password (string), enable password (string),
-    list of commands to run (list), device type (string), are we running a debug command? (boolean),
-    are we logging SSH verbosely? (boolean), ssh dest port(int), value for calculating progressbar time (int).
-    Action: Log into an ASA, run commands, log commands, log out of ASA. If a debug command was run,
-    then at the end of the session we need to undebug all.
-    Output: Debug output to terminal, main output written to logfile.
+    Input: Path of a compressed segment (string).
+    Output: List of index entries (dicts with 'offset', 'time' and 'cmd'), in the order they were written.
     '''
-    #Initialize progress bar
-    pbar = progressbar.ProgressBar().start()
-    pvalue=5
-    pbar.update(value=pvalue)
-    # Create instance of SSHClient object
-    run = paramiko.SSHClient()
-    # Automatically add untrusted host keys
-    run.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    # initiate SSH connection
-    try:
-        run.connect(ip, username=user, password=pw, look_for_keys=False, allow_agent=False, port=port)
-        pvalue=10
-        pbar.update(value=pvalue)
-    except:
-        msg = ('\nSSH ERROR: Check credentials and target IP address, and verify that '
-               'the target is configured to allow SSH access from this host.')
-        print(msg)
-        log.write('[' + str(datetime.datetime.now()) + '] ' + 'Error establishing'
-                     ' SSH connection to host. Terminating thread.\n\n')
-        sys.exit(0)
-    else:
-        if vb == True:
-            log.write('[' + str(datetime.datetime.now()) + '] SSH connection established to '
-                         + ip + ':' + str(port) + '\n\n')
-        else:
-            pass
-    # Enable password, unless you're using a Unix device
-    if str(dtype) not in nixList:
-        if str(dtype) in sfrList:
-            stdin, stdout, stderr = run.exec_command(('expert\nsudo -i\n'+pw),bufsize=10000000)
-            time.sleep(3)
-        elif str(dtype) in sfrclishList:
-            pass
-        else:
-            stdin, stdout, stderr = run.exec_command(('enable\n'+enpw+'\n'),bufsize=10000000)
-            time.sleep(1)
+    entries = []
+    with open(path + '.idx') as f:
+        for line in f:
+            if line.strip() != '':
+                entries.append(json.loads(line))
+    return entries
+
+def readSegmentMember(path,offset):
+    '''
+    Input: Path of a compressed segment (string), byte offset of a member from its index (int).
+    Action: Seek straight to the member and decompress just that one.
+    Output: The member's text (string).
+    '''
+    decompressor = zlib.decompressobj(31)
+    chunks = []
+    with open(path,'rb') as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            data = f.read(readChunk)
+            if data == b'':
+                break
+            chunks.append(decompressor.decompress(data))
+    return b''.join(chunks).decode('utf-8',errors='replace')
+
+def extractEvents(logdir,start=None,end=None,cmd=None):
+    '''
+    Input: Log folder (string), earliest and latest timestamps to match (datetime, optional), text the
+    command has to contain (string, optional).
+    Action: Look through the sparse indexes of every compressed segment in the folder and decompress
+    only the members that match.
+    Output: Generator of (segment file name, index entry, output text), oldest first.
+    '''
+    names = sorted([name for name in os.listdir(logdir) if name.endswith('.gz') and
+                    os.path.exists(os.path.join(logdir,name + '.idx'))],
+                   key=lambda name: os.path.getmtime(os.path.join(logdir,name)))
+    for name in names:
+        path = os.path.join(logdir,name)
+        for entry in readSegmentIndex(path):
+            if entry['cmd'] is None:
+                continue
+            if cmd is not None and cmd not in entry['cmd']:
+                continue
+            when = parseStamp(entry['time'])
+            if start is not None and when < start:
+                continue
+            if end is not None and when > end:
+                continue
+            yield name, entry, readSegmentMember(path,entry['offset'])
+
+# Matches the header ssh() writes in front of every command's output (see logHeader())
+logHeaderPattern = re.compile(r'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?)\] (Output|Debug output) from command "(.*)":$')
+# Matches any line TaSc writes itself: command headers and notes (see logNote()) both start with a timestamp
+logNotePattern = re.compile(r'^\[\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?\] ')
+
+def parseStamp(stamp):
+    '''
+    Input: Timestamp as TaSc writes it in logs, i.e. str(datetime.datetime.now()).
+    Output: datetime
+    '''
+    if '.' in stamp:
+        return datetime.datetime.strptime(stamp,'%Y-%m-%d %H:%M:%S.%f')
+    return datetime.datetime.strptime(stamp,'%Y-%m-%d %H:%M:%S')
+
+def logHeader(log,stamp,kind,cmd):
+    '''
+    Input: Log (file, GzipSegment or LogWriter), timestamp (string), kind of output ('Output' or 'Debug
+    output'), command.
+    Action: Write the header that starts a command's output. Compressed segments start a new gzip member
+    and index entry here, so the command can be pulled back out on its own later.
+    '''
+    if isinstance(log,(GzipSegment,LogWriter)):
+        log.mark(stamp,cmd)
+    log.write('\n[' + stamp + '] ' + kind + ' from command "' + cmd + '":\n')
+
+def logNote(log,text,lead=''):
+    '''
+    Input: Log (file, GzipSegment or LogWriter), note (string), text to put in front of the timestamp (string).
+    Action: Write lead + '[timestamp] ' + text. A LogWriter only takes the time here and builds the line on its
+    own thread.
+    '''
+    if isinstance(log,LogWriter):
+        log.note(text,lead)
     else:
-        pass
-    pvalue=12
-    pbar.update(value=pvalue)
-    # Turn off paging on ASAs
-    if str(dtype) in asaList:
-        stdin.write("terminal page 0\n")
-        stdin.flush()
-        time.sleep(1)
-    # The command is different on IOS
-    # Note: I sanitized this elsewhere. If the syntax is different in NXOS,
-    # we need to add an elif when we add support.
-    elif str(dtype) in iosList:
-        stdin.write("terminal length 0\n")
-        stdin.flush()
-        time.sleep(1)
-    elif str(dtype) in nixList:
-        stdin.write("\n")
-        stdin.flush()
-        time.sleep(1)
-    pvalue=15
-    pbar.update(value=pvalue)
-    # Send commands to device
-    for cmd in cmds:
-        split3 = cmd.split(' ')
-        if split3[0] in debuglist:
-            seconds60 = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30,
-                         31,32,33,34,35,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,56,57,
-                         58,59,60]
-            stdin.write(cmd + '\n')
-            stdin.flush()
-            for second in seconds60:
-                pvalue += tvalue
-                pbar.update(value=pvalue)
-                time.sleep(1)
-            d_out1 = stdout.channel.recv(10000000)
-            d_out2 = d_out1.decode('ISO-8859-1')
-            log.write('\n[' + str(datetime.datetime.now()) + '] Debug output from command "' + cmd + '":\n' + d_out2 + '\n')
-            pbar.update(value=pvalue)
-        else:
-            seconds45 = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30,
-                         31,32,33,34,35,36,37,38,39,40,41,42,43,44,45]
-            stdin.write(cmd + '\n')
-            stdin.flush()
-            for second in seconds45:
-                pvalue += tvalue
-                pbar.update(value=pvalue)
-                time.sleep(1)
-            output = stdout.channel.recv(10000000)
-            output2 = output.decode('ISO-8859-1')
-            log.write('\n[' + str(datetime.datetime.now()) + '] Output from command "' + cmd + '":\n' + output2 + '\n')
-            pbar.update(value=pvalue)
-    pbar.update(value=90)
-    if dbug == True:
-        stdin.write('undebug all\n')
-        stdin.flush()
-        c_output = stdout.channel.recv(4000)
-        c_output2 = output.decode('ISO-8859-1')
-        pbar.update(value=95)
-        if vb == True:
-            log.write('[' + str(datetime.datetime.now()) + '] Verifying undebug all:\n' + c_output2 + '\n')
+        log.write(lead + '[' + str(datetime.datetime.now()) + '] ' + text)
+
+class PendingPointer(object):
+    '''
+    Action: Where a command's output starts in a LogWriter's file, filled in by the writer thread once it
+    gets there. get() waits for it (see logPointer()).
+    '''
+    def __init__(self):
+        self.ready = threading.Event()
+        self.value = None
+
+    def get(self):
+        self.ready.wait()
+        return self.value
+
+class LogWriter(object):
+    '''
+    Input: Log to write to (file or GzipSegment).
+    Action: Take log writes off the capture path. write(), note() and mark() only put the text on a bounded
+    queue; a background thread builds the timestamped lines, gathers writes into batches and writes them
+    out once logBatchBytes are waiting or logFlushSeconds have passed since the last write. When the disk
+    falls logQueueItems writes behind, writes wait for room instead of piling up in memory. close() writes
+    out everything that's still queued before closing the file, and any writer still open when Python exits
+    is closed the same way, so nothing is lost on shutdown. A write error on the thread is raised from the next
+    write(), flush() or close(), as a plain file would have raised it from the write itself.
+    Output: A file-like object with write()/flush()/close().
+    '''
+    def __init__(self,log):
+        self.log = log
+        self.path = log.path if isinstance(log,GzipSegment) else log.name
+        self.queue = queue.Queue(maxsize=logQueueItems)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.writer,name='TaSc-log')
+        self.thread.daemon = True
+        self.thread.start()
+        with openLogWritersLock:
+            openLogWriters.add(self)
+
+    def check(self):
+        '''
+        Action: Raise the error the writer thread last hit, if there is one.
+        '''
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write(self,text):
+        self.check()
+        if text != '':
+            self.queue.put(text)
+
+    def note(self,text,lead=''):
+        self.check()
+        self.queue.put(('note',time.time(),lead,text))
+
+    def mark(self,stamp,cmd):
+        self.check()
+        self.queue.put(('mark',stamp,cmd))
+
+    def pointer(self):
+        '''
+        Output: PendingPointer for the current end of the log.
+        '''
+        self.check()
+        pending = PendingPointer()
+        self.queue.put(('pointer',pending))
+        return pending
+
+    def flush(self):
+        '''
+        Action: Wait until everything written so far is in the file and can be read back (see GzipSegment.sync()).
+        '''
+        done = threading.Event()
+        self.queue.put(('flush',done))
+        done.wait()
+        self.check()
+
+    def writer(self):
+        batch = []
+        size = 0
+        last = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=max(logFlushSeconds - (time.monotonic() - last),0.01))
+            except queue.Empty:
+                item = ('flush',None)
+            if isinstance(item,str):
+                batch.append(item)
+                size += len(item)
+                if size < logBatchBytes:
+                    continue
+            elif item is not None and item[0] == 'note':
+                batch.append(item[2] + '[' + str(datetime.datetime.fromtimestamp(item[1])) + '] ' + item[3])
+                size += len(batch[-1])
+                if size < logBatchBytes:
+                    continue
+            try:
+                if len(batch) > 0:
+                    self.log.write(''.join(batch))
+                batch = []
+                size = 0
+                if item is None:
+                    self.log.close()
+                    return
+                elif item[0] == 'mark':
+                    if isinstance(self.log,GzipSegment):
+                        self.log.mark(item[1],item[2])
+                elif item[0] == 'pointer':
+                    item[1].value = logPointer(self.log)
+                elif item[0] == 'flush' and item[1] is not None and isinstance(self.log,GzipSegment):
+                    # Someone is waiting to read it back
+                    self.log.sync()
+                    last = time.monotonic()
+                elif item[0] == 'flush' or time.monotonic() - last >= logFlushSeconds:
+                    self.log.flush()
+                    last = time.monotonic()
+            except (OSError, ValueError) as e:
+                self.error = e
+                batch = []
+                size = 0
+                if item is None:
+                    try:
+                        self.log.close()
+                    except (OSError, ValueError):
+                        pass
+                    return
+            finally:
+                # Never leave a caller waiting on a pointer or flush, even after a write error
+                if item is not None and item[0] == 'pointer':
+                    item[1].ready.set()
+                elif item is not None and item[0] == 'flush' and item[1] is not None:
+                    item[1].set()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        with openLogWritersLock:
+            openLogWriters.discard(self)
+        self.check()
+
+# Every LogWriter that hasn't been closed yet, so whatever is still queued gets written out at exit
+openLogWriters = set()
+openLogWritersLock = threading.Lock()
+
+def closeLogWriters():
+    with openLogWritersLock:
+        writers = list(openLogWriters)
+    for writer in writers:
+        try:
+            writer.close()
+        except (OSError, ValueError) as e:
+            print('\nERROR: Could not write the end of ' + str(writer.path) + ' (' + str(e) + ')')
+
+atexit.register(closeLogWriters)
+
+class LogRing(object):
+    '''
+    Input: Folder to keep the ring buffer in (string), retention limits: maximum number of files (int),
+    maximum total size in bytes (int), maximum age in seconds (float). 0 turns a limit off. Write
+    compressed segments? (boolean; see GzipSegment).
+    Action: Hand out a new timestamped log file for every TaSc event and throw away the oldest ones once
+    any limit is exceeded. The ring keeps its segments, oldest first, in memory and in a small manifest
+    file in the folder, so rotating doesn't have to list the folder and always evicts the oldest file
+    (not whichever one os.listdir() happens to return first). If there's no manifest yet, the folder is
+    scanned once to pick up logs that are already there.
+    Output: next() returns the new log, opened for line-buffered appends (or a GzipSegment), behind a
+    LogWriter if asyncLogs is on.
+    '''
+    manifestName = '.tasc-ring.json'
+
+    def __init__(self,logdir='.',maxfiles=120,maxbytes=0,maxage=0,compress=False):
+        self.logdir = logdir
+        self.compress = compress
+        self.maxfiles = maxfiles
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self.lock = threading.Lock()
+        # [name, created (epoch seconds), size in bytes] for every segment, oldest first.
+        # The newest segment is still being written, so its size is only filled in when we rotate.
+        self.segments = collections.deque()
+        self.names = set()
+        self.totalbytes = 0
+        self.lastbase = None
+        self.seq = 0
+        self.load()
+
+    def load(self):
+        manifest = os.path.join(self.logdir,self.manifestName)
+        try:
+            with open(manifest) as f:
+                segments = json.load(f)
+        except (IOError, ValueError):
+            segments = []
+            for name in os.listdir(self.logdir):
+                path = os.path.join(self.logdir,name)
+                if name.startswith('TaSc-log-') and not name.endswith('.idx') and os.path.isfile(path):
+                    stat = os.stat(path)
+                    segments.append([name,stat.st_mtime,stat.st_size])
+            segments.sort(key=lambda segment: segment[1])
+        for segment in segments:
+            self.segments.append(segment)
+            self.names.add(segment[0])
+            self.totalbytes += segment[2]
+
+    def save(self):
+        manifest = os.path.join(self.logdir,self.manifestName)
+        with open(manifest + '.tmp','w') as f:
+            json.dump(list(self.segments),f)
+        os.replace(manifest + '.tmp',manifest)
+
+    def next(self):
+        with self.lock:
+            # Now that the previous segment is finished, we know how big it is
+            if len(self.segments) > 0:
+                last = self.segments[-1]
+                try:
+                    size = os.path.getsize(os.path.join(self.logdir,last[0]))
+                except OSError:
+                    size = 0
+                self.totalbytes += size - last[2]
+                last[2] = size
+            now = datetime.datetime.now()
+            base = ('TaSc-log-' + str(now.year) + '-' + str(now.month) + '-' + str(now.day) + '_'
+                    + now.strftime('%H') + '-' + now.strftime('%M'))
+            # Files opened in the same minute get _1, _2... (never reusing a suffix that's been evicted)
+            if base == self.lastbase:
+                self.seq += 1
+            else:
+                self.lastbase, self.seq = base, 0
+            ext = '.log.gz' if self.compress == True else '.log'
+            logfilename = base + ('_' + str(self.seq) if self.seq > 0 else '') + ext
+            while logfilename in self.names or os.path.exists(os.path.join(self.logdir,logfilename)):
+                self.seq += 1
+                logfilename = base + '_' + str(self.seq) + ext
+            if self.compress == True:
+                logger = GzipSegment(os.path.join(self.logdir,logfilename))
+            elif asyncLogs == True:
+                # LogWriter does the batching, so the file doesn't need to be line-buffered
+                logger = open(os.path.join(self.logdir,logfilename),'a')
+            else:
+                logger = open(os.path.join(self.logdir,logfilename),'a',1)
+            if asyncLogs == True:
+                logger = LogWriter(logger)
+            self.segments.append([logfilename,time.time(),0])
+            self.names.add(logfilename)
+            self.evict()
+            self.save()
+            return logger
+
+    def evict(self):
+        '''
+        Action: Remove the oldest segments until the ring is back within its limits. The segment that
+        was just opened is never evicted.
+        '''
+        now = time.time()
+        while len(self.segments) > 1 and self.overLimit(now):
+            oldest = self.segments.popleft()
+            self.names.discard(oldest[0])
+            self.totalbytes -= oldest[2]
+            for name in [oldest[0],oldest[0] + '.idx']:
+                try:
+                    os.remove(os.path.join(self.logdir,name))
+                except OSError:
+                    pass
+
+    def overLimit(self,now):
+        if self.maxfiles > 0 and len(self.segments) > self.maxfiles:
+            return True
+        if self.maxbytes > 0 and self.totalbytes > self.maxbytes:
+            return True
+        if self.maxage > 0 and now - self.segments[0][1] > self.maxage:
+            return True
+        return False
+
+# One ring per log folder, created the first time newLog() is called for that folder
+logRings = {}
+logRingsLock = threading.Lock()
+
+def newLogFolder(root=None):
+    '''
+    Input: Folder to put the run's log folder in (string, defaults to TaScLog on the Desktop).
+    Action: Create a log folder named for the current minute, adding -1, -2... if that's already taken.
+    Output: Path of the new folder.
+    '''
+    if root is None:
+        root = logloc
+    now = datetime.datetime.now()
+    prefix = ('TaSc-log-' + str(now.year) + '-' + str(now.month) + '-' + str(now.day) + '_'
+              + now.strftime('%H') + '-' + now.strftime('%M'))
+    folder = os.path.join(root,prefix)
+    n = 0
+    while True:
+        try:
+            os.makedirs(folder)
+        except FileExistsError:
+            n += 1
+            folder = os.path.join(root,prefix + '-' + str(n))
         else:
-            pass
-    else:
-        pass
-    pbar.update(value=99)
-    # Close connection and log success
-    run.close()
-    if vb == True:
-        log.write('[' + str(datetime.datetime.now()) + '] Terminating SSH session gracefully.'
-                     ' (This is part of normal operation).\n')
-    else:
-        pass
-    pbar.update(value=100)
-    pbar.finish()
+            return folder
+
+def newLog(logdir='.'):
+    '''
+    Input: Folder the ring buffer lives in (string, defaults to the current session folder).
+    Output: A new log file for this event, from that folder's LogRing.
+    '''
+    key = os.path.abspath(logdir)
+    with logRingsLock:
+        if key not in logRings:
+            logRings[key] = LogRing(logdir,ringMaxFiles,ringMaxBytes,ringMaxAge,logCompression)
+        ring = logRings[key]
+    return ring.next()
 
 #
-# INPUT SANITY CHECKS
+# LOG SEARCH
 #
 
-def sanitize_ip(ip):
+# logHeaderPattern for bytes, to find headers straight in a memory-mapped log
+logHeaderBytes = re.compile(logHeaderPattern.pattern.encode('utf-8'),re.M)
+# What the token index counts as a word: runs of letters and digits, kept together across the . : / _ - inside
+# addresses, interface names, MACs and the like (10.1.1.1, gigabitethernet0/1, 0050.56ab.cdef)
+searchTokenPattern = re.compile(rb'[a-z0-9]+(?:[._:/-][a-z0-9]+)*')
+
+def searchTokens(data):
     '''
-    Input: a string containing the IP address that SSH traffic will be destined to.
-    
-    Action: verify that the string provided is a valid IP (my instinct is to split it up
-    into a list of octets, make sure that there are four of them and that each one is 255
-    or less, etc., but instead we'll be using IPy.)
-    
-    Output: Return nothing if the IP is invalid, return True if the IP is good. main()
-    will have a While loop and a variable we can initially set to False so that when this
-    function returns True, you can move on to the next stage.
+    Input: Output text (bytes).
+    Output: Set of the words in it (bytes, lower case), as the token index stores them.
+    '''
+    return set(searchTokenPattern.findall(data.lower()))
+
+class LogIndex(object):
+    '''
+    Input: Folder of TaSc logs (string; one session folder, or all of TaScLog), index file (string, defaults
+    to searchIndexName in the folder), index the words in every output too? (boolean).
+    Action: Keep an SQLite index of every command output in every log under the folder: file, byte range,
+    timestamp, kind and command, taken from the headers ssh() writes (see logHeader()), plus, if asked for,
+    which words each output contains. update() only reads what's changed since the last time: new files, and
+    the end of files that have grown (starting again from their last event, which may have been cut short).
+    Files the ring buffer has evicted are dropped. Text logs are read through mmap. Compressed segments are
+    indexed from their .idx sidecars and only decompressed to be tokenized or matched. Once words are
+    indexed, later updates keep indexing them.
+    Output: update() returns (files read, events added). search() is a generator of (path, event, lines);
+    see search().
+    '''
+    schema = ['CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL, '
+              'inode INTEGER)',
+              'CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, file INTEGER, start INTEGER, end INTEGER, '
+              'ts REAL, time TEXT, kind TEXT, command TEXT)',
+              'CREATE INDEX IF NOT EXISTS events_ts ON events (ts)',
+              'CREATE INDEX IF NOT EXISTS events_file ON events (file, start)',
+              'CREATE TABLE IF NOT EXISTS tokens (token BLOB, event INTEGER, PRIMARY KEY (token, event)) WITHOUT ROWID',
+              'CREATE INDEX IF NOT EXISTS tokens_event ON tokens (event)',
+              'CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)']
+
+    def __init__(self,root,path=None,tokens=False):
+        self.root = root
+        self.path = path or os.path.join(root,searchIndexName)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        for statement in self.schema:
+            self.db.execute(statement)
+        row = self.db.execute("SELECT value FROM settings WHERE name = 'tokens'").fetchone()
+        self.tokens = row is not None and row[0] == '1'
+        if tokens == True and self.tokens == False:
+            # Outputs indexed so far have no words in the index; read everything again
+            self.clear()
+            self.db.execute("INSERT OR REPLACE INTO settings VALUES ('tokens','1')")
+            self.tokens = True
+        self.db.commit()
+
+    def clear(self):
+        for table in ['files','events','tokens']:
+            self.db.execute('DELETE FROM ' + table)
+        self.db.commit()
+
+    def update(self):
+        known = {}
+        for fileid, path, size, mtime, inode in self.db.execute('SELECT id, path, size, mtime, inode FROM files'):
+            known[path] = (fileid,size,mtime,inode)
+        nfiles = 0
+        nevents = 0
+        seen = set()
+        for folder, dirs, names in os.walk(self.root):
+            for name in names:
+                if not name.startswith('TaSc-log-') or not (name.endswith('.log') or name.endswith('.log.gz')):
+                    continue
+                path = os.path.join(folder,name)
+                rel = os.path.relpath(path,self.root)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(rel)
+                row = known.get(rel)
+                if row is not None and row[1:] == (stat.st_size,stat.st_mtime,stat.st_ino):
+                    continue
+                nevents += self.read(rel,path,stat,row)
+                nfiles += 1
+        for rel, row in known.items():
+            if rel not in seen:
+                self.forget(row[0])
+                self.db.execute('DELETE FROM files WHERE id = ?',(row[0],))
+        self.db.commit()
+        return nfiles, nevents
+
+    def forget(self,fileid,start=0):
+        '''
+        Action: Drop a file's events (and their words) from byte offset start on.
+        '''
+        self.db.execute('DELETE FROM tokens WHERE event IN (SELECT id FROM events WHERE file = ? AND start >= ?)',
+                        (fileid,start))
+        self.db.execute('DELETE FROM events WHERE file = ? AND start >= ?',(fileid,start))
+
+    def read(self,rel,path,stat,row):
+        '''
+        Input: Log's path relative to the folder and its full path, os.stat() of it, what the index had for it
+        (tuple from update(), or None for a new file).
+        Action: Index the file's events, from its last indexed event on if it has only grown since.
+        Output: Number of events added.
+        '''
+        start = 0
+        if row is None:
+            fileid = self.db.execute('INSERT INTO files (path) VALUES (?)',(rel,)).lastrowid
+        else:
+            fileid = row[0]
+            if row[3] == stat.st_ino and row[1] <= stat.st_size:
+                last = self.db.execute('SELECT MAX(start) FROM events WHERE file = ?',(fileid,)).fetchone()[0]
+                start = last or 0
+            self.forget(fileid,start)
+        self.db.execute('UPDATE files SET size = ?, mtime = ?, inode = ? WHERE id = ?',
+                        (stat.st_size,stat.st_mtime,stat.st_ino,fileid))
+        try:
+            if path.endswith('.gz'):
+                events = self.readSegment(path,start,stat.st_size)
+            else:
+                events = self.readText(path,start)
+        except (OSError, ValueError):
+            return 0
+        for begin, end, stamp, kind, cmd, words in events:
+            try:
+                ts = parseStamp(stamp).timestamp()
+            except ValueError:
+                continue
+            eventid = self.db.execute('INSERT INTO events (file, start, end, ts, time, kind, command) '
+                                      'VALUES (?,?,?,?,?,?,?)',(fileid,begin,end,ts,stamp,kind,cmd)).lastrowid
+            if words is not None:
+                self.db.executemany('INSERT OR IGNORE INTO tokens VALUES (?,?)',[(word,eventid) for word in words])
+        return len(events)
+
+    def readText(self,path,start):
+        events = []
+        with open(path,'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return events
+            with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+                headers = list(logHeaderBytes.finditer(mm,start))
+                for n, match in enumerate(headers):
+                    end = headers[n + 1].start() if n + 1 < len(headers) else size
+                    words = searchTokens(mm[match.end():end]) if self.tokens else None
+                    events.append((match.start(),end,match.group(1).decode('utf-8'),match.group(2).decode('utf-8'),
+                                   match.group(3).decode('utf-8',errors='replace'),words))
+        return events
+
+    def readSegment(self,path,start,size):
+        entries = [entry for entry in readSegmentIndex(path) if entry['offset'] >= start]
+        events = []
+        for n, entry in enumerate(entries):
+            if entry['cmd'] is None:
+                continue
+            end = entries[n + 1]['offset'] if n + 1 < len(entries) else size
+            if self.tokens:
+                words = searchTokens(readSegmentMember(path,entry['offset']).split('":\n',1)[-1].encode('utf-8'))
+            else:
+                words = None
+            events.append((entry['offset'],end,entry['time'],'Output',entry['cmd'],words))
+        return events
+
+    def search(self,command=None,start=None,end=None,pattern=None,word=None):
+        '''
+        Input: Text the command has to contain, earliest and latest time (datetime), regular expression the
+        output has to match, word the output has to contain (see searchTokens()) - all optional.
+        Action: Narrow the events down in the index (command, time and, if words are indexed, the word), then
+        match the pattern (or the word, if words aren't indexed) against just those events' bytes.
+        Output: Generator of (path, event dict, lines): the log's full path, the event ('start', 'end', 'time',
+        'kind', 'command') and the lines the pattern matched (bytes; empty without a pattern), oldest first.
+        '''
+        sql = ('SELECT events.id, files.path, start, end, time, kind, command FROM events JOIN files ON '
+               'files.id = events.file WHERE 1=1')
+        params = []
+        if command is not None:
+            sql += ' AND command LIKE ?'
+            params.append('%' + command + '%')
+        if start is not None:
+            sql += ' AND ts >= ?'
+            params.append(start.timestamp())
+        if end is not None:
+            sql += ' AND ts <= ?'
+            params.append(end.timestamp())
+        if word is not None:
+            word = word.lower().encode('utf-8')
+            if self.tokens and searchTokenPattern.fullmatch(word):
+                sql += ' AND events.id IN (SELECT event FROM tokens WHERE token = ?)'
+                params.append(word)
+                word = None
+        sql += ' ORDER BY ts, start'
+        regex = re.compile(pattern.encode('utf-8')) if pattern is not None else None
+        rows = self.db.execute(sql,params).fetchall()
+        opened = None
+        try:
+            for eventid, rel, begin, finish, stamp, kind, cmd in rows:
+                path = os.path.join(self.root,rel)
+                event = {'start':begin,'end':finish,'time':stamp,'kind':kind,'command':cmd}
+                if regex is None and word is None:
+                    yield path, event, []
+                    continue
+                if path.endswith('.gz'):
+                    # The member starts with the newline in front of its header
+                    data = readSegmentMember(path,begin).lstrip('\n').encode('utf-8')
+                    lo, hi = 0, len(data)
+                else:
+                    if opened is None or opened[0] != path:
+                        if opened is not None and opened[1] is not None:
+                            opened[1].close()
+                        opened = (path,searchMap(path))
+                    data = opened[1]
+                    if data is None:
+                        continue
+                    lo, hi = begin, min(finish,len(data))
+                # Match the output, not the header line
+                lo = data.find(b'\n',lo,hi) + 1 or hi
+                if word is not None and word not in searchTokens(data[lo:hi]):
+                    continue
+                lines = []
+                if regex is not None:
+                    for match in regex.finditer(data,lo,hi):
+                        first = data.rfind(b'\n',lo,match.start()) + 1 or lo
+                        last = data.find(b'\n',match.end(),hi)
+                        line = data[first:hi if last < 0 else last]
+                        if len(lines) == 0 or lines[-1] != line:
+                            lines.append(line)
+                    if len(lines) == 0:
+                        continue
+                yield path, event, lines
+        finally:
+            if opened is not None and opened[1] is not None:
+                opened[1].close()
+
+    def close(self):
+        self.db.close()
+
+def searchOutput(path,event):
+    '''
+    Input: Log path and event, as LogIndex.search() gives them.
+    Output: The event's output (string), without its header.
+    '''
+    if path.endswith('.gz'):
+        return readPointer(path + '@' + str(event['start']))
+    with open(path,'rb') as f:
+        f.seek(event['start'])
+        data = f.read(event['end'] - event['start'])
+    return data.decode('utf-8',errors='replace').split('\n',1)[-1]
+
+def searchMap(path):
+    '''
+    Output: Read-only mmap of a text log, or None if it's empty or gone.
     '''
     try:
-        IPy.IP(ip)
-    except:
-        print('Invalid IP Address')
-        return False
+        with open(path,'rb') as f:
+            return mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+#
+# SSH SESSION MANAGEMENT
+#
+
+def deviceFamily(dtype):
+    '''
+    Input: Device type (string) as returned by getDevice()
+    Output: One of 'asa', 'ios', 'unix', 'sfr' or 'sfrclish'
+    '''
+    if str(dtype) in asaList:
+        return 'asa'
+    elif str(dtype) in iosList:
+        return 'ios'
+    elif str(dtype) in nixList:
+        return 'unix'
+    elif str(dtype) in sfrList:
+        return 'sfr'
     else:
-        return True
+        return 'sfrclish'
 
-def sanitize_cmds(cmds):
+def cmdTimeout(cmd,family=None):
     '''
-    Input: List (this should be the global commandlist)
-    Action: Verify that the commands being run look like valid ASA/IOS show commands (currently
-    we are not actually running a full-blown validator to check against a database of valid show commands,
-    but future releases might want to go in that direction.) This will be accomplished with
-    a regex match to confirm that the first word is "show" or a working approximation of "show".
-    
-    If a command doesn't look like the correct syntax, prompt the user to either remove the command
-    or 
-    Output: Returns boolean value of True if a debug command has been used, and False otherwise.
+    Input: Command (string), device family it runs on (string, optional; see deviceFamily()).
+    Output: Number of seconds the command gets to finish (int); debug commands get debugWindow. With a family
+    and adaptiveTimeouts on, commands the cost model has seen enough of get a timeout learned from them.
     '''
+    split = cmd.split(' ')
+    if split[0] in debuglist:
+        return debugWindow
+    full = normalizeCmd(cmd)
+    static = defaultCmdTimeout
+    for slow in slowCmdTimeouts:
+        if full.startswith(slow):
+            static = slowCmdTimeouts[slow]
+            break
+    if family is not None and adaptiveTimeouts == True:
+        learned = costs.timeout(family,cmd,static)
+        if learned is not None:
+            return learned
+    return static
+
+def estimateCycle(cmds,measured,family=None):
+    '''
+    Input: List of commands, dict of measured durations (seconds) per command from earlier events, device
+    family (string, optional).
+    Output: Estimated length of one event in seconds (float). Commands that haven't been timed yet this run
+    are taken from the cost model for the family, and failing that assumed to take 45 seconds (show/clear)
+    or the debug window (debug).
+    '''
+    t = float(0)
     for cmd in cmds:
-        notnum = re.search(unacceptable,cmd)
-        if notnum:
-            print(('Command "' + str(cmd) + '" contains special characters. '
-            'Commands must be strings of alphanumeric characters. Removing command from list.'))
-            cmds.remove(cmd)
-        else:
-            pass
-    
-    for cmd in cmds:
-        if cmd == '':
-            print('Command "' + str(cmd) + '" is blank. Removing command from list.')
-            cmds.remove(cmd)
-        else:
-            pass
-    
-    for cmd in cmds:
-        split = cmd.split(' ')
-        if len(split) <= 1:
-            print(('Command "' + str(cmd) + '" contains only one word. Show commands have at '
-                   'least two items. Removing command from list.'))
-            cmds.remove(cmd)
+        if cmd in measured:
+            t += measured[cmd]
+        elif cmd.split(' ')[0] in debuglist:
+            t += debugWindow
+        elif family is not None and costs.estimate(family,cmd) is not None:
+            t += costs.estimate(family,cmd)
         else:
+            t += 45.0
+    return max(t,1.0)
+
+class CostModel(object):
+    '''
+    Input: File the model is kept in (string, defaults to costModelPath).
+    Action: Remembers how long each command took and how much it printed, per (device family, command),
+    across events and runs: the last costSamples runs of each are kept and the file is rewritten every
+    costSaveSeconds and at exit. estimate() and timeout() are what estimateCycle() and cmdTimeout() use;
+    the file is only read the first time one of them is asked.
+    Output: estimate(), timeout(), rows() for 'tasc.py costs'.
+    '''
+    def __init__(self,path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = None
+        self.dirty = False
+        self.saved = time.monotonic()
+
+    def load(self):
+        if self.data is not None:
+            return
+        self.data = {}
+        try:
+            with open(self.path or costModelPath) as f:
+                for item in json.load(f):
+                    self.data[(item['family'],item['command'])] = item['samples']
+        except (OSError, ValueError, KeyError, TypeError):
             pass
-        
-    for cmd in cmds:
-        split2 = cmd.split(' ')
-        if split2[0] not in goodshow:
-            print(('Command "' + str(cmd) + '" is not a Show command. Currently only Show and Debug '
-                   'commands are supported. Removing command from list.'))
-            cmds.remove(cmd)
-        else:
+
+    def record(self,family,cmd,seconds,nbytes,finished):
+        '''
+        Input: Device family, command, seconds it took, bytes it printed, whether its prompt came back.
+        Debug commands always take their window, so they aren't recorded.
+        '''
+        if cmd.split(' ')[0] in debuglist:
+            return
+        with self.lock:
+            self.load()
+            samples = self.data.setdefault((family,normalizeCmd(cmd)),[])
+            samples.append([round(time.time(),3),round(seconds,3),nbytes,finished])
+            del samples[:-costSamples]
+            self.dirty = True
+            due = time.monotonic() - self.saved >= costSaveSeconds
+        if due:
+            self.save()
+
+    def samples(self,family,cmd):
+        with self.lock:
+            self.load()
+            return list(self.data.get((family,normalizeCmd(cmd)),[]))
+
+    def estimate(self,family,cmd):
+        '''
+        Output: Mean seconds over the recent runs of the command, or None if it hasn't been seen.
+        '''
+        samples = self.samples(family,cmd)
+        if len(samples) == 0:
+            return None
+        return sum([sample[1] for sample in samples]) / len(samples)
+
+    def timeout(self,family,cmd,static=defaultCmdTimeout):
+        '''
+        Input: Device family, command, the timeout it would get without the model (seconds).
+        Output: Learned timeout in seconds (int), or None if there aren't costMinSamples finished runs yet.
+        '''
+        samples = self.samples(family,cmd)
+        done = [sample[1] for sample in samples if sample[3]]
+        late = [sample[1] for sample in samples if not sample[3]]
+        if len(late) > 0 and samples[-1][3] == False:
+            # It just timed out: the samples that finished say nothing about how long it needs now
+            return int(min(max(static,2 * late[-1]),costMaxTimeout))
+        if len(done) < costMinSamples:
+            return None
+        learned = max(costMinTimeout,costTimeoutFactor * max(done) + costTimeoutMargin)
+        if len(late) > 0:
+            learned = max(learned,static)
+        return int(min(learned,costMaxTimeout))
+
+    def rows(self,family=None):
+        '''
+        Output: List of dicts (family, command, runs, mean/max seconds, mean bytes, timeouts, timeout) sorted
+        by family and command.
+        '''
+        with self.lock:
+            self.load()
+            keys = sorted([key for key in self.data if family is None or key[0] == family])
+        rows = []
+        for key in keys:
+            samples = self.samples(key[0],key[1])
+            learned = self.timeout(key[0],key[1],cmdTimeout(key[1]))
+            rows.append({'family':key[0],'command':key[1],'runs':len(samples),
+                         'mean':sum([sample[1] for sample in samples]) / len(samples),
+                         'max':max([sample[1] for sample in samples]),
+                         'bytes':sum([sample[2] for sample in samples]) // len(samples),
+                         'timeouts':len([sample for sample in samples if not sample[3]]),
+                         'timeout':learned if learned is not None else cmdTimeout(key[1])})
+        return rows
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = [{'family':key[0],'command':key[1],'samples':samples}
+                    for key, samples in sorted(self.data.items())]
+            self.dirty = False
+            self.saved = time.monotonic()
+        path = self.path or costModelPath
+        try:
+            with open(path + '.tmp','w') as f:
+                json.dump(data,f)
+            os.replace(path + '.tmp',path)
+        except OSError:
             pass
-    
-    if len(cmds) == 0:
-        print('\n\nERROR: List of commands is empty. Terminating TaSc.\n\n')
-        sys.exit(0)
 
-    # Debug command notifier
-    split3 = cmd.split(' ')   
-    if split3[0] in debuglist:
-        print ('NOTICE: at least one of your commands has been recognized as a DEBUG command. '
-               'UNDEBUG ALL will be automatically applied at the end of each SSH session '
-               'in order to preserve resources.')
-        return True
-    else:
-        return False
+costs = CostModel()
 
-def isIntOrBlank(foo):
+def saveCosts():
+    costs.save()
+
+atexit.register(saveCosts)
+
+def cycleWarning(cmds,family,interval):
     '''
-    Input: Any variable.
-    Action: Determine if a foo is an integer in range 1-65535 or a blank space (input sanitization for getPort)
-    Output: True if foo is an integer 1-65535 or blank; False otherwise.
+    Input: List of commands, device family, seconds between the start of each event (0 = back to back).
+    Output: Warning (string) if one event is expected to take longer than the interval (see estimateCycle()),
+    else None.
     '''
-    footoo = 0
-    try:
-        footoo = int(foo)
-    except:
-        pass
-    if isinstance(footoo,int):
-        if 1 <= footoo <= 65535:
-            return True
+    if interval <= 0:
+        return None
+    t = estimateCycle(cmds,{},family)
+    if t <= interval:
+        return None
+    return ('WARNING: one event of these commands is expected to take about ' + str(int(round(t))) + ' seconds on '
+            + family + ' devices, longer than the ' + str(interval) + ' second interval, so events will overrun.')
+
+def runEstimate(cmds,family,interval,numberoftimes):
+    '''
+    Input: List of commands, device family, seconds between event starts, number of events (0 = no end).
+    Output: Line for the confirmation screen with the estimated event length and, for a fixed number of
+    events, when the run should finish.
+    '''
+    t = estimateCycle(cmds,{},family)
+    known = len([cmd for cmd in cmds if costs.estimate(family,cmd) is not None])
+    line = ('Each event should take about ' + str(int(round(t))) + ' seconds (' + str(known) + ' of '
+            + str(len(cmds)) + ' commands timed on earlier runs)')
+    if numberoftimes > 0:
+        finish = datetime.datetime.now() + datetime.timedelta(seconds=(numberoftimes - 1) * max(interval,t) + t)
+        line += '; the run should finish around ' + finish.strftime('%H:%M') + '.'
+    else:
+        line += '.'
+    return line
+
+def readUntil(chan,done,timeout,tick=None,sink=None,holdback=0):
+    '''
+    Input: paramiko channel, function that is handed the tail end of the output read so far and returns
+    True once the command has finished, timeout in seconds (float), progress callback that is handed
+    the number of seconds elapsed (optional), file-like object to stream the output into (optional),
+    number of characters at the end of the output to hold back from the sink (int, optional).
+    Action: Read from the channel in readChunk-sized pieces as data arrives until done() says we're
+    finished, the timeout runs out or the channel closes. With a sink, each piece is written out as soon
+    as it's read, so memory use stays flat however much the command prints; only the last few hundred
+    characters are kept around for done() to look at.
+    Output: Tuple of (output (string), True if done() was satisfied / False otherwise). With a sink, the
+    output returned is just what hasn't been written yet: the held-back tail, plus the piece that satisfied
+    done().
+    '''
+    start = time.time()
+    chunks = []
+    tail = ''
+    pending = ''
+    while True:
+        elapsed = time.time() - start
+        if tick is not None:
+            tick(elapsed)
+        if chan.recv_ready():
+            # ISO-8859-1 maps every byte to one character, so chunks can be decoded on their own
+            data = chan.recv(readChunk).decode('ISO-8859-1')
+            tail = (tail + data)[-512:]
+            if sink is None:
+                chunks.append(data)
+            else:
+                pending += data
+            if done(tail):
+                # Nothing from the chunk that finished the command has gone to the sink yet, so the caller can
+                # still cut off a marker even if more output came in right behind it
+                return ''.join(chunks) + pending, True
+            if len(pending) > holdback:
+                cut = len(pending) - holdback
+                sink.write(pending[:cut])
+                pending = pending[cut:]
+            continue
+        elif chan.closed or chan.exit_status_ready():
+            return ''.join(chunks) + pending, False
+        if elapsed >= timeout:
+            return ''.join(chunks) + pending, False
+        select.select([chan],[],[],min(0.5,max(timeout - elapsed,0)))
+
+def sshClient(ip,port,user,pw,dtype,timeout=None):
+    '''
+    Input: IP address, ssh dest port, username, password, device type, connect timeout (seconds, optional).
+    Action: Open an SSH connection and authenticate. Raises the paramiko/socket exception on failure.
+    Output: Connected paramiko.SSHClient, with keepalives on.
+    '''
+    # Create instance of SSHClient object
+    run = paramiko.SSHClient()
+    # Automatically add untrusted host keys
+    run.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    if str(dtype) not in sfrclishList:
+        run.connect(ip, username=user, password=pw, look_for_keys=False, allow_agent=False, timeout=timeout,
+                    port=port)
     else:
-        var = foo.strip(' ')
-        if foo == '':
+        run.connect(ip, username=user, password=pw, timeout=timeout, port=port)
+    # Keep idle sessions from being reaped by the device or a firewall between events
+    run.get_transport().set_keepalive(30)
+    return run
+
+class TaScSession(object):
+    '''
+    Input: IP address (string), username (string), password (string), enable password (string),
+    device type (string), ssh dest port (int), connect timeout (seconds, optional), name to record the
+    device under (string, optional).
+    Action: Hold one authenticated, enabled, pager-off shell open to a device so that every TaSc event
+    can reuse it instead of paying for a TCP/key exchange, an AAA login, enable and terminal paging on
+    each pass of the main loop. ensure() checks that the session is still alive and transparently
+    reconnects if the device (or anything in between) dropped it.
+    With useBroker on, the shell is a channel on a TaScBroker's connection instead (see BrokerClient).
+    Output: stdin/stdout file handles for the shell, exactly like the ones exec_command() used to return.
+    '''
+    def __init__(self,ip,user,pw,enpw,dtype,port=22,timeout=None,name=None):
+        self.ip = ip
+        self.user = user
+        self.pw = pw
+        self.enpw = enpw
+        self.dtype = str(dtype)
+        self.port = port
+        # What the device is called in logs and records (inventory name, or ip[:port])
+        if name is None:
+            name = ip if str(port) == '22' else ip + ':' + str(port)
+        self.name = name
+        # Connect timeout used when ensure() has to (re)connect on its own
+        self.timeout = timeout
+        self.client = None
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+        self.family = deviceFamily(dtype)
+        # The device's own prompt, learned at login ('asa#', 'rtr1>' ...)
+        self.prompt = None
+        self.hostname = None
+        self.marker = 0
+        # True while reopen() logs in again, so a login command that times out doesn't reopen the shell in turn
+        self.reopening = False
+        # Number of times we've had to log in to the device (1 == the session was never dropped)
+        self.connects = 0
+        # Session this one shares its transport with (see spawn()), and the extra shells spawned off this one
+        self.parent = None
+        self.shells = []
+
+    def connect(self,timeout=None):
+        '''
+        Input: connect timeout in seconds (int or None; defaults to the session's timeout).
+        Action: Open the SSH connection and log in. Raises the paramiko/socket exception on failure.
+        Output: None
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        self.close()
+        with tracer.span('connect',self.name):
+            run = None
+            if useBroker == True:
+                run = BrokerClient(brokerSocket,self.ip,self.port,self.user,self.pw,self.dtype,self.name)
+                try:
+                    run.connect(timeout)
+                except (FileNotFoundError, ConnectionError):
+                    brokerMissing()
+                    run = None
+            if run is None:
+                run = sshClient(self.ip,self.port,self.user,self.pw,self.dtype,timeout)
+        self.client = run
+        self.connects += 1
+        with tracer.span('login',self.name):
+            self.login()
+
+    def login(self):
+        '''
+        Action: Open the shell and get it ready for commands: enable (or expert/sudo on SFR) and
+        turn off paging. Whatever the device printed while we did that is discarded.
+        '''
+        run = self.client
+        with tracer.span('enable',self.name):
+            # Enable password, unless you're using a Unix device
+            if self.dtype not in nixList:
+                if self.dtype in sfrList:
+                    stdin, stdout, stderr = run.exec_command(('expert\nsudo -i\n'+self.pw+'\n'),bufsize=10000000)
+                    time.sleep(3)
+                elif self.dtype in sfrclishList:
+                    # CLIsh has no enable and doesn't take commands on an exec channel
+                    chan = run.invoke_shell()
+                    stdin, stdout, stderr = chan.makefile_stdin('wb'), chan.makefile('r'), chan.makefile_stderr('r')
+                    time.sleep(1)
+                else:
+                    stdin, stdout, stderr = run.exec_command(('enable\n'+self.enpw+'\n'),bufsize=10000000)
+                    time.sleep(1)
+            else:
+                stdin, stdout, stderr = run.exec_command('/bin/sh',bufsize=10000000)
+            self.stdin, self.stdout, self.stderr = stdin, stdout, stderr
+            self.drain()
+        with tracer.span('pager',self.name):
+            # Turn off paging on ASAs
+            if self.dtype in asaList:
+                self.run("terminal page 0",10)
+            # The command is different on IOS
+            # Note: I sanitized this elsewhere. If the syntax is different in NXOS,
+            # we need to add an elif when we add support.
+            elif self.dtype in iosList:
+                self.run("terminal length 0",10)
+            elif self.family in markerDevices:
+                self.run("",10)
+            else:
+                time.sleep(1)
+            self.drain()
+            self.learnPrompt()
+
+    def learnPrompt(self):
+        '''
+        Action: Send an empty line and remember the prompt the device answers with, so later commands
+        are only considered finished when this device's prompt comes back (and not when some line of
+        output happens to end in '#' or '>').
+        '''
+        self.prompt = None
+        self.hostname = None
+        if self.family in markerDevices:
+            return
+        output, finished = self.run('',10)
+        if finished:
+            self.prompt = output.replace('\r','').split('\n')[-1].rstrip(' ')
+            self.hostname = re.split('[#>/(]',self.prompt)[0]
+
+    def atPrompt(self,tail):
+        '''
+        Input: Tail end of the output read so far (string).
+        Output: True if the output ends with the device prompt.
+        '''
+        lastline = tail.replace('\r','').split('\n')[-1].rstrip(' ')
+        if lastline == self.prompt:
             return True
+        # The prompt can change under us (config mode, failover state), so anything that looks like a
+        # prompt for the same hostname also counts. Before we've learned it, any prompt-looking line does.
+        pattern = promptPatterns.get(self.family)
+        if pattern is None or pattern.match(lastline) is None:
+            return False
+        return self.hostname is None or lastline.startswith(self.hostname)
+
+    def run(self,cmd,timeout,tick=None,sink=None):
+        '''
+        Input: Command (string), seconds to wait for it (float), progress callback (optional), file-like
+        object to stream the output into as it arrives (optional).
+        Action: Send a command and read its output until the device prompt comes back. On Unix/SFR
+        shells an echoed marker stands in for the prompt (and is never written to the sink).
+        If the command times out, the rest of its output (and its prompt or marker) would still be on its way
+        and end up in the next command's output, so the shell is reopened (see reopen()).
+        Output: Tuple of (output (string), True if the command finished / False if we timed out). When
+        streaming into a sink, the output has already been written and '' is returned in its place.
+        '''
+        if self.family in markerDevices:
+            self.marker += 1
+            marker = 'TASC-EOC-' + str(self.marker)
+            self.stdin.write(cmd + '\necho ' + marker + '\n')
+            self.stdin.flush()
+            output, finished = readUntil(self.stdout.channel,lambda tail: (marker + '\n') in tail,timeout,tick,
+                                         sink,len(marker) + 1)
+            cut = output.rfind(marker)
+            if finished and cut >= 0:
+                output = output[:cut]
         else:
+            self.stdin.write(cmd + '\n')
+            self.stdin.flush()
+            output, finished = readUntil(self.stdout.channel,self.atPrompt,timeout,tick,sink)
+        if sink is not None:
+            sink.write(output)
+            output = ''
+        chan = self.stdout.channel
+        if not finished and not self.reopening and not (chan.closed or chan.exit_status_ready()):
+            with tracer.span('resync',self.name,cmd):
+                self.reopen()
+        return output, finished
+
+    def collect(self,cmd,seconds,tick=None,sink=None):
+        '''
+        Input: Command (string), seconds of output to collect (float), progress callback (optional), file-like
+        object to stream the output into as it arrives (optional).
+        Action: Send a command that never finishes on its own (debugs) and read whatever it prints.
+        Output: Output (string), or '' if it was streamed into a sink.
+        '''
+        self.stdin.write(cmd + '\n')
+        self.stdin.flush()
+        return readUntil(self.stdout.channel,lambda tail: False,seconds,tick,sink)[0]
+
+    def drain(self):
+        '''
+        Action: Throw away anything sitting in the channel (login banners, enable/pager echoes,
+        late output from the previous event) so it doesn't end up in the next command's output.
+        Output: Number of bytes discarded (int).
+        '''
+        n = 0
+        chan = self.stdout.channel
+        while chan.recv_ready():
+            n += len(chan.recv(65535))
+        return n
+
+    def isAlive(self):
+        '''
+        Output: True if the transport is up and the shell channel is still open, False otherwise.
+        '''
+        if self.client is None or self.stdout is None:
+            return False
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        chan = self.stdout.channel
+        if chan.closed or chan.exit_status_ready():
             return False
+        try:
+            # Cheap round trip through the socket; raises if the TCP session died underneath us
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def ensure(self,vb=False,log=None):
+        '''
+        Input: are we logging SSH verbosely? (boolean), log to write to (file).
+        Action: Reconnect if the session is gone, otherwise reuse it.
+        Output: True if the existing session was reused, False if we had to (re)connect.
+        '''
+        if self.isAlive():
+            stale = self.drain()
+            if vb == True and log is not None:
+                logNote(log,'Reusing SSH session to ' + self.ip + ':'
+                        + str(self.port) + ' (logins so far: ' + str(self.connects) + ', discarded '
+                        + str(stale) + ' stale bytes)\n\n')
+            return True
+        if vb == True and log is not None and self.connects > 0:
+            logNote(log,'SSH session to ' + self.ip + ':' + str(self.port) + ' was lost; reconnecting.\n\n')
+        self.connect()
+        if vb == True and log is not None:
+            logNote(log,'SSH connection established to ' + self.ip + ':' + str(self.port) + '\n\n')
+        return False
+
+    def reopen(self):
+        '''
+        Action: Close the shell channel (along with whatever a timed-out command is still printing into it) and
+        log in again on a new one over the same SSH connection, so the next command starts at a fresh prompt.
+        A dead connection is left for ensure() to notice and reconnect.
+        '''
+        self.stdout.channel.close()
+        self.stdin = self.stdout = self.stderr = None
+        self.reopening = True
+        try:
+            self.login()
+        finally:
+            self.reopening = False
+
+    def spawn(self):
+        '''
+        Output: New TaScSession with its own shell channel on this session's SSH transport, logged in the same
+        way (no new TCP connection or authentication). Closing it only closes its channel.
+        '''
+        shell = TaScSession(self.ip,self.user,self.pw,self.enpw,self.dtype,self.port,self.timeout,self.name)
+        shell.parent = self
+        shell.client = self.client
+        shell.login()
+        return shell
+
+    def canParallel(self,cmds):
+        '''
+        Output: True if the commands should be run side by side (see runParallel()).
+        '''
+        return parallelChannels > 1 and self.family in markerDevices and len(cmds) > 1
+
+    def runParallel(self,cmds,keep=captureLimit,parent=None):
+        '''
+        Input: Commands (list), characters of each output to keep for recorders (int), span to hang each
+        command's span off (Span, optional).
+        Action: Run independent commands at the same time, each on its own shell channel, up to
+        parallelChannels at once (this session's own shell is one of them). Extra shells are spawned the first
+        time they're needed and kept for later events (a shell whose command timed out has already been reopened
+        by run(); one whose channel died is closed and spawned again next time). Each output is spooled on its own (in memory up to
+        captureLimit characters, then in a temporary file) so ssh() can log them in order afterwards.
+        Output: List in the same order as cmds of (timestamp, start (epoch seconds), spool (file, rewound),
+        CaptureSink, finished (boolean), seconds).
+        '''
+        n = min(parallelChannels,len(cmds))
+        if n == 0:
+            return []
+        missing = n - 1 - len(self.shells)
+        if missing > 0:
+            # Logging in takes seconds on SFR, so the new shells log in at the same time too
+            with concurrent.futures.ThreadPoolExecutor(max_workers=missing) as pool:
+                self.shells.extend(pool.map(lambda i: self.spawn(),range(missing)))
+        free = queue.Queue()
+        for shell in [self] + self.shells[:n - 1]:
+            free.put(shell)
+        stale = []
+        def work(cmd):
+            shell = free.get()
+            stamp = str(datetime.datetime.now())
+            start = time.time()
+            spool = tempfile.SpooledTemporaryFile(max_size=captureLimit,mode='w+',encoding='utf-8',newline='')
+            sink = CaptureSink(spool,keep)
+            finished = False
+            try:
+                with tracer.span('command',self.name,cmd,parent) as span:
+                    output, finished = shell.run(cmd,cmdTimeout(cmd,shell.family),None,sink)
+                    span.nbytes = sink.nbytes
+                    if not finished:
+                        span.outcome = 'timeout'
+            finally:
+                if shell is self or shell.isAlive():
+                    free.put(shell)
+                else:
+                    stale.append(shell)
+            spool.seek(0)
+            return stamp, start, spool, sink, finished, time.time() - start
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=n) as pool:
+                results = list(pool.map(work,cmds))
+        finally:
+            for shell in stale:
+                self.shells.remove(shell)
+                shell.close()
+        return results
+
+    def close(self):
+        for shell in self.shells:
+            shell.close()
+        self.shells = []
+        if self.parent is not None:
+            # Spawned shells share the parent's client and only own their channel
+            if self.stdout is not None:
+                self.stdout.channel.close()
+        elif self.client is not None:
+            self.client.close()
+        self.client = None
+        self.stdin = self.stdout = self.stderr = None
+
+
+# What a recorder (see ssh()) is told about every command TaSc runs. time: timestamp string as it appears in
+# the log header, start: epoch seconds, device: session name, family: deviceFamily(), duration: seconds,
+# nbytes: characters of output, output: the output (only the first captureLimit characters),
+# pointer: where the full output lives ('path@offset'), finished: did the prompt come back?
+CommandRecord = collections.namedtuple('CommandRecord',['time','start','device','family','command','duration',
+                                                        'nbytes','output','pointer','finished'])
+
+class CaptureSink(object):
+    '''
+    Input: Log (file or GzipSegment), number of characters to keep (int).
+    Action: Sits between the channel reader and the log: everything is passed straight through to the
+    log, counted, and the first `limit` characters are kept for recorders.
+    '''
+    def __init__(self,log,limit=captureLimit):
+        self.log = log
+        self.limit = limit
+        self.nbytes = 0
+        self.kept = []
+        self.keptbytes = 0
+
+    def write(self,text):
+        self.log.write(text)
+        self.nbytes += len(text)
+        if self.keptbytes < self.limit:
+            self.kept.append(text[:self.limit - self.keptbytes])
+            self.keptbytes += len(self.kept[-1])
+
+    def text(self):
+        return ''.join(self.kept)
+
+def logPointer(log):
+    '''
+    Input: Log (file, GzipSegment or LogWriter) right after a command header has been written to it.
+    Output: 'path@offset' - where that command's output starts. For compressed segments the offset is
+    the start of the command's gzip member (see readSegmentMember()). A LogWriter hands back a
+    PendingPointer instead; call get() on it once the output is written.
+    '''
+    if isinstance(log,LogWriter):
+        return log.pointer()
+    if isinstance(log,GzipSegment):
+        return os.path.abspath(log.path) + '@' + str(log.memberOffset)
+    try:
+        log.flush()
+        return os.path.abspath(log.name) + '@' + str(log.tell())
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class NullBar(object):
+    '''
+    Stand-in for progressbar.ProgressBar when nobody is watching the bar.
+    '''
+    def update(self,value=None):
+        pass
+
+    def finish(self):
+        pass
+
+
+# ssh() is adapted from the work of Kirk Byers
+# see: https://pynet.twb-tech.com/blog/python/paramiko-ssh-part1.html
+def ssh(ip,user,pw,enpw,cmds,dtype,dbug,vb,port,tvalue,log,session=None,showbar=True,recorders=None,window=None):
+    '''
+    Input: IP address (string), username (string), password (string), enable password (string),
+    list of commands to run (list), device type (string), are we running a debug command? (boolean),
+    are we logging SSH verbosely? (boolean), ssh dest port(int), value for calculating progressbar time (int),
+    log to write to (file), persistent session to reuse (TaScSession, optional), draw a progress bar?
+    (boolean, optional - inventory mode runs many devices at once and turns it off), objects to tell
+    about every command that runs (list, optional; each one's record() is handed a CommandRecord), seconds
+    each debug command runs (optional, defaults to debugWindow).
+    Action: Log into an ASA, run commands, log commands, log out of ASA. If a debug command was run,
+    then at the end of the session we need to undebug all. If a session is passed in, it is reused
+    (and reconnected if it has died) and left open for the next event instead of being closed.
+    Output: Debug output to terminal, main output written to logfile. Returns a dict of how long
+    each command actually took, in seconds.
+    '''
+    #Initialize progress bar
+    if showbar == True:
+        pbar = progressbar.ProgressBar().start()
+    else:
+        pbar = NullBar()
+    pvalue=5
+    pbar.update(value=pvalue)
+    oneshot = session is None
+    if oneshot:
+        session = TaScSession(ip,user,pw,enpw,dtype,port)
+    with tracer.span('event',session.name) as event:
+        # initiate SSH connection (or pick up the one we already have)
+        try:
+            session.ensure(vb,log)
+            pvalue=10
+            pbar.update(value=pvalue)
+        except:
+            msg = ('\nSSH ERROR: Check credentials and target IP address, and verify that '
+                   'the target is configured to allow SSH access from this host.')
+            print(msg)
+            logNote(log,'Error establishing SSH connection to host. Terminating thread.\n\n')
+            sys.exit(0)
+        pvalue=15
+        pbar.update(value=pvalue)
+        # Move the bar along with the clock while we wait on the device
+        def tick(elapsed):
+            pbar.update(value=min(89,pvalue + elapsed*tvalue))
+        # Send commands to device
+        durations = {}
+        def finish(cmd,cmdstart,stamp,sink,pointer,finished,seconds):
+            nonlocal pvalue
+            log.write('\n')
+            if not finished:
+                logNote(log,'WARNING: prompt did not return within ' + str(cmdTimeout(cmd,session.family))
+                        + ' seconds; output above may be incomplete.\n')
+            event.nbytes += sink.nbytes
+            durations[cmd] = seconds
+            change = throttle.observe(session.name,session.family,cmd,seconds,finished,sink.text())
+            if change == 'busy':
+                logNote(log,'Throttling: ' + throttle.reason(throttle.state(session.name)) + '; skipping heavy '
+                        'commands and slowing down until it recovers.\n')
+            elif change == 'clear':
+                logNote(log,'Throttling: device load is back to normal; running every command again.\n')
+            costs.record(session.family,cmd,seconds,sink.nbytes,finished)
+            if recorders:
+                if isinstance(pointer,PendingPointer):
+                    pointer = pointer.get()
+                if sink.nbytes > sink.keptbytes:
+                    # Recorders read the rest of the output back out of the log, so it has to be written first
+                    # (and for a compressed segment, out of the compressor; see GzipSegment.sync())
+                    if isinstance(log,GzipSegment):
+                        log.sync()
+                    else:
+                        log.flush()
+                record = CommandRecord(stamp,cmdstart,session.name,session.family,cmd,durations[cmd],sink.nbytes,
+                                       sink.text(),pointer,finished)
+                for recorder in recorders:
+                    recorder.record(record)
+            pvalue = min(89,pvalue + durations[cmd]*tvalue)
+            pbar.update(value=pvalue)
+        def admit(cmd):
+            reason = throttle.admit(session.name,session.family,cmd)
+            if reason is not None:
+                logNote(log,'Skipped "' + cmd + '": ' + reason + '.\n','\n')
+            return reason is None
+        if session.canParallel(cmds):
+            # Every command on its own channel at once; outputs are logged afterwards, in command order
+            torun = [cmd for cmd in cmds if admit(cmd)]
+            keep = captureLimit if recorders or any([throttle.wants(session.family,cmd) for cmd in torun]) else 0
+            results = session.runParallel(torun,keep,event)
+            for cmd, (stamp, cmdstart, spool, sink, finished, seconds) in zip(torun,results):
+                logHeader(log,stamp,'Output',cmd)
+                pointer = logPointer(log) if recorders else None
+                shutil.copyfileobj(spool,log,readChunk)
+                spool.close()
+                finish(cmd,cmdstart,stamp,sink,pointer,finished,seconds)
+        else:
+            for cmd in cmds:
+                if not admit(cmd):
+                    continue
+                split3 = cmd.split(' ')
+                cmdstart = time.time()
+                stamp = str(datetime.datetime.now())
+                if split3[0] in debuglist:
+                    logHeader(log,stamp,'Debug output',cmd)
+                else:
+                    logHeader(log,stamp,'Output',cmd)
+                if recorders:
+                    pointer = logPointer(log)
+                    sink = CaptureSink(log)
+                else:
+                    # Still counted for the metrics, just not kept (unless the throttle reads it)
+                    pointer = None
+                    sink = CaptureSink(log,captureLimit if throttle.wants(session.family,cmd) else 0)
+                with tracer.span('command',session.name,cmd) as span:
+                    if split3[0] in debuglist:
+                        session.collect(cmd,window or debugWindow,tick,sink)
+                        finished = True
+                    else:
+                        output2, finished = session.run(cmd,cmdTimeout(cmd,session.family),tick,sink)
+                    span.nbytes = sink.nbytes
+                    if not finished:
+                        span.outcome = 'timeout'
+                finish(cmd,cmdstart,stamp,sink,pointer,finished,time.time() - cmdstart)
+        pbar.update(value=90)
+        if dbug == True:
+            with tracer.span('undebug',session.name,'undebug all'):
+                c_output2, finished = session.run('undebug all',10)
+            pbar.update(value=95)
+            if vb == True:
+                logNote(log,'Verifying undebug all:\n' + c_output2 + '\n')
+            else:
+                pass
+        else:
+            pass
+        pbar.update(value=99)
+        # Close connection and log success; persistent sessions stay up for the next event
+        if oneshot:
+            with tracer.span('close',session.name):
+                session.close()
+            if vb == True:
+                logNote(log,'Terminating SSH session gracefully. (This is part of normal operation).\n')
+            else:
+                pass
+        pbar.update(value=100)
+        pbar.finish()
+        return durations
+
+#
+# CONTINUOUS DEBUG CAPTURE
+#
+
+class TaScDebugCapture(object):
+    '''
+    Input: Logged-in session (TaScSession), debug commands (list), folder for the ring buffer (string),
+    most seconds to run (float), most bytes/second averaged over debugRateWindow (float), seconds and bytes
+    per log file before starting a new one (0 turns each limit off), are we logging verbosely? (boolean).
+    Action: Turn the debugs on once and keep reading for as long as the debug runs, instead of taking
+    debugWindow seconds of output per event and losing everything in between. Output is handed to a
+    background writer through a bounded queue and written to the folder's LogRing, starting a new file every
+    rotate seconds or bytes. When the disk falls behind and the queue fills up, the reader stops reading, so
+    the SSH window closes and the device holds (or drops) output instead of TaSc buffering it without limit.
+    If the session drops, it's reconnected and the debugs are turned back on, and the gap is noted in the log.
+    'undebug all' is sent when the debug hits its time or rate cap, on stop() and on Ctrl+C.
+    Output: run() returns a summary dict (see run()).
+    '''
+    def __init__(self,session,cmds,logdir='.',maxseconds=debugMaxSeconds,maxrate=debugMaxRate,
+                 rotateseconds=debugRotateSeconds,rotatebytes=debugRotateBytes,vb=False):
+        self.session = session
+        self.cmds = list(cmds)
+        self.logdir = logdir
+        self.maxseconds = maxseconds
+        self.maxrate = maxrate
+        self.rotateseconds = rotateseconds
+        self.rotatebytes = rotatebytes
+        self.vb = vb
+        self.queue = queue.Queue(maxsize=debugQueueChunks)
+        self.stopping = threading.Event()
+        self.error = None
+        self.nbytes = 0
+        self.files = 0
+        self.stalled = 0.0
+        self.reconnects = 0
+        self.reason = None
+
+    def note(self,text):
+        self.put('\n[' + str(datetime.datetime.now()) + '] ' + text + '\n')
+
+    def put(self,text):
+        '''
+        Action: Queue text for the writer, waiting for room (and counting the wait) if the disk is behind.
+        '''
+        started = time.monotonic()
+        self.queue.put(text)
+        self.stalled += time.monotonic() - started
+
+    def begin(self):
+        '''
+        Action: (Re)connect if the session is gone and turn the debugs on.
+        '''
+        self.session.ensure()
+        for cmd in self.cmds:
+            self.session.stdin.write(cmd + '\n')
+        self.session.stdin.flush()
+
+    def writer(self):
+        log = None
+        opened = 0
+        written = 0
+        while True:
+            text = self.queue.get()
+            if text is None:
+                break
+            if self.error is not None:
+                # Keep draining so the reader never blocks on a dead disk
+                continue
+            try:
+                if log is None or (self.rotateseconds > 0 and time.monotonic() - opened >= self.rotateseconds) or \
+                   (self.rotatebytes > 0 and written >= self.rotatebytes):
+                    if log is not None:
+                        log.close()
+                    log = newLog(self.logdir)
+                    logHeader(log,str(datetime.datetime.now()),'Debug output',', '.join(self.cmds))
+                    opened = time.monotonic()
+                    written = 0
+                    self.files += 1
+                log.write(text)
+                written += len(text)
+            except (OSError, ValueError) as e:
+                self.error = e
+        if log is not None:
+            try:
+                log.close()
+            except (OSError, ValueError) as e:
+                if self.error is None:
+                    self.error = e
+
+    def stop(self):
+        '''
+        Action: Ask a running capture to undebug and finish (from another thread).
+        '''
+        self.stopping.set()
+
+    def run(self):
+        '''
+        Action: Capture until a cap is hit, stop() is called or Ctrl+C, then undebug and flush the log.
+        Output: Dict with 'reason' (duration, rate, stopped, interrupted or error), 'seconds', 'bytes',
+        'files' written, 'reconnects', and 'stalled' (seconds spent waiting on the disk).
+        '''
+        thread = threading.Thread(target=self.writer,name='TaSc-debug')
+        thread.daemon = True
+        thread.start()
+        started = time.monotonic()
+        window = started
+        windowbytes = 0
+        with tracer.span('debug',self.session.name,', '.join(self.cmds)) as span:
+            try:
+                self.begin()
+                self.note('Debug started: ' + ', '.join(self.cmds))
+                if self.vb == True:
+                    self.note('Streaming from ' + self.session.ip + ':' + str(self.session.port) + ' (logins so far: ' +
+                              str(self.session.connects) + ')')
+                while self.reason is None:
+                    now = time.monotonic()
+                    if self.stopping.is_set():
+                        self.reason = 'stopped'
+                    elif self.maxseconds > 0 and now - started >= self.maxseconds:
+                        self.reason = 'duration'
+                    elif now - window >= debugRateWindow:
+                        if self.maxrate > 0 and windowbytes / (now - window) > self.maxrate:
+                            self.reason = 'rate'
+                        window = now
+                        windowbytes = 0
+                    if self.reason is not None:
+                        break
+                    chan = self.session.stdout.channel
+                    if chan.recv_ready():
+                        data = chan.recv(readChunk).decode('ISO-8859-1')
+                        self.nbytes += len(data)
+                        windowbytes += len(data)
+                        self.put(data)
+                    elif chan.closed or chan.exit_status_ready():
+                        self.reconnects += 1
+                        self.note('SSH session was lost; reconnecting and turning the debugs back on. '
+                                  'Output between the drop and this line is missing.')
+                        self.begin()
+                    else:
+                        select.select([chan],[],[],0.5)
+            except KeyboardInterrupt:
+                self.reason = 'interrupted'
+            except Exception as e:
+                self.reason = 'error'
+                self.note('Error during debug capture: ' + str(e))
+            span.nbytes = self.nbytes
+            if self.reason == 'rate':
+                self.note('WARNING: debug output ran above ' + str(self.maxrate) + ' bytes/second; sending undebug all.')
+            elif self.reason == 'duration':
+                self.note('Debug reached its ' + str(self.maxseconds) + ' second limit; sending undebug all.')
+            if self.session.isAlive():
+                try:
+                    output, finished = self.session.run('undebug all',10)
+                    self.put(output)
+                    self.note('undebug all sent.')
+                except Exception as e:
+                    self.note('ERROR: could not send undebug all (' + str(e) + '). Turn the debugs off by hand!')
+            else:
+                self.note('ERROR: session is down, so undebug all could not be sent. Turn the debugs off by hand!')
+            if self.reason not in ['stopped','duration']:
+                span.outcome = self.reason
+        self.queue.put(None)
+        thread.join()
+        return {'reason':self.reason,'seconds':time.monotonic() - started,'bytes':self.nbytes,'files':self.files,
+                'reconnects':self.reconnects,'stalled':self.stalled}
+
+#
+# SCHEDULING
+#
+
+# One scheduled event. n: event number (from 1), due: wall-clock time it was scheduled for (datetime),
+# wait: seconds until it's due, late: seconds it's starting late, missed: boundaries skipped or folded into it
+Tick = collections.namedtuple('Tick',['n','due','wait','late','missed'])
+
+class TaScScheduler(object):
+    '''
+    Input: Seconds between the start of each event (float; 0 = back to back, like TaSc always used to),
+    loop count (int, 0 = no limit), end time (datetime, optional), overrun policy (string), line events
+    up on wall-clock boundaries? (boolean).
+    Action: Start events at fixed boundaries instead of "whenever the last one finished", so samples
+    line up across runs and devices. With align on, boundaries are multiples of the interval counted
+    from local midnight (an interval of 300 fires at :00, :05, :10...). Deadlines are kept on the
+    monotonic clock as base + k*interval, so they don't drift however long the events take and don't
+    jump if the system clock is changed.
+    When an event runs past the next boundary, the overrun policy decides what happens:
+        skip     - drop the missed boundaries and wait for the next one
+        coalesce - run one event straight away in place of all of the missed ones, then get back on the grid
+        late     - run every missed event, back to back, until we've caught up
+    Output: iterate over the scheduler (it sleeps until each event is due) or call next() to get the
+    next Tick without sleeping. Stops after the loop count or at the end time, whichever comes first.
+    '''
+    def __init__(self,interval,count=0,endtime=None,policy='skip',align=True):
+        if policy not in overrunPolicies:
+            raise ValueError('Overrun policy must be one of ' + ', '.join(overrunPolicies))
+        self.interval = float(interval)
+        self.count = count
+        self.endtime = endtime
+        self.policy = policy
+        self.align = align
+        # Events handed out so far, and the index of the next boundary on the grid
+        self.n = 0
+        self.k = 0
+        # Boundary 0 on the monotonic clock and on the wall clock
+        self.base = None
+        self.wallbase = None
+
+    def start(self):
+        now = time.time()
+        mono = time.monotonic()
+        if self.interval > 0 and self.align == True:
+            midnight = datetime.datetime.combine(datetime.date.today(),datetime.time()).timestamp()
+            first = midnight + math.ceil((now - midnight) / self.interval) * self.interval
+        else:
+            first = now
+        self.wallbase = first
+        self.base = mono + (first - now)
+
+    def retime(self,interval):
+        '''
+        Input: New number of seconds between events.
+        Action: Switch to the new interval from the next event on (escalation triggers use this to poll
+        faster for a while), lined up on the clock again the same way as at the start.
+        '''
+        self.interval = float(interval)
+        self.start()
+        self.k = 0
+
+    def next(self):
+        '''
+        Output: Tick for the next event, or None once the loop count or end time has been reached.
+        '''
+        if self.base is None:
+            self.start()
+        if self.count != 0 and self.n >= self.count:
+            return None
+        mono = time.monotonic()
+        missed = 0
+        if self.interval <= 0:
+            due = mono
+        else:
+            due = self.base + self.k * self.interval
+            if mono - due > lateTolerance:
+                behind = int((mono - due) // self.interval)
+                if self.policy == 'skip':
+                    # Wait for the first boundary that's still ahead of us
+                    missed = behind + 1
+                    self.k += missed
+                    due = self.base + self.k * self.interval
+                elif self.policy == 'coalesce':
+                    # This event stands in for every boundary we've blown through
+                    missed = behind
+                    self.k += behind
+                    due = self.base + self.k * self.interval
+                # 'late' leaves k alone and works through the backlog one boundary at a time
+        wall = self.wallbase + (due - self.base)
+        if self.endtime is not None and wall >= self.endtime.timestamp():
+            return None
+        self.n += 1
+        if self.interval > 0:
+            self.k += 1
+        return Tick(self.n,datetime.datetime.fromtimestamp(wall),max(due - mono,0),max(mono - due,0),missed)
+
+    def __iter__(self):
+        while True:
+            tick = self.next()
+            if tick is None:
+                return
+            if tick.wait > 0:
+                time.sleep(tick.wait)
+            yield tick
+
+#
+# POST-PROCESSING POOL
+#
+
+class OffloadBuffer(object):
+    '''
+    Input: Output (string).
+    Action: Copy the output into a block of shared memory once, so a pool worker can read it from there;
+    only the block's name and size are pickled and sent down the pool's pipe. Whoever made the buffer
+    calls release() when no job needs it any more.
+    Output: text() gives the output back, in this process or a worker.
+    '''
+    def __init__(self,text):
+        data = text.encode('utf-8','surrogatepass')
+        self.size = len(data)
+        self.block = shared_memory.SharedMemory(create=True,size=max(self.size,1))
+        self.block.buf[:self.size] = data
+        self.name = self.block.name
+
+    def __getstate__(self):
+        return {'name':self.name,'size':self.size}
+
+    def __setstate__(self,state):
+        self.name = state['name']
+        self.size = state['size']
+        self.block = None
+
+    def text(self):
+        block = self.block or shared_memory.SharedMemory(name=self.name)
+        try:
+            with block.buf[:self.size] as view:
+                return str(view,'utf-8','surrogatepass')
+        finally:
+            if block is not self.block:
+                block.close()
+
+    def release(self):
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+class OffloadFile(object):
+    '''
+    Input: 'path@offset' pointer to an output in the logs (see logPointer()), its length in characters (int).
+    Action: Hand a worker an output that was too big to keep in memory as just its pointer; the worker reads
+    the output back out of the log itself.
+    '''
+    def __init__(self,pointer,nbytes=None):
+        self.pointer = pointer
+        self.nbytes = nbytes
+
+    def text(self):
+        return readPointer(self.pointer,self.nbytes)
+
+def offloadShare(text):
+    '''
+    Input: Output (string).
+    Output: What to hand to the pool for it: an OffloadBuffer if the pool is running and the output is at least
+    offloadShareBytes, else the string itself.
+    '''
+    if offload.executor is not None and len(text) >= offloadShareBytes:
+        try:
+            return OffloadBuffer(text)
+        except OSError:
+            pass
+    return text
+
+def offloadText(text):
+    '''
+    Output: The output a string, OffloadBuffer or OffloadFile stands for (string).
+    '''
+    if isinstance(text,str):
+        return text
+    return text.text()
+
+def offloadRelease(text):
+    if isinstance(text,OffloadBuffer):
+        text.release()
+
+class OffloadPool(object):
+    '''
+    Input: Worker processes (int; 0 = no pool), most jobs handed over and not yet delivered (int).
+    Action: Run the CPU-heavy work recorders do on captured output in worker processes, so it doesn't hold the
+    GIL while capture threads are reading SSH channels. submit(key,fn,args,done) runs fn(*args) in a worker and
+    calls done() with the result on the pool's delivery thread. Results for the same key (a device, say)
+    are delivered in the order they were submitted, however the workers finish. Once `inflight` jobs are
+    out, submit() waits for one to be delivered before handing over another. That wait is the
+    backpressure: the capture thread slows down instead of outputs piling up in memory. A failed job is
+    delivered as None (the error is kept in error). With no pool, or once the pool has broken, submit()
+    just runs fn and done in the calling thread.
+    '''
+    def __init__(self,workers=0,inflight=offloadInFlight):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(max(inflight,1))
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        # key -> [future, done] for every job handed over, in the order they were submitted
+        self.pending = {}
+        self.inflight = 0
+        self.ready = queue.Queue()
+        self.error = None
+        self.executor = None
+        if workers > 0:
+            # forkserver: workers start from a clean process rather than a fork of this busy, threaded one
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+            else:
+                context = multiprocessing.get_context()
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers,mp_context=context)
+            self.thread = threading.Thread(target=self.deliver,name='TaSc-offload')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def submit(self,key,fn,args,done):
+        if self.executor is not None:
+            started = time.monotonic()
+            self.slots.acquire()
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                metrics.observe('tasc_offload_wait_seconds',(),waited)
+            with self.lock:
+                try:
+                    future = self.executor.submit(fn,*args)
+                except RuntimeError as e:
+                    # BrokenProcessPool, or the interpreter is shutting down
+                    self.error = e
+                    future = None
+                else:
+                    self.pending.setdefault(key,collections.deque()).append([future,done])
+                    self.inflight += 1
+            if future is not None:
+                future.add_done_callback(lambda future: self.ready.put(key))
+                return
+            self.slots.release()
+            # Let whatever was already handed over be delivered first, so results still arrive in order
+            self.drain()
+        done(fn(*args))
+
+    def deliver(self):
+        while True:
+            key = self.ready.get()
+            if key is None:
+                return
+            while True:
+                with self.lock:
+                    jobs = self.pending.get(key)
+                    if not jobs or not jobs[0][0].done():
+                        break
+                    future, done = jobs.popleft()
+                    if len(jobs) == 0:
+                        del self.pending[key]
+                try:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.error = e
+                        result = None
+                    done(result)
+                except Exception as e:
+                    self.error = e
+                finally:
+                    self.slots.release()
+                    with self.lock:
+                        self.inflight -= 1
+                        self.idle.notify_all()
+
+    def drain(self):
+        '''
+        Action: Wait until every job handed over so far has been delivered.
+        '''
+        with self.lock:
+            while self.inflight > 0:
+                self.idle.wait()
+
+    def close(self):
+        if self.executor is None:
+            return
+        self.drain()
+        self.ready.put(None)
+        self.thread.join()
+        self.executor.shutdown()
+        self.executor = None
+
+# The pool every recorder hands its work to; startOffload() replaces it
+offload = OffloadPool(0)
+
+def startOffload(workers):
+    '''
+    Input: Worker processes (int; 0 = do the work in this process).
+    Action: Replace the offload pool with one of that size.
+    '''
+    global offload, offloadWorkers
+    offloadWorkers = max(workers,0)
+    offload.close()
+    offload = OffloadPool(offloadWorkers)
+
+def closeOffload():
+    offload.close()
+
+atexit.register(closeOffload)
+
+#
+# OUTPUT STORES
+#
+
+class SQLiteStore(object):
+    '''
+    Input: Path of the SQLite database (string), rows per transaction (int), seconds between commits
+    when it's quiet (float).
+    Action: Record every command TaSc runs as a row - timestamp, device, command, duration, bytes, and
+    either the output itself (up to sqliteInlineLimit characters) or a pointer to it in the logs - with
+    indexes on device, command and time. record() only drops the row on a queue; a background thread
+    does the inserts in batches, so the polling loop never waits on the database.
+    Output: Pass the store to ssh() as a recorder. Call close() at the end to flush what's left.
+    '''
+    schema = ['''CREATE TABLE IF NOT EXISTS commands (id INTEGER PRIMARY KEY, ts REAL, time TEXT, device TEXT,
+                 family TEXT, command TEXT, duration REAL, bytes INTEGER, finished INTEGER, output TEXT,
+                 pointer TEXT)''',
+              'CREATE INDEX IF NOT EXISTS commands_device ON commands (device, ts)',
+              'CREATE INDEX IF NOT EXISTS commands_command ON commands (command, ts)',
+              'CREATE INDEX IF NOT EXISTS commands_ts ON commands (ts)']
+
+    def __init__(self,path,batch=500,interval=2.0):
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        # Bounded so a wedged disk can't eat all our memory; at 10000 rows behind, record() waits.
+        self.queue = queue.Queue(maxsize=10000)
+        self.error = None
+        db = sqlite3.connect(path)
+        db.execute('PRAGMA journal_mode=WAL')
+        for statement in self.schema:
+            db.execute(statement)
+        db.commit()
+        db.close()
+        self.thread = threading.Thread(target=self.writer,name='TaSc-sqlite')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self,record):
+        if record.nbytes <= sqliteInlineLimit and len(record.output) == record.nbytes:
+            output = record.output
+        else:
+            output = None
+        self.queue.put((record.start,record.time,record.device,record.family,record.command,record.duration,
+                        record.nbytes,int(record.finished),output,record.pointer))
+
+    def writer(self):
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA synchronous=NORMAL')
+        rows = []
+        stopping = False
+        while not stopping:
+            deadline = time.time() + self.interval
+            while len(rows) < self.batch:
+                try:
+                    row = self.queue.get(timeout=max(deadline - time.time(),0.01))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+            if len(rows) > 0:
+                try:
+                    db.executemany('INSERT INTO commands (ts, time, device, family, command, duration, bytes, '
+                                   'finished, output, pointer) VALUES (?,?,?,?,?,?,?,?,?,?)',rows)
+                    db.commit()
+                except sqlite3.Error as e:
+                    self.error = e
+                rows = []
+        db.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+def queryStore(path,device=None,command=None,start=None,end=None):
+    '''
+    Input: Path of a TaSc SQLite database (string), device name, text the command has to contain,
+    earliest and latest time (datetime) - all optional.
+    Output: List of matching rows as dicts, oldest first.
+    '''
+    sql = 'SELECT ts, time, device, family, command, duration, bytes, finished, output, pointer FROM commands WHERE 1=1'
+    params = []
+    if device is not None:
+        sql += ' AND device = ?'
+        params.append(device)
+    if command is not None:
+        sql += ' AND command LIKE ?'
+        params.append('%' + command + '%')
+    if start is not None:
+        sql += ' AND ts >= ?'
+        params.append(start.timestamp())
+    if end is not None:
+        sql += ' AND ts <= ?'
+        params.append(end.timestamp())
+    sql += ' ORDER BY ts'
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    rows = [dict(row) for row in db.execute(sql,params)]
+    db.close()
+    return rows
+
+class HistoryStore(object):
+    '''
+    Input: Folder to keep the history in (string).
+    Action: Keep every output of every (device, command) pair without storing the same text twice.
+    Outputs are stored as content-addressed blobs (zlib-compressed, named by their SHA-256) plus line
+    deltas against the previous output of the same command on the same device. Every event appends one
+    line to the stream's journal (streams/<device>/<command>.jsonl):
+        same  - identical to the last output; only the hash is written
+        ref   - identical to an output we already have a blob for
+        full  - a new blob (first output, every historyKeyframe deltas, or when a delta wouldn't save much)
+        delta - line operations that turn the previous output into this one
+    Like SQLiteStore, record() only queues the output; writing happens on a background thread, and hashing,
+    diffing and compressing in the offload pool (see historyWork()).
+    Output: Pass the store to ssh() as a recorder. Read it back with HistoryReader.
+    '''
+    def __init__(self,root):
+        self.root = root
+        for folder in ['blobs','streams']:
+            if not os.path.exists(os.path.join(root,folder)):
+                os.makedirs(os.path.join(root,folder))
+        # Per stream: [last hash, events so far, deltas since the last blob, journal file]
+        self.streams = {}
+        # Per stream: the last output handed to the pool (string, OffloadBuffer or OffloadFile); the next one is
+        # diffed against it, so it's only released once that one is done
+        self.last = {}
+        self.queue = queue.Queue(maxsize=1000)
+        self.error = None
+        self.thread = threading.Thread(target=self.writer,name='TaSc-history')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self,record):
+        self.queue.put(record)
+
+    def writer(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            try:
+                self.store(record)
+            except (OSError, ValueError) as e:
+                self.error = e
+        offload.drain()
+        for text in self.last.values():
+            offloadRelease(text)
+        for stream in self.streams.values():
+            stream[3].close()
+
+    def store(self,record):
+        if len(record.output) < record.nbytes and record.pointer is not None:
+            # Too big to have been kept in memory; the worker goes back to the log for the whole thing
+            text = OffloadFile(record.pointer,record.nbytes)
+        else:
+            text = offloadShare(record.output)
+        key = (record.device,record.command)
+        last = self.last.get(key)
+        self.last[key] = text
+        offload.submit(('history',) + key,historyWork,(last,text),
+                       lambda result: self.journal(record,last,text,result))
+
+    def journal(self,record,last,text,result):
+        '''
+        Input: CommandRecord, the stream's previous output and this one (as handed to historyWork()), and what
+        historyWork() made of them (None if it failed).
+        Action: Write the event to the stream's journal, and its blob if it needs one.
+        '''
+        offloadRelease(last)
+        stream = self.stream(record.device,record.command)
+        lasthash, n, deltas, journal = stream
+        if result is None:
+            # Nothing to diff the next output against
+            stream[0] = None
+            return
+        nbytes, digest, delta, blob = result
+        entry = {'n':n + 1,'time':record.time,'hash':digest,'bytes':nbytes}
+        if digest == lasthash:
+            entry['kind'] = 'same'
+        elif os.path.exists(self.blobPath(digest)):
+            entry['kind'] = 'ref'
+            deltas = 0
+        elif delta is not None and lasthash is not None and deltas < historyKeyframe:
+            entry['kind'] = 'delta'
+            entry['base'] = lasthash
+            entry['delta'] = delta
+            deltas += 1
+        else:
+            if blob is None:
+                blob = zlib.compress(offloadText(text).encode('utf-8'))
+            self.writeBlob(digest,blob)
+            entry['kind'] = 'full'
+            deltas = 0
+        journal.write(json.dumps(entry) + '\n')
+        journal.flush()
+        self.streams[(record.device,record.command)] = [digest,n + 1,deltas,journal]
+
+    def stream(self,device,command):
+        key = (device,command)
+        if key not in self.streams:
+            path = historyPath(self.root,device,command)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            n = 0
+            if os.path.exists(path):
+                with open(path) as f:
+                    n = sum(1 for line in f)
+            # We don't know what the last output was, so the first one we see gets a full blob
+            self.streams[key] = [None,n,0,open(path,'a')]
+        return self.streams[key]
+
+    def blobPath(self,digest):
+        return os.path.join(self.root,'blobs',digest[:2],digest)
+
+    def writeBlob(self,digest,blob):
+        '''
+        Input: SHA-256 of the output, the output zlib-compressed (bytes).
+        '''
+        path = self.blobPath(digest)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.tmp','wb') as f:
+            f.write(blob)
+        os.replace(path + '.tmp',path)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+def historyWork(last,text):
+    '''
+    Input: A history stream's previous output (None if HistoryStore hasn't seen one) and this output (string,
+    OffloadBuffer or OffloadFile).
+    Action: HistoryStore's CPU-heavy part, done in the offload pool: hash the output, diff it against the
+    previous one, and compress it if a delta wouldn't save much.
+    Output: (characters, SHA-256, line delta or None, zlib-compressed output or None).
+    '''
+    text = offloadText(text)
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    delta = None
+    if last is not None:
+        last = offloadText(last)
+        if last == text:
+            return len(text), digest, None, None
+        delta = lineDelta(last,text)
+        if len(json.dumps(delta)) > len(text) / 2:
+            delta = None
+    blob = zlib.compress(text.encode('utf-8')) if delta is None else None
+    return len(text), digest, delta, blob
+
+def historyPath(root,device,command):
+    '''
+    Output: Path of the journal for one (device, command) stream in a history folder.
+    '''
+    return os.path.join(root,'streams',re.sub(r'[^\w\-.]+','_',device),re.sub(r'[^\w\-.]+','_',command) + '.jsonl')
+
+def lineDelta(old,new):
+    '''
+    Input: Previous output, new output (strings).
+    Output: List of operations that rebuild new from old: ['=', i, j] copies lines i..j-1 of old,
+    ['+', [lines]] inserts new lines. Lines keep their line endings, so the rebuild is exact.
+    '''
+    a = old.splitlines(True)
+    b = new.splitlines(True)
+    delta = []
+    for op, i1, i2, j1, j2 in difflib.SequenceMatcher(None,a,b,autojunk=False).get_opcodes():
+        if op == 'equal':
+            delta.append(['=',i1,i2])
+        elif op in ('replace','insert'):
+            delta.append(['+',b[j1:j2]])
+    return delta
+
+def applyDelta(old,delta):
+    '''
+    Input: Previous output (string), delta from lineDelta() against it (list).
+    Output: The output the delta was made from (string).
+    '''
+    a = old.splitlines(True)
+    parts = []
+    for op in delta:
+        if op[0] == '=':
+            parts.extend(a[op[1]:op[2]])
+        else:
+            parts.extend(op[1])
+    return ''.join(parts)
+
+class HistoryReader(object):
+    '''
+    Input: History folder written by HistoryStore (string).
+    Action: Read a stream's journal and rebuild outputs from its blobs and deltas.
+    '''
+    def __init__(self,root):
+        self.root = root
+
+    def streams(self):
+        '''
+        Output: List of (device folder, command file name) for every stream in the history.
+        '''
+        found = []
+        top = os.path.join(self.root,'streams')
+        for device in sorted(os.listdir(top)):
+            for name in sorted(os.listdir(os.path.join(top,device))):
+                found.append((device,name[:-len('.jsonl')]))
+        return found
+
+    def events(self,device,command):
+        '''
+        Output: List of journal entries for a stream, oldest first.
+        '''
+        with open(historyPath(self.root,device,command)) as f:
+            return [json.loads(line) for line in f if line.strip() != '']
+
+    def changes(self,device,command):
+        '''
+        Output: Journal entries for only the events where the output changed.
+        '''
+        return [entry for entry in self.events(device,command) if entry['kind'] != 'same']
+
+    def blob(self,digest):
+        '''
+        Input: SHA-256 of an output that has a blob.
+        Output: The output (string), decompressed.
+        '''
+        with open(os.path.join(self.root,'blobs',digest[:2],digest),'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def rebuild(self,device,command,n):
+        '''
+        Input: Device, command, event number (int, from the journal's 'n').
+        Action: Start from the nearest blob at or before the event and replay deltas forward.
+        Output: That event's full output (string).
+        '''
+        events = self.events(device,command)
+        target = [i for i in range(len(events)) if events[i]['n'] == n]
+        if len(target) == 0:
+            raise KeyError('No event ' + str(n) + ' for ' + device + ' "' + command + '"')
+        start = target[0]
+        while events[start]['kind'] not in ('full','ref'):
+            start -= 1
+        text = self.blob(events[start]['hash'])
+        for entry in events[start + 1:target[0] + 1]:
+            if entry['kind'] == 'delta':
+                text = applyDelta(text,entry['delta'])
+            elif entry['kind'] in ('full','ref'):
+                text = self.blob(entry['hash'])
+        return text
+
+def readPointer(pointer,nbytes=None):
+    '''
+    Input: 'path@offset' pointer from a CommandRecord / the SQLite store, length of the output in characters
+    (int, optional; the record's nbytes).
+    Output: The command output it points at (string), read from the text log or compressed segment. With the
+    length that's exactly the output; without it, reading stops at the first line TaSc wrote itself (the next
+    header, or a note such as a timeout warning) and drops the newline ssh() writes after every output.
+    '''
+    path, offset = pointer.rsplit('@',1)
+    if path.endswith('.gz'):
+        text = readSegmentMember(path,int(offset))
+        # The member starts with the command header; drop it
+        text = text.split('":\n',1)[-1]
+        if nbytes is not None:
+            return text[:nbytes]
+        lines = trimOutput(text.splitlines(True))
+    else:
+        with open(path,newline='') as f:
+            f.seek(int(offset))
+            if nbytes is not None:
+                return f.read(nbytes)
+            lines = trimOutput(f)
+    text = ''.join(lines)
+    return text[:-1] if text.endswith('\n') else text
+
+def trimOutput(lines):
+    '''
+    Input: Lines of a log starting at a command's output (iterable).
+    Output: List of the lines up to the first one TaSc wrote itself (see logNotePattern).
+    '''
+    output = []
+    for line in lines:
+        if logNotePattern.match(line):
+            break
+        output.append(line)
+    return output
+
+def closeRecorders(recorders):
+    '''
+    Action: Flush and close every recorder that needs it (SQLite store etc.).
+    '''
+    for recorder in recorders:
+        if hasattr(recorder,'close'):
+            recorder.close()
+
+#
+# OUTPUT PARSERS AND TIME SERIES
+#
+
+# (device family, expanded command) -> function that takes the output and returns {field: number}
+outputParsers = {}
+
+def normalizeCmd(cmd):
+    '''
+    Output: Command lowercased, with extra spaces dropped and 'sh'/'sho' expanded to 'show'.
+    '''
+    split = cmd.split()
+    if len(split) > 0 and split[0] in showlist:
+        split[0] = 'show'
+    return ' '.join(split).lower()
+
+def registerParser(families,command):
+    '''
+    Input: Device families the parser understands (list), command it parses (string; 'sh' is fine).
+    Action: Decorator that adds the function to outputParsers. findParser() matches on the start of the
+    command, so a parser for 'show interface' also gets 'show interface outside'.
+    '''
+    def register(function):
+        for family in families:
+            outputParsers[(family,normalizeCmd(command))] = function
+        return function
+    return register
+
+def findParser(family,cmd):
+    '''
+    Output: The parser for the longest registered command that the command starts with, or None.
+    Keywords can be abbreviated the way the device allows, so 'sh int outside' gets 'show interface'.
+    '''
+    words = normalizeCmd(cmd).split()
+    best = None
+    for (pfamily, pcmd), function in outputParsers.items():
+        pwords = pcmd.split()
+        if pfamily != family or len(words) < len(pwords):
+            continue
+        if all([pwords[i].startswith(words[i]) for i in range(len(pwords))]):
+            if best is None or len(pwords) > len(best[0]):
+                best = (pwords,function)
+    return None if best is None else best[1]
+
+def parseOutput(family,cmd,text):
+    '''
+    Input: Device family, command, its output (string or OffloadBuffer).
+    Action: Run the output through its parser (see findParser()); SeriesStore does this in the offload pool.
+    Output: {field: number}, or {} if there's no parser or it couldn't make sense of the output.
+    '''
+    parser = findParser(family,cmd)
+    if parser is None:
+        return {}
+    try:
+        return parser(offloadText(text))
+    except (ValueError, IndexError):
+        return {}
+
+@registerParser(['asa'],'show cpu')
+@registerParser(['asa'],'show cpu usage')
+def parseAsaCpu(text):
+    # CPU utilization for 5 seconds = 1%; 1 minute: 2%; 5 minutes: 3%
+    match = re.search(r'5 seconds = (\d+)%; 1 minute: (\d+)%; 5 minutes: (\d+)%',text)
+    if match is None:
+        return {}
+    return {'cpu.5s':float(match.group(1)),'cpu.1m':float(match.group(2)),'cpu.5m':float(match.group(3))}
+
+@registerParser(['ios'],'show processes cpu')
+def parseIosCpu(text):
+    # CPU utilization for five seconds: 3%/0%; one minute: 2%; five minutes: 1%
+    match = re.search(r'five seconds: (\d+)%(?:/(\d+)%)?; one minute: (\d+)%; five minutes: (\d+)%',text)
+    if match is None:
+        return {}
+    fields = {'cpu.5s':float(match.group(1)),'cpu.1m':float(match.group(3)),'cpu.5m':float(match.group(4))}
+    if match.group(2) is not None:
+        fields['cpu.5s_interrupt'] = float(match.group(2))
+    return fields
+
+@registerParser(['asa'],'show memory')
+def parseAsaMemory(text):
+    # Free memory:        3000000000 bytes (70%)
+    fields = {}
+    for name, value, pct in re.findall(r'(Free|Used|Total) memory:\s+(\d+) bytes(?: \(\s*(\d+)%\))?',text):
+        fields['mem.' + name.lower()] = float(value)
+        if pct != '':
+            fields['mem.' + name.lower() + '_pct'] = float(pct)
+    return fields
+
+@registerParser(['asa'],'show conn count')
+def parseAsaConnCount(text):
+    # 15 in use, 1234 most used
+    match = re.search(r'(\d+) in use, (\d+) most used',text)
+    if match is None:
+        return {}
+    return {'conn.in_use':float(match.group(1)),'conn.most_used':float(match.group(2))}
+
+@registerParser(['asa'],'show asp drop')
+def parseAsaAspDrop(text):
+    #   No route to host (no-route)                                             1234
+    fields = {}
+    total = 0.0
+    for name, count in re.findall(r'^\s+.+? \(([\w\-]+)\)\s+(\d+)\s*$',text,re.M):
+        fields['asp_drop.' + name] = fields.get('asp_drop.' + name,0.0) + float(count)
+        total += float(count)
+    if len(fields) > 0:
+        fields['asp_drop.total'] = total
+    return fields
+
+@registerParser(['asa','ios'],'show interface')
+def parseInterfaces(text):
+    # Interface GigabitEthernet0/0 "outside", is up, ...   (ASA)
+    # GigabitEthernet0/0 is up, line protocol is up        (IOS)
+    #         1234 packets input, 567890 bytes, 0 no buffer
+    #         0 input errors, 0 CRC, 0 frame, 0 overrun, 0 ignored, 0 abort
+    #         2345 packets output, 678901 bytes, 0 underruns
+    #         0 output errors, 0 collisions, 0 interface resets
+    counters = [(r'(\d+) packets input, (\d+) bytes',['in_packets','in_bytes']),
+                (r'(\d+) packets output, (\d+) bytes',['out_packets','out_bytes']),
+                (r'(\d+) input errors',['in_errors']),
+                (r'(\d+) output errors',['out_errors']),
+                (r'(\d+) packets dropped',['drops'])]
+    fields = {}
+    ifc = None
+    for line in text.splitlines():
+        header = re.match(r'^(?:Interface )?([A-Za-z][\w\-/.:]*\d)(?: "([^"]*)")?,? is ',line)
+        if header is not None:
+            ifc = header.group(2) if header.group(2) else header.group(1)
+            continue
+        if ifc is None:
+            continue
+        for pattern, names in counters:
+            match = re.search(pattern,line)
+            if match is None:
+                continue
+            for i in range(len(names)):
+                # ASA repeats some counters under "Traffic Statistics"; the first ones are the interface's own
+                key = 'if.' + ifc + '.' + names[i]
+                if key not in fields:
+                    fields[key] = float(match.group(i + 1))
+    return fields
+
+@registerParser(['unix','sfr'],'uptime')
+def parseUptime(text):
+    # load average: 0.10, 0.20, 0.30
+    match = re.search(r'load averages?: ([\d.]+),? ([\d.]+),? ([\d.]+)',text)
+    if match is None:
+        return {}
+    return {'load.1m':float(match.group(1)),'load.5m':float(match.group(2)),'load.15m':float(match.group(3))}
+
+class TimeSeries(object):
+    '''
+    Action: One numeric field over time, kept in two parallel array('d')s (timestamps and values) rather
+    than lists of objects, so a long capture costs 16 bytes a sample. Timestamps are expected to arrive
+    in order; windows are found by bisecting the timestamps, and summaries work on array slices.
+    '''
+    def __init__(self):
+        self.times = array.array('d')
+        self.values = array.array('d')
+
+    def append(self,when,value):
+        self.times.append(when)
+        self.values.append(value)
+
+    def window(self,start=None,end=None):
+        '''
+        Input: Earliest and latest epoch seconds (float, optional).
+        Output: (times, values) array slices for the window.
+        '''
+        lo = 0 if start is None else bisect.bisect_left(self.times,start)
+        hi = len(self.times) if end is None else bisect.bisect_right(self.times,end)
+        return self.times[lo:hi], self.values[lo:hi]
+
+    def summary(self,start=None,end=None,percentiles=(50,90,99)):
+        '''
+        Input: Window (epoch seconds, optional), percentiles to work out (list of numbers 0-100).
+        Output: Dict with count, first, last, min, max, mean, rate (change per second from first to last
+        sample, with counter resets skipped) and p<N> for each percentile (nearest rank); {} if no samples.
+        '''
+        times, values = self.window(start,end)
+        if len(values) == 0:
+            return {}
+        ordered = sorted(values)
+        result = {'count':len(values),'first':values[0],'last':values[-1],'min':ordered[0],'max':ordered[-1],
+                  'mean':sum(values) / len(values),'rate':None}
+        if len(values) > 1 and times[-1] > times[0]:
+            steps = [values[i] - values[i - 1] for i in range(1,len(values))]
+            if min(steps) < 0:
+                # Counter got cleared mid-window: count the increases only, so the rate doesn't go negative
+                result['rate'] = sum([step for step in steps if step > 0]) / (times[-1] - times[0])
+            else:
+                result['rate'] = (values[-1] - values[0]) / (times[-1] - times[0])
+        for pct in percentiles:
+            rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1,0)
+            result['p' + str(pct)] = ordered[rank]
+        return result
+
+class SeriesStore(object):
+    '''
+    Input: File to save the series to every seriesSaveSeconds and when the store is closed (string, optional).
+    Action: Recorder that runs each captured output through its parser (if there is one for the device
+    type and command) and appends the numbers to a TimeSeries per (device, field), so trends can be
+    read without going back through the logs. Parsing is done in the offload pool (see parseOutput()).
+    Output: series(device, field), fields(device) and summary(); save()/loadSeries() to keep them.
+    '''
+    def __init__(self,path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+        self.saved = time.monotonic()
+
+    def record(self,record):
+        if findParser(record.family,record.command) is None:
+            return
+        text = offloadShare(record.output)
+        offload.submit(('series',record.device),parseOutput,(record.family,record.command,text),
+                       lambda fields: self.add(record.device,record.start,fields,text))
+
+    def add(self,device,when,fields,text):
+        offloadRelease(text)
+        if not fields:
+            return
+        with self.lock:
+            for field, value in fields.items():
+                key = (device,field)
+                if key not in self.data:
+                    self.data[key] = TimeSeries()
+                self.data[key].append(when,value)
+            due = self.path is not None and time.monotonic() - self.saved >= seriesSaveSeconds
+            if due:
+                self.saved = time.monotonic()
+        if due:
+            try:
+                self.save()
+            except OSError:
+                # Tried again next time, and at close()
+                pass
+
+    def series(self,device,field):
+        return self.data.get((device,field))
+
+    def fields(self,device=None):
+        with self.lock:
+            return sorted([key for key in self.data if device is None or key[0] == device])
+
+    def summary(self,device=None,field=None,start=None,end=None):
+        '''
+        Output: {(device, field): TimeSeries.summary()} for every series that matches (field matches on
+        the start of the name, so 'if.outside' gets all of outside's counters).
+        '''
+        result = {}
+        for key in self.fields(device):
+            if field is None or key[1].startswith(field):
+                result[key] = self.data[key].summary(start,end)
+        return result
+
+    def save(self,path=None):
+        path = path or self.path
+        with self.lock:
+            data = [{'device':key[0],'field':key[1],'times':list(ts.times),'values':list(ts.values)}
+                    for key, ts in sorted(self.data.items())]
+            self.saved = time.monotonic()
+        with open(path + '.tmp','w') as f:
+            json.dump(data,f)
+        os.replace(path + '.tmp',path)
+
+    def close(self):
+        offload.drain()
+        if self.path is not None and len(self.data) > 0:
+            self.save()
+
+def loadSeries(path):
+    '''
+    Input: File written by SeriesStore.save().
+    Output: SeriesStore with the series loaded.
+    '''
+    store = SeriesStore()
+    with open(path) as f:
+        for item in json.load(f):
+            ts = TimeSeries()
+            ts.times.extend(item['times'])
+            ts.values.extend(item['values'])
+            store.data[(item['device'],item['field'])] = ts
+    return store
+
+#
+# METRICS
+#
+
+# name -> (type, help text, histogram buckets)
+metricTypes = collections.OrderedDict([
+    ('tasc_connects_total',('counter','SSH logins (first connection and every reconnect).',None)),
+    ('tasc_connect_seconds',('histogram','Time to open the SSH connection and authenticate.',metricTimeBuckets)),
+    ('tasc_enable_seconds',('histogram','Time to enable (or expert/sudo on SFR) and turn off paging.',
+                                        metricTimeBuckets)),
+    ('tasc_errors_total',('counter','Failed connections (kind="connect") and events that ended in an error '
+                                    '(kind="event").',None)),
+    ('tasc_events_total',('counter','TaSc events started.',None)),
+    ('tasc_events_missed_total',('counter','Scheduled event starts skipped or coalesced because an event overran.',
+                                           None)),
+    ('tasc_schedule_slip_seconds',('histogram','How late each event started compared to its scheduled time.',
+                                               metricTimeBuckets)),
+    ('tasc_commands_total',('counter','Commands run.',None)),
+    ('tasc_command_seconds',('histogram','Time from sending a command to its prompt coming back (or its debug '
+                                         'window ending).',metricTimeBuckets)),
+    ('tasc_command_bytes',('histogram','Output received per command.',metricByteBuckets)),
+    ('tasc_received_bytes_total',('counter','Output received.',None)),
+    ('tasc_command_timeouts_total',('counter','Commands whose prompt did not come back before their timeout.',
+                                              None)),
+    ('tasc_commands_skipped_total',('counter','Heavy commands skipped because the device was busy (see '
+                                              'TaScThrottle).',None)),
+    ('tasc_triggers_total',('counter','Escalation triggers that fired (see TriggerWatch).',None)),
+    ('tasc_throttle_wait_seconds',('histogram','Time a command waited on the throttle before it was sent.',
+                                               metricTimeBuckets)),
+    ('tasc_offload_wait_seconds',('histogram','Time spent waiting for room in the offload pool (see OffloadPool).',
+                                              metricTimeBuckets)),
+])
+
+class TaScMetrics(object):
+    '''
+    Action: Counters and histograms (see metricTypes) for everything TaSc does, labeled by device and,
+    for per-command metrics, command. Sessions, ssh() and the schedulers update the module's `metrics`
+    as they go; prometheus() and snapshot() read it out, and MetricsServer serves both over HTTP.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # (name, ((label, value), ...)) -> number, or [bucket counts, sum, count] for histograms
+        self.values = collections.OrderedDict()
+
+    def inc(self,name,labels,value=1):
+        key = (name,tuple(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key,0) + value
+
+    def observe(self,name,labels,value):
+        buckets = metricTypes[name][2]
+        key = (name,tuple(labels))
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(buckets),0.0,0]
+            hist = self.values[key]
+            for i in range(len(buckets)):
+                if value <= buckets[i]:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def command(self,device,cmd,seconds,nbytes,finished):
+        labels = (('device',device),('command',cmd))
+        self.inc('tasc_commands_total',labels)
+        self.observe('tasc_command_seconds',labels,seconds)
+        self.observe('tasc_command_bytes',labels,nbytes)
+        self.inc('tasc_received_bytes_total',labels,nbytes)
+        if not finished:
+            self.inc('tasc_command_timeouts_total',labels)
+
+    def event(self,device,tick):
+        labels = (('device',device),)
+        self.inc('tasc_events_total',labels)
+        self.observe('tasc_schedule_slip_seconds',labels,tick.late)
+        if tick.missed > 0:
+            self.inc('tasc_events_missed_total',labels,tick.missed)
+
+    def error(self,device,kind):
+        self.inc('tasc_errors_total',(('device',device),('kind',kind)))
+
+    def span(self,span):
+        '''
+        Action: Take connection, login and command timings from a finished Span (see TaScTracer).
+        '''
+        labels = (('device',span.device),)
+        if span.name == 'connect':
+            if span.outcome == 'error':
+                self.error(span.device,'connect')
+            elif span.outcome == 'ok':
+                self.observe('tasc_connect_seconds',labels,span.duration)
+                self.inc('tasc_connects_total',labels)
+        elif span.name == 'login' and span.outcome == 'ok':
+            self.observe('tasc_enable_seconds',labels,span.duration)
+        elif span.name == 'command' and span.outcome in ['ok','timeout']:
+            self.command(span.device,span.command,span.duration,span.nbytes,span.outcome == 'ok')
+
+    def prometheus(self):
+        '''
+        Output: Every metric in the Prometheus text exposition format (string).
+        '''
+        def labeltext(labels,extra=()):
+            pairs = [name + '="' + str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n') + '"'
+                     for name, value in tuple(labels) + tuple(extra)]
+            return '{' + ','.join(pairs) + '}' if len(pairs) > 0 else ''
+        with self.lock:
+            items = [(key,value if not isinstance(value,list) else [list(value[0]),value[1],value[2]])
+                     for key, value in self.values.items()]
+        lines = []
+        for name, (kind, text, buckets) in metricTypes.items():
+            lines.append('# HELP ' + name + ' ' + text)
+            lines.append('# TYPE ' + name + ' ' + kind)
+            for (mname, labels), value in items:
+                if mname != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(name + labeltext(labels) + ' ' + repr(float(value)))
+                    continue
+                for i in range(len(buckets)):
+                    lines.append(name + '_bucket' + labeltext(labels,(('le',repr(float(buckets[i]))),)) + ' ' +
+                                 str(value[0][i]))
+                lines.append(name + '_bucket' + labeltext(labels,(('le','+Inf'),)) + ' ' + str(value[2]))
+                lines.append(name + '_sum' + labeltext(labels) + ' ' + repr(float(value[1])))
+                lines.append(name + '_count' + labeltext(labels) + ' ' + str(value[2]))
+        lines.append('# HELP tasc_uptime_seconds Seconds since TaSc started collecting metrics.')
+        lines.append('# TYPE tasc_uptime_seconds gauge')
+        lines.append('tasc_uptime_seconds ' + repr(time.time() - self.started))
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        '''
+        Output: Every metric as a JSON-friendly dict: {'time', 'uptime', 'metrics': [{'name', 'type',
+        'labels', 'value'} for counters, or with 'count', 'sum' and cumulative 'buckets' for histograms]}.
+        '''
+        metrics = []
+        with self.lock:
+            for (name, labels), value in self.values.items():
+                kind, text, buckets = metricTypes[name]
+                entry = {'name':name,'type':kind,'labels':dict(labels)}
+                if kind == 'counter':
+                    entry['value'] = value
+                else:
+                    entry['count'] = value[2]
+                    entry['sum'] = value[1]
+                    entry['buckets'] = [[buckets[i],value[0][i]] for i in range(len(buckets))]
+                metrics.append(entry)
+        return {'time':str(datetime.datetime.now()),'uptime':time.time() - self.started,'metrics':metrics}
+
+# What this process has done so far
+metrics = TaScMetrics()
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Action: GET /metrics returns the Prometheus text format, GET /metrics.json the JSON snapshot.
+    '''
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body = metrics.prometheus().encode('utf-8')
+            ctype = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/metrics.json':
+            body = json.dumps(metrics.snapshot()).encode('utf-8')
+            ctype = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type',ctype)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        # Scrapes every few seconds would bury the console
+        pass
+
+class MetricsServer(socketserver.ThreadingMixIn,http.server.HTTPServer):
+    daemon_threads = True
+
+def startMetrics(port,host='127.0.0.1'):
+    '''
+    Input: TCP port (int), address to listen on (string; local only by default).
+    Action: Serve the metrics on a background thread.
+    Output: The MetricsServer (call shutdown() on it when done).
+    '''
+    server = MetricsServer((host,int(port)),MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print('Metrics at http://' + host + ':' + str(server.server_address[1]) + '/metrics (JSON: /metrics.json)')
+    return server
+
+#
+# TRACING
+#
+
+class Span(object):
+    '''
+    Input: Phase name (string), device (session name), command (string, optional), enclosing span (Span,
+    optional).
+    Action: One timed phase of a TaSc event: event (all of ssh()), connect (TCP, key exchange and
+    authentication), login (enable and pager together), enable (enable, or expert/sudo on SFR), pager
+    (paging off and learning the prompt), command, resync (reopening the shell after a command timed out),
+    undebug or close. start and end are time.monotonic(), so they can't be thrown off by the system clock;
+    wall is the epoch time the span started, for lining spans up with the logs. outcome is ok, timeout (the
+    prompt never came back), error or interrupted (Ctrl+C). A continuous debug capture is one span (debug)
+    whose outcome is rate when it was cut off for printing too much.
+    '''
+    def __init__(self,name,device,command=None,parent=None):
+        self.name = name
+        self.device = device
+        self.command = command
+        self.id = next(spanIds)
+        self.parent = None if parent is None else parent.id
+        self.trace = self.id if parent is None else parent.trace
+        self.wall = time.time()
+        self.start = time.monotonic()
+        self.end = None
+        self.nbytes = 0
+        self.outcome = 'ok'
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+    def asDict(self):
+        return {'trace':self.trace,'span':self.id,'parent':self.parent,'name':self.name,'device':self.device,
+                'command':self.command,'wall':self.wall,'start':self.start,'end':self.end,
+                'duration':self.duration,'bytes':self.nbytes,'outcome':self.outcome,'error':self.error}
+
+spanIds = itertools.count(1)
+
+class TaScTracer(object):
+    '''
+    Action: Hands out Spans and tells everyone interested when one finishes: the module's metrics first,
+    then every callback added with addCallback() (a callable taking the Span; see SpanLog). Spans nest
+    per thread, so every span inside ssh() has the event span as its parent and shares its trace ID.
+    '''
+    def __init__(self):
+        self.local = threading.local()
+        self.callbacks = []
+
+    def addCallback(self,callback):
+        self.callbacks.append(callback)
+
+    def removeCallback(self,callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    @contextlib.contextmanager
+    def span(self,name,device,command=None,parent=None):
+        '''
+        Input: Phase name, device, command (optional), enclosing span (optional; defaults to the innermost
+        open span on this thread - pass it in for work handed off to another thread).
+        Action: Time the body of the with block as a Span, which the block can add bytes or an outcome to.
+        An exception that escapes the block marks the span as an error (or interrupted) and carries on up.
+        '''
+        if not hasattr(self.local,'stack'):
+            self.local.stack = []
+        stack = self.local.stack
+        if parent is None and len(stack) > 0:
+            parent = stack[-1]
+        span = Span(name,device,command,parent)
+        stack.append(span)
+        try:
+            yield span
+        except KeyboardInterrupt:
+            span.outcome = 'interrupted'
+            raise
+        except BaseException as e:
+            span.outcome = 'error'
+            span.error = str(e) or type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            span.end = time.monotonic()
+            self.finish(span)
+
+    def finish(self,span):
+        metrics.span(span)
+        for callback in list(self.callbacks):
+            try:
+                callback(span)
+            except Exception:
+                # A broken callback shouldn't take the capture down with it
+                pass
+
+# Where this process's spans go
+tracer = TaScTracer()
+
+class SpanLog(object):
+    '''
+    Input: Path of the JSONL file to append to (string).
+    Action: Tracer callback that writes each finished span as one line of JSON (see Span.asDict()).
+    '''
+    def __init__(self,path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = open(path,'a',1)
+
+    def __call__(self,span):
+        line = json.dumps(span.asDict()) + '\n'
+        with self.lock:
+            if not self.f.closed:
+                self.f.write(line)
+
+    def close(self):
+        tracer.removeCallback(self)
+        with self.lock:
+            self.f.close()
+
+def closeTracing():
+    '''
+    Action: Close every SpanLog the tracer is writing to.
+    '''
+    for callback in list(tracer.callbacks):
+        if isinstance(callback,SpanLog):
+            callback.close()
+
+def readTrace(path):
+    '''
+    Input: JSONL file written by SpanLog.
+    Output: List of span dicts, skipping any line that was cut short.
+    '''
+    spans = []
+    with open(path) as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                pass
+    return spans
+
+#
+# THROTTLING
+#
+
+class TokenBucket(object):
+    '''
+    Input: Tokens per minute (float), most tokens that can be saved up (float, defaults to a minute's worth).
+    Action: take() waits until there's a token and uses it. scale slows the refill down (0.5 = half rate).
+    Output: take() returns how long (seconds) it waited.
+    '''
+    def __init__(self,perminute,burst=None):
+        self.lock = threading.Lock()
+        self.perminute = float(perminute)
+        self.burst = float(burst) if burst is not None else max(self.perminute,1.0)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.scale = 1.0
+
+    def take(self):
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                rate = self.perminute * self.scale / 60
+                self.tokens = min(self.burst,self.tokens + (now - self.stamp) * rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                wait = (1 - self.tokens) / rate
+            time.sleep(wait)
+
+class TaScThrottle(object):
+    '''
+    Action: Keeps each device from being polled harder than it can take. observe() is handed every command
+    ssh() runs: CPU is read from show cpu output and each command's time is compared with its usual time from
+    the cost model, to decide whether the device is busy (with separate busy and clear thresholds, so it
+    doesn't flap). admit() is asked before every command: it skips heavy commands on a busy device (except
+    for a probe every throttleProbeSeconds), pauses before the rest, and takes a token from the device's and
+    the global TokenBucket when deviceRate or globalRate is set. ssh() uses the module's `throttle`.
+    Output: admit() returns None if the command can go ahead, or why it was skipped (string).
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        # device -> {'cpu':percent or None,'latency':smoothed slowdown,'seen':when latency was last updated,
+        # 'busy':bool,'probed':when a heavy command last went through while busy,'bucket':TokenBucket or None}
+        self.devices = {}
+        self.bucket = None
+
+    def state(self,device):
+        with self.lock:
+            if device not in self.devices:
+                self.devices[device] = {'cpu':None,'latency':1.0,'seen':time.time(),'busy':False,'probed':0,
+                                        'bucket':None}
+            return self.devices[device]
+
+    def busy(self,device):
+        return self.state(device)['busy']
+
+    def wants(self,family,cmd):
+        '''
+        Output: True if observe() needs the command's output (it's where the CPU figure comes from).
+        '''
+        return throttling == True and findParser(family,cmd) in [parseAsaCpu,parseIosCpu]
+
+    def heavy(self,family,cmd):
+        full = normalizeCmd(cmd)
+        for slow in slowCmdTimeouts:
+            if full.startswith(slow):
+                return True
+        samples = costs.samples(family,cmd)
+        if len(samples) == 0:
+            return False
+        return (sum([sample[1] for sample in samples]) / len(samples) > throttleHeavySeconds or
+                sum([sample[2] for sample in samples]) / len(samples) > throttleHeavyBytes)
+
+    def admit(self,device,family,cmd):
+        state = self.state(device)
+        waited = 0.0
+        if throttling == True and state['busy']:
+            if self.heavy(family,cmd) and time.time() - state['probed'] >= throttleProbeSeconds:
+                # Let this one through to see whether the device has recovered
+                state['probed'] = time.time()
+            elif self.heavy(family,cmd):
+                metrics.inc('tasc_commands_skipped_total',(('device',device),('command',cmd)))
+                return self.reason(state)
+            time.sleep(throttleBusyPause)
+            waited += throttleBusyPause
+        if deviceRate > 0:
+            with self.lock:
+                if state['bucket'] is None or state['bucket'].perminute != deviceRate:
+                    state['bucket'] = TokenBucket(deviceRate)
+                state['bucket'].scale = 0.5 if state['busy'] else 1.0
+            waited += state['bucket'].take()
+        if globalRate > 0:
+            with self.lock:
+                if self.bucket is None or self.bucket.perminute != globalRate:
+                    self.bucket = TokenBucket(globalRate)
+            waited += self.bucket.take()
+        if waited > 0:
+            metrics.observe('tasc_throttle_wait_seconds',(('device',device),),waited)
+        return None
+
+    def reason(self,state):
+        if state['cpu'] is not None and state['cpu'] >= throttleCpuBusy:
+            return 'device busy (CPU ' + str(int(state['cpu'])) + '%)'
+        return 'device busy (commands running ' + str(round(state['latency'],1)) + 'x slower than usual)'
+
+    def observe(self,device,family,cmd,seconds,finished,output=''):
+        '''
+        Input: Device name, family, command, seconds it took, whether it finished, its output (if wants()).
+        Output: 'busy' or 'clear' if the device just changed state, else None. Call it before the command goes
+        into the cost model, so the command isn't compared with itself.
+        '''
+        if throttling == False or cmd.split(' ')[0] in debuglist:
+            return None
+        state = self.state(device)
+        if self.wants(family,cmd) and output != '':
+            fields = findParser(family,cmd)(output)
+            if 'cpu.5s' in fields:
+                state['cpu'] = fields['cpu.5s']
+        done = sorted([sample[1] for sample in costs.samples(family,cmd) if sample[3]])
+        if not finished:
+            ratio = throttleLatencyBusy
+        elif len(done) >= costMinSamples:
+            # Floor the usual time at a second, so jitter on commands that take milliseconds doesn't count
+            ratio = seconds / max(done[len(done) // 2],1.0)
+        else:
+            ratio = None
+        # The slowdown fades back towards normal with time, by half every throttleProbeSeconds
+        now = time.time()
+        state['latency'] = 1.0 + (state['latency'] - 1.0) * 0.5 ** ((now - state['seen']) / throttleProbeSeconds)
+        state['seen'] = now
+        if ratio is not None:
+            state['latency'] = 0.7 * state['latency'] + 0.3 * ratio
+        cpu = state['cpu'] if state['cpu'] is not None else 0
+        if not state['busy'] and (cpu >= throttleCpuBusy or state['latency'] >= throttleLatencyBusy):
+            state['busy'] = True
+            state['probed'] = now
+            return 'busy'
+        if state['busy'] and cpu < throttleCpuClear and state['latency'] < throttleLatencyClear:
+            state['busy'] = False
+            return 'clear'
+        return None
+
+throttle = TaScThrottle()
+
+#
+# ESCALATION TRIGGERS
+#
+
+def loadTriggers(path):
+    '''
+    Input: Path to a JSON file with a list of trigger rules. Each rule has a "name", the "command" whose output
+    it watches ('sh' is fine; matched on the start of the command), optionally the device "type" it's for, and
+    one or more conditions, all of which have to hold for it to fire:
+        "regex"           - the output matches this regular expression
+        "field" + "above"/"below" - a number the command's parser pulls out (see outputParsers, e.g. cpu.5s)
+                            is above/below this value
+        "changed": true   - the output differs from the device's last output for the command
+    and what to do when it fires:
+        "commands"        - commands to add to the event (show or debug; checked like the main command list)
+        "interval"        - seconds between events while escalated
+        "window"          - seconds each escalated debug command runs (defaults to debugWindow)
+        "events"          - how many events to stay escalated before dropping back (defaults to triggerEvents)
+    Output: TriggerWatch for the rules.
+    '''
+    try:
+        with open(path) as f:
+            rules = json.load(f)
+    except (IOError, ValueError) as e:
+        print('\n\nERROR: Could not read trigger file ' + path + ': ' + str(e) + '\n\n')
+        sys.exit(0)
+    checked = []
+    for n, rule in enumerate(rules):
+        name = str(rule.get('name','rule ' + str(n + 1)))
+        try:
+            if 'command' not in rule:
+                raise ValueError('needs a "command" to watch')
+            if not any([key in rule for key in ['regex','field','changed']]):
+                raise ValueError('needs a "regex", "field" or "changed" condition')
+            if 'field' in rule and 'above' not in rule and 'below' not in rule:
+                raise ValueError('"field" needs an "above" or "below" value')
+            if 'type' in rule and str(rule['type']) not in asaList + iosList + nixList + sfrList + sfrclishList:
+                raise ValueError('unknown device type "' + str(rule['type']) + '"')
+            family = deviceFamily(rule['type']) if 'type' in rule else None
+            rule = dict(rule,name=name,family=family,command=normalizeCmd(rule['command']),
+                        regex=re.compile(rule['regex']) if 'regex' in rule else None,
+                        commands=list(rule.get('commands',[])),events=int(rule.get('events',triggerEvents)),
+                        interval=rule.get('interval'),window=rule.get('window'))
+        except (ValueError, TypeError, re.error) as e:
+            print('\n\nERROR: Trigger "' + name + '" in ' + path + ': ' + str(e) + '\n\n')
+            sys.exit(0)
+        if len(rule['commands']) > 0 and family not in ['unix','sfr','sfrclish']:
+            sanitize_cmds(rule['commands'])
+        checked.append(rule)
+    return TriggerWatch(checked)
+
+class TriggerWatch(object):
+    '''
+    Input: Trigger rules (list of dicts, see loadTriggers()).
+    Action: Recorder that checks every output against the rules, so a device can be polled with a cheap
+    command set and only switch to the heavy one (more commands, a shorter interval, a debug window) once
+    something interesting shows up. When a rule fires for a device, the device's next `events` events are
+    escalated; a rule that fires again while escalated starts the count over. The event loops ask active()
+    before each event and call step() after an escalated one (see escalate()).
+    Output: active(device) -> the rule the device is escalated by, or None.
+    '''
+    def __init__(self,rules):
+        self.rules = rules
+        self.lock = threading.Lock()
+        # device -> {'rule':rule,'left':events to go,'why':what matched}
+        self.escalated = {}
+        # (device, command) -> last output, for "changed" rules
+        self.last = {}
+
+    def record(self,record):
+        cmd = normalizeCmd(record.command)
+        for rule in self.rules:
+            if not cmd.startswith(rule['command']) or rule['family'] not in [None,record.family]:
+                continue
+            why = self.check(rule,record)
+            if why is not None:
+                self.fire(record.device,rule,why)
+        with self.lock:
+            if len([rule for rule in self.rules if rule.get('changed') and cmd.startswith(rule['command'])]) > 0:
+                self.last[(record.device,cmd)] = record.output
+
+    def check(self,rule,record):
+        '''
+        Output: What matched (string) if every condition in the rule holds, else None.
+        '''
+        why = []
+        if rule['regex'] is not None:
+            match = rule['regex'].search(record.output)
+            if match is None:
+                return None
+            why.append('"' + match.group(0).strip()[:80] + '"')
+        if 'field' in rule:
+            parser = findParser(record.family,record.command)
+            try:
+                value = parser(record.output).get(rule['field']) if parser is not None else None
+            except (ValueError, IndexError):
+                value = None
+            if value is None:
+                return None
+            if 'above' in rule and not value > rule['above']:
+                return None
+            if 'below' in rule and not value < rule['below']:
+                return None
+            why.append(rule['field'] + '=' + str(value))
+        if rule.get('changed'):
+            with self.lock:
+                last = self.last.get((record.device,normalizeCmd(record.command)))
+            if last is None or last == record.output:
+                return None
+            why.append('output changed')
+        return ', '.join(why)
+
+    def fire(self,device,rule,why):
+        with self.lock:
+            current = self.escalated.get(device)
+            self.escalated[device] = {'rule':rule,'left':rule['events'],'why':why}
+        metrics.inc('tasc_triggers_total',(('device',device),('rule',rule['name'])))
+        if current is None:
+            print(device + ': trigger "' + rule['name'] + '" fired (' + why + '); escalating for ' +
+                  str(rule['events']) + ' events.')
+
+    def active(self,device):
+        with self.lock:
+            current = self.escalated.get(device)
+        return None if current is None else current['rule']
+
+    def why(self,device):
+        with self.lock:
+            current = self.escalated.get(device)
+        return None if current is None else current['why']
+
+    def step(self,device):
+        '''
+        Action: Count an escalated event off. Output: True if the device just dropped back to the baseline.
+        '''
+        with self.lock:
+            current = self.escalated.get(device)
+            if current is None:
+                return False
+            current['left'] -= 1
+            if current['left'] > 0:
+                return False
+            del self.escalated[device]
+        print(device + ': trigger "' + current['rule']['name'] + '" done; back to the baseline command set.')
+        return True
+
+def triggerWatch(recorders):
+    '''
+    Output: The TriggerWatch among the recorders, or None.
+    '''
+    for recorder in recorders or []:
+        if isinstance(recorder,TriggerWatch):
+            return recorder
+    return None
+
+def escalate(recorders,device,cmds,dbug):
+    '''
+    Input: Recorders (list), device name, baseline commands (list), are there debugs in them? (boolean).
+    Output: Tuple of (commands, debug flag, debug window (seconds or None), rule or None) for the device's
+    next event: the baseline plus the escalation commands of the rule it's escalated by, if any.
+    '''
+    watch = triggerWatch(recorders)
+    rule = watch.active(device) if watch is not None else None
+    if rule is None:
+        return cmds, dbug, None, None
+    extra = [cmd for cmd in rule['commands'] if cmd not in cmds]
+    return (cmds + extra,dbug or any([cmd.split(' ')[0] in debuglist for cmd in extra]),rule['window'],rule)
+
+def escalatedInterval(recorders,device,interval):
+    '''
+    Input: Recorders (list), device name, baseline seconds between events.
+    Output: Seconds between events the device should be polled at right now: the escalation interval while a
+    trigger rule with one has it escalated, otherwise the baseline.
+    '''
+    watch = triggerWatch(recorders)
+    rule = watch.active(device) if watch is not None else None
+    if rule is not None and rule['interval'] is not None:
+        return float(rule['interval'])
+    return float(interval)
+
+#
+# INPUT SANITY CHECKS
+#
+
+def sanitize_ip(ip):
+    '''
+    Input: a string containing the IP address that SSH traffic will be destined to.
+    
+    Action: verify that the string provided is a valid IP (my instinct is to split it up
+    into a list of octets, make sure that there are four of them and that each one is 255
+    or less, etc., but instead we'll be using IPy.)
+    
+    Output: Return nothing if the IP is invalid, return True if the IP is good. main()
+    will have a While loop and a variable we can initially set to False so that when this
+    function returns True, you can move on to the next stage.
+    '''
+    try:
+        IPy.IP(ip)
+    except:
+        print('Invalid IP Address')
+        return False
+    else:
+        return True
+
+def sanitize_cmds(cmds):
+    '''
+    Input: List (this should be the global commandlist)
+    Action: Verify that the commands being run look like valid ASA/IOS show commands (currently
+    we are not actually running a full-blown validator to check against a database of valid show commands,
+    but future releases might want to go in that direction.) This will be accomplished with
+    a regex match to confirm that the first word is "show" or a working approximation of "show".
+    
+    If a command doesn't look like the correct syntax, prompt the user to either remove the command
+    or 
+    Output: Returns boolean value of True if a debug command has been used, and False otherwise.
+    '''
+    for cmd in cmds:
+        notnum = re.search(unacceptable,cmd)
+        if notnum:
+            print(('Command "' + str(cmd) + '" contains special characters. '
+            'Commands must be strings of alphanumeric characters. Removing command from list.'))
+            cmds.remove(cmd)
+        else:
+            pass
+    
+    for cmd in cmds:
+        if cmd == '':
+            print('Command "' + str(cmd) + '" is blank. Removing command from list.')
+            cmds.remove(cmd)
+        else:
+            pass
+    
+    for cmd in cmds:
+        split = cmd.split(' ')
+        if len(split) <= 1:
+            print(('Command "' + str(cmd) + '" contains only one word. Show commands have at '
+                   'least two items. Removing command from list.'))
+            cmds.remove(cmd)
+        else:
+            pass
+        
+    for cmd in cmds:
+        split2 = cmd.split(' ')
+        if split2[0] not in goodshow:
+            print(('Command "' + str(cmd) + '" is not a Show command. Currently only Show and Debug '
+                   'commands are supported. Removing command from list.'))
+            cmds.remove(cmd)
+        else:
+            pass
+    
+    if len(cmds) == 0:
+        print('\n\nERROR: List of commands is empty. Terminating TaSc.\n\n')
+        sys.exit(0)
+
+    # Debug command notifier
+    split3 = cmd.split(' ')   
+    if split3[0] in debuglist:
+        print ('NOTICE: at least one of your commands has been recognized as a DEBUG command. '
+               'UNDEBUG ALL will be automatically applied at the end of each SSH session '
+               'in order to preserve resources.')
+        return True
+    else:
+        return False
+
+def isIntOrBlank(foo):
+    '''
+    Input: Any variable.
+    Action: Determine if a foo is an integer in range 1-65535 or a blank space (input sanitization for getPort)
+    Output: True if foo is an integer 1-65535 or blank; False otherwise.
+    '''
+    var = str(foo).strip(' ')
+    if var == '':
+        return True
+    try:
+        footoo = int(var)
+    except ValueError:
+        return False
+    return 1 <= footoo <= 65535
+
+#
+# INPUT COLLECTION LOOPS
+#
+
+def getCommand(goodcmd,prompt):
+    '''
+    Input: Boolean value (must be false for the loop to work), string containing prompt for raw input.
+    Action: Validate input to make sure that command is not blank
+    Output: None, but the global commandlist should be appended with valid commands.
+    '''
+    while goodcmd == False:
+        more = input(prompt)
+        if more != '':
+            goodcmd = True
+            commandlist.append(more)
+        else:
+            print('This field cannot be left blank!\n')
+
+def enough_cmds(nuffcmds):
+    '''
+    Input: Boolean value, must be False.
+    Action: Get commands to populate a list of commands to be run at the specified interval.
+    Output: None, but the global commandlist should be populated.
+    '''
+    while nuffcmds == False:
+        more = input('Enter an additional command to run (or strike Enter to get started): ')
+        if more == '':
+            nuffcmds = True
+        else:
+            commandlist.append(more)
+
+def amVerbose(goodanswer,prompt):
+    '''
+    Input: Boolean value, must be False.
+    Action: Get a yes or no answer w/r/t whether we are running in debug/verbose mode (default to No/False)
+    Output: True if verbose, False if not verbose
+    '''
+    while goodanswer == False:
+        more = input(prompt)
+        if more in NoList2:
+            goodanswer = True
+            return False
+        elif more in YesList2:
+            goodanswer = True
+            return True
+        else:
+            goodanswer = False
+            print('Please enter "Y" or "N".\n')
+
+def bigredbutton():
+    '''
+    Confirm that the user wants to go ahead with the action and provide an escape.
+    '''
+    looper = False
+    while looper == False:
+        uin = input('CONFIRM [Type "yes" or "no"]: ')    
+        if uin in NoList:
+            print('\nOk! Terminating thread. Thanks for using TaSc.\n')
+            sys.exit(0)
+        elif uin in YesList2:
+            print('\nOk! Initializing...\n')
+            looper = True
+
+def getSSHlogin(goodlogin):
+    '''
+    Input: Boolean value (must be false for the loop to work).
+    Action: Validate input to make sure that ssh username is not blank
+    Output: SSH Username as a string.
+    '''
+    while goodlogin == False:
+        more = input('SSH Username: ')
+        if more != '':
+            goodlogin = True
+            return more
+        else:
+            print('Username cannot be blank.\n')
+
+def getDevice(goodvalue,prompt):
+    '''
+    Input: Boolean value (must be false for the loop to work), string containing prompt for raw input.
+    Action: Validate input to make sure that device type is not blank
+    Output: Returns either 'ASA', 'IOS', 'SFR', or 'Unix'
+    '''
+    while goodvalue == False:
+        more = input(prompt)
+        if more != '':
+            if more in goodDeviceList:
+                goodvalue = True
+                if more in sfrList:
+                    sfrmore = input('Run commands in CLIsh? (y/N): ')
+                    goodanswer = False
+                    while goodanswer == False:
+                        if sfrmore in NoList2:
+                            goodanswer = True
+                            return more
+                        elif sfrmore in YesList2:
+                            goodanswer = True
+                            return 'sfrclish'
+                        else:
+                            goodanswer = False
+                            print('Please enter "Y" or "N".\n')
+                else:
+                    return more
+            else:
+                print('Valid responses: "ASA", "IOS", "SFR", or "Unix".\n')
+        else:
+            print('This field cannot be left blank!\n')
+    
+def getPort():
+    '''
+    Input: None
+    Action: Get port from raw input.
+    Output: If raw input empty, return 22. Else, return specified port.
+    '''
+    validate = False
+    anyOldPort = input('Port [defaults to 22 if left blank]: ')
+    validate = isIntOrBlank(anyOldPort)
+    while validate == False:
+        anyOldPort = input('Please either enter an integer (1-65535) or leave this field blank to use 22: ')
+        validate = isIntOrBlank(anyOldPort)
+    if anyOldPort == '':
+        return 22
+    else:
+        return anyOldPort
+
+def getLoops(prompt):
+    '''
+    Input: A prompt (str) to feed to the user to retrieve the number of loops to run.
+    Action: Get loop count & verify format.
+    Output: Return loop count as an integer.
+    '''
+    goodLoop = False
+    while goodLoop == False:
+        more = input(prompt)
+        try:
+            intmore = int(more)
+        except:
+            print('\nError: Value must be an integer between 0 and 25000.\n')
+        else:
+            if intmore < 0:
+                goodLoop = False
+                print('\nError: Value must be an integer between 0 and 25000.\n')
+            elif intmore > 25000:
+                goodLoop = False
+                print('\nError: Value must be an integer between 0 and 25000.\n')
+            else:
+                goodLoop = True
+                return intmore
+
+def getInterval(prompt):
+    '''
+    Input: A prompt (str) to feed to the user to retrieve the interval between events.
+    Action: Get interval & verify format.
+    Output: Return the interval in seconds as an integer (0 = run events back to back).
+    '''
+    goodInterval = False
+    while goodInterval == False:
+        more = input(prompt)
+        if more == '':
+            return 0
+        try:
+            intmore = int(more)
+        except:
+            print('\nError: Value must be an integer between 0 and 86400.\n')
+        else:
+            if 0 <= intmore <= 86400:
+                goodInterval = True
+                return intmore
+            else:
+                print('\nError: Value must be an integer between 0 and 86400.\n')
+
+def getMetricsPort(prompt):
+    '''
+    Input: A prompt (str) to feed to the user to retrieve the metrics port.
+    Action: Get port & verify format.
+    Output: Port as an integer, or None if left blank.
+    '''
+    goodPort = False
+    while goodPort == False:
+        more = input(prompt).strip()
+        if more == '':
+            return None
+        try:
+            intmore = int(more)
+        except ValueError:
+            intmore = 0
+        if 1 <= intmore <= 65535:
+            goodPort = True
+            return intmore
+        prompt = 'Please either enter an integer (1-65535) or leave this field blank for no metrics: '
+
+def getOffloadWorkers(prompt):
+    '''
+    Input: A prompt (str) to feed to the user to retrieve the number of offload workers.
+    Action: Get a number & verify format.
+    Output: Number of worker processes (int), 0 if left blank.
+    '''
+    goodWorkers = False
+    while goodWorkers == False:
+        more = input(prompt).strip()
+        if more == '':
+            return 0
+        try:
+            intmore = int(more)
+        except ValueError:
+            intmore = -1
+        if intmore >= 0:
+            goodWorkers = True
+            return intmore
+        prompt = 'Please either enter a whole number (0 or more) or leave this field blank for none: '
+
+def getTriggerFile(prompt):
+    '''
+    Input: A prompt (str) to feed to the user to retrieve the trigger file.
+    Action: Get a path & verify that the file is there.
+    Output: Path (string), or None if left blank.
+    '''
+    more = input(prompt).strip()
+    while more != '' and not os.path.isfile(os.path.expanduser(more)):
+        more = input('File not found. Please enter the path to a JSON trigger file, or leave this field blank for none: ').strip()
+    if more == '':
+        return None
+    return os.path.expanduser(more)
+
+def parseEndTime(more):
+    '''
+    Input: Time of day as a string, 'HH:MM' (24-hour clock).
+    Output: datetime of the next time the clock reads HH:MM (today, or tomorrow if that's already
+    passed), or None if the string isn't a valid time.
+    '''
+    try:
+        clock = datetime.datetime.strptime(more.strip(),'%H:%M').time()
+    except ValueError:
+        return None
+    endtime = datetime.datetime.combine(datetime.date.today(),clock)
+    if endtime <= datetime.datetime.now():
+        endtime += datetime.timedelta(days=1)
+    return endtime
+
+def getEndTime(prompt):
+    '''
+    Input: A prompt (str) to feed to the user to retrieve the time to stop at.
+    Action: Get end time & verify format.
+    Output: datetime to stop at, or None if left blank.
+    '''
+    while True:
+        more = input(prompt)
+        if more == '':
+            return None
+        endtime = parseEndTime(more)
+        if endtime is not None:
+            return endtime
+        print('\nError: Enter a time as HH:MM (24-hour clock), or leave this field blank.\n')
+
+def getOverrun(prompt):
+    '''
+    Input: A prompt (str) to feed to the user to retrieve the overrun policy.
+    Output: 'skip' (the default), 'coalesce' or 'late'.
+    '''
+    while True:
+        more = input(prompt).strip().lower()
+        if more == '':
+            return 'skip'
+        if more in overrunPolicies:
+            return more
+        print('Valid responses: "skip", "coalesce", or "late".\n')
+
+def verifySSH(ip,user,pw,port,dtype,session=None):
+    '''
+    Input: SSH IP address, username, password, device type, persistent session (TaScSession, optional)
+    Action: SSH/login to specified address with given credentials. If a session is given, the test
+    connection is made through it and left open so the main loop can reuse it.
+    Output: True if SSH connection works, False if it fails in some way.
+    '''
+    if session is not None:
+        try:
+            session.connect(timeout=4)
+        except:
+            session.close()
+            return False
+        else:
+            return True
+    # Create instance of SSHClient object
+    run_pre = paramiko.SSHClient()
+    # Automatically add untrusted hosts (make sure okay for security policy in your environment)
+    run_pre.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    # initiate test SSH connection
+    value = False
+    if str(dtype) not in sfrclishList:
+        try:
+            run_pre.connect(ip, username=user, password=pw, look_for_keys=False, allow_agent=False, timeout=4, port=port)
+        except:
+            value = False
+        else:
+            value = True
+    else:
+        try:
+            run_pre.connect(ip, username=user, password=pw, port=port)
+        except:
+            value = False
+        else:
+            value = True
+    # Close connection
+    run_pre.close()
+    return value
+
+#
+# INTERACTIVE ASA PACKET CAPTURE
+#
+
+def shallWePlay(prompt):
+    '''
+    Input: Prompt to display to user
+    Action: Get a yes or no answer w/r/t whether to take an ASA pcap
+    Output: True if taking a pcap, False if not taking a pcap
+    '''
+    goodanswer = False
+    while goodanswer == False:
+        more = input(prompt)
+        if more in NoList2:
+            goodanswer = True
+            return False
+        elif more in YesList2:
+            goodanswer = True
+            return True
+        else:
+            goodanswer = False
+            print('Please enter "Y" or "N".\n')
+
+class PcapRing(object):
+    '''
+    Input: Folder to write to (string), bytes per file (int), files to keep (int, 0 = all of them).
+    Action: Write packets to classic libpcap files (Ethernet link type) as they come in, starting a new
+    TaSc-pcap-<time>.pcap once the current one reaches its size, and deleting the oldest files beyond keep.
+    Output: write(stamp, frame) for each packet; close() when done. files, packets and nbytes count what went out.
+    '''
+    def __init__(self,logdir='.',rotatebytes=pcapRotateBytes,keep=pcapKeepFiles):
+        self.logdir = logdir
+        self.rotatebytes = rotatebytes
+        self.keep = keep
+        self.f = None
+        self.size = 0
+        self.paths = []
+        self.files = 0
+        self.packets = 0
+        self.nbytes = 0
+
+    def open(self):
+        now = datetime.datetime.now()
+        path = os.path.join(self.logdir,'TaSc-pcap-' + now.strftime('%Y-%m-%d_%H-%M-%S-%f') + '.pcap')
+        self.f = open(path,'wb')
+        # Magic, version 2.4, GMT offset, accuracy, snapshot length, link type (1 = Ethernet)
+        self.f.write(struct.pack('<IHHiIII',0xa1b2c3d4,2,4,0,0,65535,1))
+        self.size = 24
+        self.paths.append(path)
+        self.files += 1
+        while self.keep > 0 and len(self.paths) > self.keep:
+            try:
+                os.remove(self.paths.pop(0))
+            except OSError:
+                pass
+
+    def write(self,stamp,frame):
+        if self.f is None or (self.rotatebytes > 0 and self.size >= self.rotatebytes):
+            self.close()
+            self.open()
+        self.f.write(struct.pack('<IIII',int(stamp.timestamp()),stamp.microsecond,len(frame),len(frame)))
+        self.f.write(frame)
+        self.size += 16 + len(frame)
+        self.packets += 1
+        self.nbytes += len(frame)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+# '   12: 14:16:55.283045       10.1.1.10 > 10.2.2.20 icmp: echo request' starts each packet in a capture dump,
+# and '0x0010   0054 1c3f 4000 4001 0689 0a01 010a 0a02   .T.?@.@.........' lines carry its bytes
+pcapPacketLine = re.compile(r'^\s*(\d+): (\d\d):(\d\d):(\d\d)\.(\d+) ')
+pcapHexLine = re.compile(r'^0x([0-9a-f]+)[\t ]+((?:[0-9a-f]{2,4} ?)+?)(?:\t| {2,}|\s*$)')
+
+class PcapDumpParser(object):
+    '''
+    Input: Function to hand each packet to, as (timestamp (datetime), frame (bytes)) - e.g. PcapRing.write.
+    Action: File-like sink for 'show capture NAME dump' output (see TaScSession.run()): turns the hex dump
+    back into frames line by line as it streams in, so only the packet being read is ever held in memory.
+    The dump only has the time of day, so the date is today's, moving on a day whenever the clock wraps.
+    Output: packets counts the packets handed on, last is the number of the last one.
+    '''
+    def __init__(self,callback):
+        self.callback = callback
+        self.partial = ''
+        self.current = None
+        self.day = datetime.date.today()
+        self.clock = None
+        self.packets = 0
+        self.last = 0
+
+    def write(self,text):
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.line(line.rstrip('\r'))
+
+    def line(self,line):
+        match = pcapPacketLine.match(line)
+        if match is not None:
+            self.emit()
+            clock = datetime.time(int(match.group(2)),int(match.group(3)),int(match.group(4)),
+                                  int(match.group(5)[:6].ljust(6,'0')))
+            if self.clock is not None and clock < self.clock and self.clock.hour >= 12 and clock.hour < 12:
+                self.day += datetime.timedelta(days=1)
+            self.clock = clock
+            self.current = (int(match.group(1)),datetime.datetime.combine(self.day,clock),bytearray())
+            return
+        match = pcapHexLine.match(line)
+        # Offsets have to follow on, or the line isn't part of this packet
+        if match is not None and self.current is not None and int(match.group(1),16) == len(self.current[2]):
+            self.current[2].extend(bytes.fromhex(match.group(2).replace(' ','')))
+
+    def finish(self):
+        '''
+        Action: Read whatever is left of the last line and hand on the packet being read. Call it once the dump
+        has ended.
+        '''
+        if self.partial != '':
+            line, self.partial = self.partial, ''
+            self.line(line.rstrip('\r'))
+        self.emit()
+
+    def emit(self):
+        '''
+        Action: Hand on the packet being read, if there is one.
+        '''
+        if self.current is not None and len(self.current[2]) > 0:
+            self.callback(self.current[1],bytes(self.current[2]))
+            self.packets += 1
+            self.last = self.current[0]
+        self.current = None
+
+def captureMatch(proto='ip',src='',sport='',dst='',dport=''):
+    '''
+    Input: Protocol (ip/tcp/udp/icmp), source IP, source port, destination IP, destination port (strings;
+    blank = any).
+    Output: The 'match' part of an ASA capture command for that five-tuple. A capture match takes traffic in
+    both directions, so one match covers replies too.
+    '''
+    parts = [proto]
+    parts.append('host ' + src if src != '' else 'any')
+    if sport != '' and proto in ['tcp','udp']:
+        parts.append('eq ' + str(sport))
+    parts.append('host ' + dst if dst != '' else 'any')
+    if dport != '' and proto in ['tcp','udp']:
+        parts.append('eq ' + str(dport))
+    return ' '.join(parts)
+
+def asaNameifs(session):
+    '''
+    Input: Logged in ASA session (TaScSession).
+    Output: List of interface names (nameifs) from 'show nameif'.
+    '''
+    output, finished = session.run('show nameif',30)
+    names = []
+    for line in output.splitlines():
+        split = line.split()
+        if len(split) >= 3 and split[-1].isdigit() and split[0] != 'Interface':
+            names.append(split[1])
+    return names
+
+class TaScPacketCapture(object):
+    '''
+    Input: Logged in ASA session (TaScSession), interface (nameif), match (see captureMatch()), folder for the
+    pcap files, capture buffer on the ASA (bytes), seconds to capture for (0 = until Ctrl+C), bytes of packets
+    to collect (0 = no limit), bytes per local pcap file, local files to keep, capture name.
+    Action: Define a raw-data capture on the ASA with a bounded buffer, and while it runs read the new packets
+    back over the session every pcapPoll seconds ('show capture NAME dump packet-number N count pcapBatch'),
+    streaming the dump through a PcapDumpParser into rotating pcap files (PcapRing) - no TFTP/SCP server,
+    and nothing piles up in memory. The buffer's fill level is checked after each read; at pcapDrainPercent
+    it's cleared, so a long capture on a busy link never fills it and stops. Anything captured between the
+    last read and the clear is lost; drains counts how often that window came up. On a limit or Ctrl+C the
+    last packets are read and the capture is removed from the ASA.
+    Output: run() returns a dict with the reason it stopped, seconds, packets, bytes, files and drains.
+    '''
+    def __init__(self,session,interface,match,logdir='.',buffer=pcapBuffer,maxseconds=0,maxbytes=0,
+                 rotatebytes=pcapRotateBytes,keep=pcapKeepFiles,name=pcapName):
+        self.session = session
+        self.interface = interface
+        self.match = match
+        self.buffer = buffer
+        self.maxseconds = maxseconds
+        self.maxbytes = maxbytes
+        self.name = name
+        self.ring = PcapRing(logdir,rotatebytes,keep)
+        self.next = 1
+        self.drains = 0
+
+    def configure(self,cmds):
+        '''
+        Action: Run commands in configuration mode. Raises ValueError with the ASA's complaint if one fails.
+        '''
+        for cmd in ['configure terminal'] + cmds + ['end']:
+            output, finished = self.session.run(cmd,30)
+            if not finished or re.search(r'^(ERROR|%)',output,re.MULTILINE):
+                if cmd != 'end':
+                    self.session.run('end',30)
+                raise ValueError('"' + cmd + '" failed: ' + output.strip())
+
+    def define(self):
+        self.configure(['capture ' + self.name + ' type raw-data buffer ' + str(self.buffer) + ' packet-length ' +
+                        str(pcapPacketLength) + ' interface ' + self.interface + ' match ' + self.match])
+
+    def level(self):
+        '''
+        Output: Bytes in the capture buffer right now.
+        '''
+        output, finished = self.session.run('show capture ' + self.name,30)
+        match = re.search(r'Capturing - (\d+) bytes',output)
+        return int(match.group(1)) if match is not None else 0
+
+    def fetch(self):
+        '''
+        Action: Read every packet captured since the last read into the pcap files.
+        '''
+        while True:
+            parser = PcapDumpParser(self.ring.write)
+            output, finished = self.session.run('show capture ' + self.name + ' dump packet-number ' +
+                                                str(self.next) + ' count ' + str(pcapBatch),max(60,pcapBatch / 10),
+                                                None,parser)
+            parser.finish()
+            if parser.packets == 0:
+                return
+            self.next = parser.last + 1
+            if parser.packets < pcapBatch:
+                return
+
+    def run(self):
+        started = time.monotonic()
+        reason = 'stopped'
+        with tracer.span('pcap',self.session.name) as span:
+            self.define()
+            try:
+                while True:
+                    self.fetch()
+                    if self.level() >= self.buffer * pcapDrainPercent / 100.0:
+                        self.fetch()
+                        self.session.run('clear capture ' + self.name,30)
+                        self.next = 1
+                        self.drains += 1
+                    elapsed = time.monotonic() - started
+                    if self.maxseconds > 0 and elapsed >= self.maxseconds:
+                        reason = 'time limit'
+                        break
+                    if self.maxbytes > 0 and self.ring.nbytes >= self.maxbytes:
+                        reason = 'size limit'
+                        break
+                    wait = pcapPoll if self.maxseconds <= 0 else min(pcapPoll,self.maxseconds - elapsed)
+                    time.sleep(max(wait,0))
+            except KeyboardInterrupt:
+                reason = 'Ctrl+C'
+                span.outcome = 'interrupted'
+                # Whatever we were in the middle of reading is still coming
+                time.sleep(1)
+                self.session.drain()
+            finally:
+                try:
+                    self.fetch()
+                finally:
+                    self.configure(['no capture ' + self.name])
+                    self.ring.close()
+                    span.nbytes = self.ring.nbytes
+        return {'reason':reason,'seconds':time.monotonic() - started,'packets':self.ring.packets,
+                'bytes':self.ring.nbytes,'files':self.ring.files,'drains':self.drains}
+
+def captureSummary(result):
+    '''
+    Input: Dict returned by TaScPacketCapture.run().
+    Output: One line saying why the capture stopped and what it collected.
+    '''
+    return ('Capture stopped (' + result['reason'] + ') after ' + str(round(result['seconds'],1)) + 's: ' +
+            str(result['packets']) + ' packets, ' + str(result['bytes']) + ' bytes in ' + str(result['files']) +
+            ' pcap file(s)' + (', buffer cleared ' + str(result['drains']) + ' time(s)' if result['drains'] > 0 else '')
+            + '.')
+
+def getCaptureAddress(prompt):
+    '''
+    Input: A prompt (str) to feed to the user.
+    Output: IP address (string), or '' for any.
+    '''
+    more = input(prompt).strip()
+    while more != '' and not sanitize_ip(more):
+        more = input('Please enter an IP address, or leave this field blank for any: ').strip()
+    return more
+
+def getCapturePort(prompt):
+    '''
+    Input: A prompt (str) to feed to the user.
+    Output: Port (string of an integer 1-65535), or '' for any.
+    '''
+    goodPort = False
+    while goodPort == False:
+        more = input(prompt).strip()
+        if more == '':
+            return ''
+        try:
+            intmore = int(more)
+        except ValueError:
+            intmore = 0
+        if 1 <= intmore <= 65535:
+            goodPort = True
+            return str(intmore)
+        prompt = 'Please either enter an integer (1-65535) or leave this field blank for any: '
+
+def pcap(session,vb):
+    '''
+    Outline: This function steps in after we give the details for an ASA in the Main() loop and verify it.
+                We'll ask if they want to run a packet capture. If yes, get the five-tuple, the interface
+                and how long to capture for, then run it (see TaScPacketCapture).
+
+    Input: The following should be passed from Main():
+            Logged in session to the ASA (TaScSession), whether we're verbose.
+
+           pcap() should get the following from the user:
+            Five-tuple, interface (list nameifs on ASA for user and pass them back as a reminder),
+            how many minutes to capture for.
+    Output: pcap files in the current log folder.
+    '''
+    session.ensure(vb)
+    # Give user a list of ASA nameifs to help with the capture tool
+    nameifList = asaNameifs(session)
+    if len(nameifList) == 0:
+        print('\n\nERROR: Could not read the interface names from the ASA. Skipping the packet capture.\n\n')
+        return
+    print('\n\n Current interface names on device:\n')
+    for n, nameif in enumerate(nameifList):
+        print(str(n + 1) + '.     ' + nameif)
+    choice = input('Select the ingress interface (Enter a number from the list 1-' + str(len(nameifList)) + '): ')
+    while not (choice.isdigit() and 1 <= int(choice) <= len(nameifList)):
+        choice = input('Please enter a number from the list (1-' + str(len(nameifList)) + '): ')
+    ingress_ifc = nameifList[int(choice) - 1]
+    proto = input('Protocol (ip/tcp/udp/icmp) [ip]: ').strip().lower()
+    while proto not in ['','ip','tcp','udp','icmp']:
+        proto = input('Please enter ip, tcp, udp or icmp (or leave blank for ip): ').strip().lower()
+    proto = proto or 'ip'
+    src = getCaptureAddress('Source IP (leave blank for any): ')
+    sport = getCapturePort('Source port (leave blank for any): ') if proto in ['tcp','udp'] else ''
+    dst = getCaptureAddress('Destination IP (leave blank for any): ')
+    dport = getCapturePort('Destination port (leave blank for any): ') if proto in ['tcp','udp'] else ''
+    minutes = getLoops('Capture for how many minutes? (0-25000; 0 = until Ctrl+C): ')
+    match = captureMatch(proto,src,sport,dst,dport)
+    print('\nTaSc will capture "' + match + '" on ' + ingress_ifc + ' into pcap files in ' + os.getcwd() +
+          (' for ' + str(minutes) + ' minutes' if minutes > 0 else ' until Ctrl+C') + '.\n')
+    bigredbutton()
+    capture = TaScPacketCapture(session,ingress_ifc,match,os.getcwd(),maxseconds=minutes * 60)
+    try:
+        result = capture.run()
+    except ValueError as e:
+        print('\n\nERROR: The ASA would not start the capture: ' + str(e) + '\n\n')
+        return
+    print(captureSummary(result) + '\n')
+
+
+#
+# LIBRARY API
+#
+
+class TaScJob(object):
+    '''
+    Input: SSH IP address, username, password, enable password, device type (ASA/IOS/SFR/sfrclish/Unix),
+    commands (list), ssh dest port (int), log folder (string; default: a new one from newLogFolder()), are
+    we logging verbosely? (boolean), recorders (list, optional; see ssh()), name to record the device
+    under (string, optional).
+    Action: Run TaSc from other tools without going through the prompts in main(). A job wraps
+    verifySSH(), newLog() and ssh() around one persistent TaScSession. Making a job touches neither the
+    disk nor the network: verify() opens the session, and the first event creates the log folder.
+    Output: verify() returns True/False, event() returns {command: seconds} for one event, and run()
+    returns a list of those, one per event. Raises ValueError if none of the commands are usable.
+    '''
+    def __init__(self,ip,user,pw,enpw,dtype,cmds,port=22,logdir=None,vb=False,recorders=None,name=None):
+        self.ip = ip
+        self.user = user
+        self.pw = pw
+        self.enpw = enpw
+        self.dtype = str(dtype)
+        self.port = port
+        self.logdir = logdir
+        self.vb = vb
+        self.recorders = recorders
+        self.cmds = list(cmds)
+        self.dbug = False
+        if self.dtype not in nixList and self.dtype not in sfrclishList:
+            try:
+                self.dbug = sanitize_cmds(self.cmds)
+            except SystemExit:
+                raise ValueError('None of the commands are usable.')
+        self.session = TaScSession(ip,user,pw,enpw,self.dtype,port,name=name)
+        self.measured = {}
+
+    def verify(self):
+        return verifySSH(self.ip,self.user,self.pw,self.port,self.dtype,self.session)
+
+    def event(self):
+        '''
+        Action: Run the commands once, into a new log file in the job's ring buffer.
+        Output: {command: seconds} for this event.
+        '''
+        if self.logdir is None:
+            self.logdir = newLogFolder()
+        elif not os.path.exists(self.logdir):
+            os.makedirs(self.logdir)
+        log = newLog(self.logdir)
+        try:
+            self.session.ensure(self.vb,log)
+            cmds, dbug, window, rule = escalate(self.recorders,self.session.name,self.cmds,self.dbug)
+            if rule is not None:
+                logNote(log,'Escalated by trigger "' + rule['name'] + '" (' + str(triggerWatch(self.recorders)
+                        .why(self.session.name)) + ').\n\n')
+            tvalue = float(75/estimateCycle(cmds,self.measured,self.session.family))
+            durations = ssh(self.ip,self.user,self.pw,self.enpw,cmds,self.dtype,dbug,self.vb,self.port,
+                            tvalue,log,self.session,False,self.recorders,window)
+            if rule is not None:
+                triggerWatch(self.recorders).step(self.session.name)
+        finally:
+            log.close()
+        self.measured.update(durations)
+        return durations
+
+    def run(self,loops=1,interval=0,endtime=None,overrun='skip'):
+        '''
+        Input: Number of events (int, 0 = until endtime or forever), seconds between event starts (int),
+        end time (datetime, optional), overrun policy (string; see TaScScheduler).
+        Output: List of event() results.
+        '''
+        results = []
+        scheduler = TaScScheduler(interval,loops,endtime,overrun)
+        for tick in scheduler:
+            metrics.event(self.session.name,tick)
+            results.append(self.event())
+            wanted = escalatedInterval(self.recorders,self.session.name,interval)
+            if scheduler.interval != wanted:
+                scheduler.retime(wanted)
+        return results
+
+    def close(self):
+        self.session.close()
+
+#
+# INVENTORY MODE
+#
+
+def inventoryDevice(row,names,ask=True):
+    '''
+    Input: One inventory entry (dict), names already taken (list; the new name is added to it), prompt for
+    anything missing? (boolean; False for jobs coming in through the daemon socket, which has no terminal).
+    Action: Validate the entry and fill in its defaults; prompt (getpass) for any password that isn't in it.
+    Output: Device dict with every field filled in. Raises ValueError describing the first problem found.
+    '''
+    ip = str(row.get('ip') or '').strip()
+    if sanitize_ip(ip) == False:
+        raise ValueError('Inventory entry ' + str(row) + ' has an invalid IP address.')
+    port = str(row.get('port') or '').strip()
+    if isIntOrBlank(port) != True:
+        raise ValueError('Inventory entry for ' + ip + ' has an invalid port.')
+    port = int(port) if port != '' else 22
+    dtype = str(row.get('type') or '').strip()
+    if dtype not in goodDeviceList and dtype != 'sfrclish':
+        raise ValueError('Inventory entry for ' + ip + ' has an invalid device type "' + dtype +
+                         '". Valid types: "ASA", "IOS", "SFR", "sfrclish", or "Unix".')
+    name = str(row.get('name') or '').strip()
+    if name == '':
+        name = ip if port == 22 else ip + '_' + str(port)
+    if re.search(unacceptable,name) or '/' in name or name in names:
+        raise ValueError('Inventory name "' + name + '" is either a duplicate or not usable as a folder name.')
+    user = str(row.get('user') or '').strip()
+    pw = row.get('password')
+    if not ask and (user == '' or not pw):
+        raise ValueError('Inventory entry for ' + name + ' needs a "user" and a "password".')
+    if user == '':
+        user = getSSHlogin(False)
+    if not pw:
+        pw = getpass.getpass('SSH Password for ' + name + ': ')
+    # Same enable password rules as main()
+    if dtype in nixList:
+        enpw = 'UnixHasNoEnablePassword'
+    elif dtype in sfrList:
+        enpw = pw
+    elif dtype == 'sfrclish':
+        enpw = 'CLIshHasNoEnablePassword'
+    elif 'enable' in row and row['enable'] is not None:
+        enpw = row['enable']
+    elif not ask:
+        enpw = ''
+    else:
+        enpw = getpass.getpass('Enable Password for ' + name + ' (leave blank if none): ')
+    names.append(name)
+    return {'name':name,'ip':ip,'port':port,'type':dtype,'user':user,'password':pw,'enable':enpw}
+
+def loadInventory(path):
+    '''
+    Input: Path to an inventory file (string): a JSON list of devices, or a CSV file with a header row.
+    Each device needs an "ip", a "type" (ASA/IOS/SFR/sfrclish/Unix) and a "user", and can also have a
+    "name" (used for its log folder), a "port" (defaults to 22), a "password" and an "enable" password.
+    Action: Read and validate the inventory (see inventoryDevice()).
+    Output: List of device dicts with every field filled in.
+    '''
+    try:
+        if path.lower().endswith('.csv'):
+            with open(path,newline='') as f:
+                rows = list(csv.DictReader(f))
+        else:
+            with open(path) as f:
+                rows = json.load(f)
+    except (IOError, ValueError) as e:
+        print('\n\nERROR: Could not read inventory file ' + path + ': ' + str(e) + '\n\n')
+        sys.exit(0)
+    devices = []
+    names = []
+    for row in rows:
+        try:
+            devices.append(inventoryDevice(row,names))
+        except ValueError as e:
+            print('\n\nERROR: ' + str(e) + '\n\n')
+            sys.exit(0)
+    if len(devices) == 0:
+        print('\n\nERROR: Inventory ' + path + ' has no devices in it. Terminating TaSc.\n\n')
+        sys.exit(0)
+    return devices
+
+class InventoryRunner(object):
+    '''
+    Input: List of devices from loadInventory(), list of commands, loop count (int, 0 = infinite loop),
+    size of the worker pool (int), are we logging verbosely? (boolean), folder to create the per-device
+    log folders in (string), seconds between events (int, 0 = back to back), end time (datetime or None),
+    overrun policy (string; see TaScScheduler), recorders shared by every device (list, optional; see ssh()).
+    Action: Run the command set against every device in the inventory at once. Each device keeps its own
+    persistent session, log folder and schedule. One event on one device is one job on a bounded thread
+    pool, and a device's next event is queued for its next scheduled start as soon as its last one
+    finishes, so a slow or unreachable box only ever delays itself.
+    '''
+    def __init__(self,devices,cmds,loops,workers,vb,logroot,interval=0,endtime=None,overrun='skip',recorders=None):
+        self.vb = vb
+        self.recorders = recorders
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.stopping = False
+        self.timers = []
+        # Show/debug syntax only gets checked for the device types main() checks it for
+        checked = list(cmds)
+        if len([dev for dev in devices if dev['type'] not in nixList and dev['type'] not in sfrclishList]) > 0:
+            checkeddebug = sanitize_cmds(checked)
+        else:
+            checkeddebug = False
+        self.states = []
+        for dev in devices:
+            logdir = os.path.join(logroot,dev['name'])
+            if not os.path.exists(logdir):
+                os.makedirs(logdir)
+            if dev['type'] not in nixList and dev['type'] not in sfrclishList:
+                dcmds, dbug = checked, checkeddebug
+            else:
+                dcmds, dbug = list(cmds), False
+            session = TaScSession(dev['ip'],dev['user'],dev['password'],dev['enable'],dev['type'],dev['port'],
+                                  timeout=inventoryConnectTimeout,name=dev['name'])
+            self.states.append(self.newState(dev,session,threading.Lock(),logdir,dcmds,dbug,
+                                             TaScScheduler(interval,loops,endtime,overrun)))
+        self.running = len(self.states)
+
+    def newState(self,dev,session,slock,logdir,cmds,dbug,sched):
+        '''
+        Output: State dict for one device's loop. slock guards the session, so loops that share one
+        (see TaScDaemon) take turns on it.
+        '''
+        return {'dev':dev,'session':session,'slock':slock,'logdir':logdir,'cmds':cmds,'dbug':dbug,'sched':sched,
+                'interval':sched.interval,'measured':{},'failures':0,'events':0,'error':None,'due':None,'timer':None,'cancelled':False}
+
+    def run(self):
+        '''
+        Action: Test every device, start all of the loops and wait for them to finish (or for Ctrl+C).
+        '''
+        for state in self.states:
+            self.pool.submit(self.verify,state)
+        try:
+            while not self.finished.wait(1):
+                pass
+        except KeyboardInterrupt:
+            print('\nEscape sequence detected. Letting running events finish, then shutting down...')
+            self.stopping = True
+            with self.lock:
+                for timer in self.timers:
+                    timer.cancel()
+        self.pool.shutdown(wait=True)
+        for state in self.states:
+            state['session'].close()
+
+    def verify(self,state):
+        dev = state['dev']
+        with state['slock']:
+            # Another loop on the same session may already have it up
+            ok = state['session'].isAlive() or verifySSH(dev['ip'],dev['user'],dev['password'],dev['port'],
+                                                         dev['type'],state['session'])
+        if ok:
+            print(dev['name'] + ': connectivity test succeeded.')
+            self.schedule(state)
+        else:
+            print(dev['name'] + ': error connecting! TaSc will keep retrying this device every ' +
+                  str(inventoryRetryDelay) + ' seconds.')
+            self.schedule(state,inventoryRetryDelay)
+
+    def event(self,state,tick):
+        '''
+        Action: Run one TaSc event on one device and queue up its next one.
+        '''
+        if self.stopping or state['cancelled']:
+            self.done(state)
+            return
+        with state['slock']:
+            delay = self.runEvent(state,tick)
+        self.schedule(state,delay)
+
+    def runEvent(self,state,tick):
+        '''
+        Output: Minimum number of seconds to wait before the next event (non-zero after an error).
+        '''
+        dev = state['dev']
+        session = state['session']
+        n = tick.n
+        delay = 0
+        log = newLog(state['logdir'])
+        metrics.event(session.name,tick)
+        try:
+            eventstart = time.time()
+            try:
+                session.ensure(self.vb,log)
+            except Exception:
+                state['failures'] += 1
+                state['error'] = 'could not connect'
+                delay = inventoryRetryDelay
+                logNote(log,'Error establishing SSH connection to ' + dev['ip'] + ':' + str(dev['port'])
+                        + ' (attempt ' + str(state['failures']) + '). Will retry.\n\n')
+                print(dev['name'] + ': could not connect for TaSc event ' + str(n) + '.')
+            else:
+                cmds, dbug, window, rule = escalate(self.recorders,session.name,state['cmds'],state['dbug'])
+                if rule is not None:
+                    logNote(log,'Escalated by trigger "' + rule['name'] + '" (' + str(triggerWatch(self.recorders)
+                            .why(session.name)) + ').\n\n')
+                tvalue = float(75/estimateCycle(cmds,state['measured'],session.family))
+                durations = ssh(dev['ip'],dev['user'],dev['password'],dev['enable'],cmds,dev['type'],
+                                dbug,self.vb,dev['port'],tvalue,log,session,False,self.recorders,window)
+                if rule is not None:
+                    triggerWatch(self.recorders).step(session.name)
+                state['measured'].update(durations)
+                state['failures'] = 0
+                state['events'] += 1
+                state['error'] = None
+                print(dev['name'] + ': data for TaSc event ' + str(n) + ' written to log (' +
+                      str(round(time.time() - eventstart,1)) + 's).')
+        except (Exception, SystemExit) as e:
+            session.close()
+            metrics.error(session.name,'event')
+            state['error'] = str(e)
+            delay = inventoryRetryDelay
+            logNote(log,'Error during TaSc event: ' + str(e) + '\n','\n\n')
+            print(dev['name'] + ': error during TaSc event ' + str(n) + '; see log.')
+        finally:
+            log.close()
+        return delay
+
+    def schedule(self,state,mindelay=0):
+        '''
+        Input: Device state, minimum number of seconds to wait before its next event (for retries).
+        Action: Queue the device's next event for when its schedule says it's due.
+        '''
+        interval = escalatedInterval(self.recorders,state['session'].name,state['interval'])
+        if state['sched'].interval != interval:
+            state['sched'].retime(interval)
+        tick = state['sched'].next()
+        with self.lock:
+            if tick is not None and not self.stopping and not state['cancelled']:
+                delay = max(tick.wait,mindelay)
+                state['due'] = time.time() + delay
+                if delay > 0:
+                    # Don't tie up a worker while the device waits for its next start time
+                    timer = threading.Timer(delay,self.pool.submit,(self.event,state,tick))
+                    timer.daemon = True
+                    self.timers = [t for t in self.timers if t.is_alive()]
+                    self.timers.append(timer)
+                    state['timer'] = timer
+                    timer.start()
+                else:
+                    self.pool.submit(self.event,state,tick)
+                return
+        self.done(state)
+
+    def done(self,state):
+        state['session'].close()
+        with self.lock:
+            self.running -= 1
+            if self.running == 0:
+                self.finished.set()
+
+def ringRetention(args):
+    '''
+    Input: Parsed command line arguments with the log options (see parseArgs()).
+    Action: Apply the ring buffer's retention limits (--keep-files, --keep-mb, --keep-hours).
+    '''
+    global ringMaxFiles, ringMaxBytes, ringMaxAge
+    ringMaxFiles = args.keep_files
+    ringMaxBytes = int(args.keep_mb * 1000000)
+    ringMaxAge = args.keep_hours * 3600
+
+def setupRing(args,logroot):
+    '''
+    Input: Parsed command line arguments with the log options (see parseArgs()), log folder (string).
+    Action: Apply the ring buffer, compression and broker options, and start the trace log if asked for.
+    '''
+    global logCompression, useBroker, brokerSocket
+    logCompression = args.compress
+    if args.broker is not None:
+        useBroker = True
+        brokerSocket = args.broker
+    ringRetention(args)
+    if args.trace is not None:
+        tracer.addCallback(SpanLog(args.trace if args.trace != '' else os.path.join(logroot,traceName)))
+
+def setupStorage(args,logroot):
+    '''
+    Input: Parsed command line arguments with the storage options (see parseArgs()), log folder (string).
+    Action: Apply the log options (see setupRing()) and start the recorders.
+    Output: List of recorders asked for (SQLite store, history, time series).
+    '''
+    setupRing(args,logroot)
+    global throttling, deviceRate, globalRate
+    throttling = args.throttle
+    deviceRate = max(args.rate,0)
+    globalRate = max(args.global_rate,0)
+    if args.offload > 0:
+        startOffload(args.offload)
+    recorders = []
+    if args.sqlite is not None:
+        recorders.append(SQLiteStore(args.sqlite if args.sqlite != '' else os.path.join(logroot,sqliteName)))
+    if args.history is not None:
+        recorders.append(HistoryStore(args.history if args.history != '' else os.path.join(logroot,historyName)))
+    if args.series is not None:
+        recorders.append(SeriesStore(args.series if args.series != '' else os.path.join(logroot,seriesName)))
+    if args.triggers is not None:
+        recorders.append(loadTriggers(args.triggers))
+    return recorders
+
+def inventoryMain(args):
+    '''
+    Input: Parsed command line arguments for the inventory subcommand.
+    Action: Load the inventory, get the command set and loop count (prompting for whatever wasn't given on
+    the command line), confirm, and run every device at once with per-device log folders.
+    '''
+    ringRetention(args)
+    print(disclaimerText())
+    devices = loadInventory(args.inventory)
+    for cmd in args.command:
+        commandlist.append(cmd)
+    if len(commandlist) == 0:
+        getCommand(False,'Enter a command to run on every device: ')
+        enough_cmds(False)
+    if args.loops is None or not 0 <= args.loops <= 25000:
+        numberoftimes = getLoops('How many times should TaSc run? (0-25000; 0 = infinite loop): ')
+    else:
+        numberoftimes = args.loops
+    endtime = None
+    if args.until is not None:
+        endtime = parseEndTime(args.until)
+        if endtime is None:
+            print('\n\nERROR: --until must be a time of day as HH:MM (24-hour clock).\n\n')
+            sys.exit(0)
+    logroot = newLogFolder()
+    print('\n\nLogs for each device will be written to a ring buffer in its own folder under ' + logroot)
+    print('\nThe script will run the following commands:\n' + '\n'.join(commandlist) + '\n\non these devices:\n' +
+          '\n'.join([dev['name'] + ' (' + dev['type'] + ', ' + dev['ip'] + ':' + str(dev['port']) + ')' for dev in devices]))
+    if numberoftimes != 0:
+        print('\nThese commands will be run ' + str(numberoftimes) + ' times on each device, ' +
+              str(args.workers) + ' devices at a time.\n\n')
+    else:
+        print('\nThese commands will be run continuously, ' + str(args.workers) + ' devices at a time, until '
+              'TaSc is stopped with Ctrl+C.\n\n')
+    if args.interval > 0:
+        print('Events will start every ' + str(args.interval) + ' seconds, lined up on the clock (overruns: ' +
+              args.overrun + ').')
+    if endtime is not None:
+        print('TaSc will stop at ' + str(endtime) + '.')
+    for family in sorted(set([deviceFamily(dev['type']) for dev in devices])):
+        print(family + ': ' + runEstimate(commandlist,family,args.interval,numberoftimes))
+        warning = cycleWarning(commandlist,family,args.interval)
+        if warning is not None:
+            print(warning)
+    if not args.yes:
+        bigredbutton()
+    global parallelChannels
+    parallelChannels = max(args.parallel,1)
+    recorders = setupStorage(args,logroot)
+    metricsserver = startMetrics(args.metrics) if args.metrics is not None else None
+    runner = InventoryRunner(devices,commandlist,numberoftimes,args.workers,args.verbose,logroot,
+                             args.interval,endtime,args.overrun,recorders)
+    runner.run()
+    closeRecorders(recorders)
+    closeTracing()
+    if metricsserver is not None:
+        metricsserver.shutdown()
+    print('Thanks for using TaSc! Bye!\n')
+
+#
+# SSH BROKER
+#
+
+def sameUser(sock):
+    '''
+    Input: Connected Unix socket.
+    Output: True if the process at the other end runs as this user or root (or the platform can't tell us, in
+    which case the socket's 0600 mode is all there is), False otherwise.
+    '''
+    if not hasattr(socket,'SO_PEERCRED'):
+        return True
+    pid, uid, gid = struct.unpack('3i',sock.getsockopt(socket.SOL_SOCKET,socket.SO_PEERCRED,struct.calcsize('3i')))
+    return uid in [os.getuid(),0]
+
+def unixServer(path,handler):
+    '''
+    Input: Socket path (string), socketserver handler class.
+    Action: Listen on a Unix socket that only this user can connect to. The umask keeps the socket private from
+    the moment it's bound, instead of from the chmod just after.
+    Output: ThreadingUnixStreamServer (not serving yet).
+    '''
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path,handler)
+    finally:
+        os.umask(umask)
+    os.chmod(path,0o600)
+    return server
+
+def brokerRequest(path,request,timeout=None):
+    '''
+    Input: Broker socket path (string), request (dict; see TaScBroker.serve()), seconds to wait (optional).
+    Action: Send the request. For 'exec' and 'shell' requests the socket stays open afterwards as the channel.
+    Output: Tuple of (reply (dict), socket, bytes already read past the reply). Raises OSError if no broker is
+    listening.
+    '''
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        if not sameUser(sock):
+            raise IOError('The TaSc broker on ' + path + ' belongs to another user.')
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        data = b''
+        while b'\n' not in data:
+            more = sock.recv(65536)
+            if not more:
+                raise IOError('The TaSc broker closed the connection.')
+            data += more
+        sock.settimeout(None)
+    except Exception:
+        sock.close()
+        raise
+    line, rest = data.split(b'\n',1)
+    return json.loads(line.decode('utf-8')), sock, rest
+
+# Only say once per process that the broker isn't there
+brokerWarned = False
+
+def brokerMissing():
+    global brokerWarned
+    if not brokerWarned:
+        brokerWarned = True
+        print('No TaSc broker is listening on ' + brokerSocket + ' ("tasc.py broker" starts one); connecting directly.')
+
+class BrokerChannel(object):
+    '''
+    Input: Socket to the broker, opened with an 'exec' or 'shell' request, and any bytes already read from it.
+    Action: Looks enough like a paramiko Channel for TaScSession and readUntil(): the broker relays everything
+    between this socket and the real channel on its connection to the device.
+    '''
+    def __init__(self,sock,data=b''):
+        self.sock = sock
+        self.buffer = data
+        self.eof = False
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def fill(self):
+        try:
+            data = self.sock.recv(readChunk)
+        except OSError:
+            data = b''
+        if data == b'':
+            self.eof = True
+        self.buffer += data
+
+    def recv_ready(self):
+        if len(self.buffer) == 0 and not self.eof and not self.closed:
+            if len(select.select([self.sock],[],[],0)[0]) > 0:
+                self.fill()
+        return len(self.buffer) > 0
+
+    def recv(self,n):
+        if len(self.buffer) == 0 and not self.eof and not self.closed:
+            self.fill()
+        data = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return data
+
+    def exit_status_ready(self):
+        return self.eof and len(self.buffer) == 0
+
+    def sendall(self,data):
+        if isinstance(data,str):
+            data = data.encode('utf-8')
+        self.sock.sendall(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
+
+    def makefile(self,mode='r'):
+        return BrokerFile(self)
+
+    makefile_stdin = makefile
+    makefile_stderr = makefile
+
+class BrokerFile(object):
+    '''
+    Action: stdin/stdout handle for a BrokerChannel, the way paramiko's ChannelFile is for a Channel.
+    '''
+    def __init__(self,channel):
+        self.channel = channel
+
+    def write(self,data):
+        self.channel.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class BrokerClient(object):
+    '''
+    Input: Broker socket path, IP address, ssh dest port, username, password, device type, name.
+    Action: Stands in for paramiko.SSHClient in TaScSession when useBroker is on. connect() has the broker
+    log in to the device if it hasn't already; exec_command() and invoke_shell() open channels on the
+    broker's connection, so the TCP connection, key exchange and AAA login are paid once per device
+    however many TaSc processes and shells use it. get_transport() is the client itself: is_active() and
+    send_ignore() ask the broker about the real transport.
+    '''
+    def __init__(self,path,ip,port,user,pw,dtype,name=None):
+        self.path = path
+        self.device = {'ip':ip,'port':int(port),'user':user,'password':pw,'type':str(dtype),'name':name or ip}
+        self.channels = []
+        self.active = False
+
+    def request(self,op,wait=None,**extra):
+        reply, sock, rest = brokerRequest(self.path,dict(self.device,op=op,**extra),wait)
+        if not reply.get('ok'):
+            sock.close()
+            self.active = False
+            raise IOError(reply.get('error','The TaSc broker refused the request.'))
+        return sock, rest
+
+    def connect(self,timeout=None):
+        # The login itself is bounded by the timeout on the broker's side
+        sock, rest = self.request('connect',None,timeout=timeout)
+        sock.close()
+        self.active = True
+
+    def open(self,op,command=None):
+        sock, rest = self.request(op,None,command=command)
+        chan = BrokerChannel(sock,rest)
+        self.channels.append(chan)
+        return chan
+
+    def exec_command(self,command,bufsize=-1):
+        chan = self.open('exec',command)
+        return chan.makefile_stdin('wb'), chan.makefile('r'), chan.makefile_stderr('r')
+
+    def invoke_shell(self):
+        return self.open('shell')
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self,interval):
+        # The broker keeps its own connections alive
+        pass
+
+    def send_ignore(self):
+        sock, rest = self.request('alive',10)
+        sock.close()
+
+    def close(self):
+        for chan in self.channels:
+            chan.close()
+        self.channels = []
+        self.active = False
+
+class TaScBroker(object):
+    '''
+    Input: Socket to listen on (string, defaults to brokerSocket), seconds to keep an unused connection up.
+    Action: Like an OpenSSH ControlMaster for TaSc: holds one authenticated SSH connection per device (ip, port,
+    user) and lets any TaSc process on the host open channels on it through a Unix socket (readable by this
+    user only). Each request is a line of JSON; 'exec' and 'shell' requests get {"ok": true} back and then
+    the socket carries the channel's bytes both ways until either end closes it. A later request for the same
+    device has to bring the same password before it can ride on the connection. Connections that drop are
+    made again on the next request, and ones with no channels open for `idle` seconds are closed.
+    Output: run() serves until Ctrl+C or a 'stop' request.
+    '''
+    def __init__(self,path=None,idle=brokerIdleClose):
+        self.path = path or brokerSocket
+        self.idle = idle
+        self.lock = threading.Lock()
+        # (ip, port, user) -> {'client':SSHClient,'secret':password hash,'channels':open,'used':time,'lock':Lock,...}
+        self.devices = {}
+        self.quit = threading.Event()
+
+    def device(self,request):
+        '''
+        Output: The held connection for the request's device, logging in first if there isn't a live one.
+        Raises ValueError if the password doesn't match the one the connection was made with.
+        '''
+        key = (str(request['ip']),int(request['port']),str(request['user']))
+        secret = hashlib.sha256(str(request['password']).encode('utf-8')).hexdigest()
+        with self.lock:
+            if key not in self.devices:
+                self.devices[key] = {'client':None,'secret':None,'channels':0,'connects':0,'opened':0,
+                                     'used':time.time(),'lock':threading.Lock(),'name':str(request.get('name'))}
+            held = self.devices[key]
+        with held['lock']:
+            transport = held['client'].get_transport() if held['client'] is not None else None
+            if transport is None or not transport.is_active():
+                if held['client'] is not None:
+                    held['client'].close()
+                held['client'] = None
+                with tracer.span('connect',held['name']):
+                    held['client'] = sshClient(key[0],key[1],key[2],request['password'],request['type'],
+                                               request.get('timeout'))
+                held['secret'] = secret
+                held['connects'] += 1
+            elif held['secret'] != secret:
+                raise ValueError('Wrong password for the broker\'s connection to ' + held['name'] + '.')
+            held['used'] = time.time()
+        return held
+
+    def serve(self,sock):
+        '''
+        Input: Socket for one request.
+        Action: Handle the request: 'connect' (log in if needed), 'alive' (check the connection), 'exec' or
+        'shell' (open a channel and relay it), 'status' or 'stop'.
+        '''
+        data = b''
+        while b'\n' not in data:
+            more = sock.recv(65536)
+            if not more:
+                return
+            data += more
+        line, rest = data.split(b'\n',1)
+        held = None
+        try:
+            request = json.loads(line.decode('utf-8'))
+            op = request.get('op')
+            if op == 'status':
+                return self.reply(sock,{'ok':True,'devices':self.status()})
+            if op == 'stop':
+                self.quit.set()
+                return self.reply(sock,{'ok':True})
+            if op not in ['connect','alive','exec','shell']:
+                raise ValueError('Unknown request "' + str(op) + '".')
+            held = self.device(request)
+            if op == 'alive':
+                held['client'].get_transport().send_ignore()
+            if op in ['connect','alive']:
+                return self.reply(sock,{'ok':True,'connects':held['connects']})
+            chan = held['client'].get_transport().open_session()
+            if op == 'shell':
+                chan.get_pty()
+                chan.invoke_shell()
+            else:
+                chan.exec_command(request['command'])
+        except Exception as e:
+            return self.reply(sock,{'ok':False,'error':str(e) or e.__class__.__name__})
+        with self.lock:
+            held['channels'] += 1
+            held['opened'] += 1
+        try:
+            self.reply(sock,{'ok':True})
+            self.relay(sock,chan,rest)
+        finally:
+            chan.close()
+            with self.lock:
+                held['channels'] -= 1
+                held['used'] = time.time()
+
+    def reply(self,sock,reply):
+        sock.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+
+    def relay(self,sock,chan,data=b''):
+        '''
+        Action: Copy bytes between the client's socket and the channel until either side closes. Anything on
+        stderr is thrown away, so it can't fill the channel's window.
+        '''
+        if len(data) > 0:
+            chan.sendall(data)
+        while True:
+            readable = select.select([sock,chan],[],[],1)[0]
+            while chan.recv_ready():
+                sock.sendall(chan.recv(readChunk))
+            while chan.recv_stderr_ready():
+                chan.recv_stderr(readChunk)
+            if sock in readable:
+                data = sock.recv(readChunk)
+                if not data:
+                    return
+                chan.sendall(data)
+            if chan.closed or (chan.exit_status_ready() and not chan.recv_ready()):
+                return
+
+    def status(self):
+        with self.lock:
+            return [{'device':held['name'],'ip':key[0],'port':key[1],'user':key[2],'channels':held['channels'],
+                     'opened':held['opened'],'connects':held['connects'],'idle':round(time.time() - held['used'],1)}
+                    for key, held in sorted(self.devices.items())]
+
+    def closeIdle(self):
+        with self.lock:
+            idle = [key for key, held in self.devices.items()
+                    if held['channels'] == 0 and time.time() - held['used'] > self.idle]
+            closing = [self.devices.pop(key) for key in idle]
+        for held in closing:
+            if held['client'] is not None:
+                held['client'].close()
+
+    def run(self):
+        if os.path.exists(self.path):
+            try:
+                brokerRequest(self.path,{'op':'status'},5)[1].close()
+            except (IOError, ValueError):
+                # Left over from a broker that didn't shut down cleanly
+                os.remove(self.path)
+            else:
+                print('\n\nERROR: A TaSc broker is already listening on ' + self.path + '\n\n')
+                sys.exit(0)
+        server = unixServer(self.path,TaScBrokerHandler)
+        server.daemon_threads = True
+        server.tasc = self
+        listener = threading.Thread(target=server.serve_forever)
+        listener.daemon = True
+        listener.start()
+        print('TaSc broker listening on ' + self.path)
+        try:
+            while not self.quit.wait(1):
+                self.closeIdle()
+        except KeyboardInterrupt:
+            print('\nEscape sequence detected.')
+        server.shutdown()
+        server.server_close()
+        os.remove(self.path)
+        with self.lock:
+            for held in self.devices.values():
+                if held['client'] is not None:
+                    held['client'].close()
+
+class TaScBrokerHandler(socketserver.BaseRequestHandler):
+    '''
+    Action: One connection to the broker's socket (see TaScBroker.serve()).
+    '''
+    def handle(self):
+        if not sameUser(self.request):
+            return
+        self.server.tasc.serve(self.request)
+
+def brokerMain(args):
+    '''
+    Input: Parsed command line arguments for the broker subcommand.
+    Action: Run the broker, or ask a running one for its status or to stop.
+    '''
+    if not hasattr(socketserver,'ThreadingUnixStreamServer'):
+        print('\n\nERROR: The broker needs Unix sockets, which this platform does not have.\n\n')
+        sys.exit(0)
+    if args.status or args.stop:
+        try:
+            reply, sock, rest = brokerRequest(args.socket,{'op':'stop' if args.stop else 'status'},10)
+            sock.close()
+        except (IOError, ValueError) as e:
+            print('\n\nERROR: Could not reach a TaSc broker on ' + args.socket + ' (' + str(e) + ')\n\n')
+            sys.exit(0)
+        for held in reply.get('devices',[]):
+            print(held['device'] + ' (' + held['user'] + '@' + held['ip'] + ':' + str(held['port']) + ')  channels=' +
+                  str(held['channels']) + '  opened=' + str(held['opened']) + '  logins=' + str(held['connects']) +
+                  '  idle=' + str(held['idle']) + 's')
+        return
+    TaScBroker(args.socket,args.idle).run()
+    print('Thanks for using TaSc! Bye!\n')
+
+#
+# DAEMON MODE
+#
+
+class TaScDaemon(InventoryRunner):
+    '''
+    Input: Size of the worker pool (int), are we logging verbosely? (boolean), folder to create the job log
+    folders in (string), recorders shared by every job (list, optional), control socket path (string).
+    Action: Long-running InventoryRunner that starts with no devices and takes capture jobs from a local
+    Unix socket (see TaScDaemonHandler) or a job file. Each job is one device's loop with its own commands,
+    schedule and log folder. Jobs for the same device (ip, port, user and type) share one session, which
+    stays logged in between jobs for daemonIdleClose seconds, so a new job doesn't pay for a new login. A job
+    only rides on a session that was logged in with the same passwords. The socket only takes jobs from this user.
+    '''
+    def __init__(self,workers,vb,logroot,recorders=None,path=daemonSocket):
+        InventoryRunner.__init__(self,[],[],0,workers,vb,logroot,recorders=recorders)
+        self.logroot = logroot
+        self.path = path
+        self.jobs = collections.OrderedDict()
+        # (ip, port, user, type) -> {'session', 'lock', 'jobs' using it, when it was last 'used', password 'secret'}
+        self.sessions = {}
+        self.nextid = 1
+        self.quit = threading.Event()
+
+    def submit(self,spec):
+        '''
+        Input: Job (dict): an inventory entry (see inventoryDevice()) plus "commands" (list), and optionally
+        "interval" (seconds, 0 = back to back), "count" (0-25000, 0 = until cancelled), "until" (HH:MM) and
+        "overrun" (skip/coalesce/late).
+        Action: Validate the job and start its loop.
+        Output: Job ID (string). Raises ValueError if the job can't be run.
+        '''
+        dev = inventoryDevice(spec,[],False)
+        cmds = spec.get('commands') or []
+        if isinstance(cmds,str):
+            cmds = [cmds]
+        cmds = [str(cmd) for cmd in cmds]
+        if len(cmds) == 0:
+            raise ValueError('Job for ' + dev['name'] + ' has no commands.')
+        try:
+            interval = int(spec.get('interval') or 0)
+            loops = int(spec.get('count') or 0)
+        except (TypeError, ValueError):
+            raise ValueError('Job for ' + dev['name'] + ' has an invalid interval or count.')
+        if interval < 0 or not 0 <= loops <= 25000:
+            raise ValueError('Job for ' + dev['name'] + ' has an invalid interval or count.')
+        endtime = None
+        if spec.get('until'):
+            endtime = parseEndTime(str(spec['until']))
+            if endtime is None:
+                raise ValueError('Job for ' + dev['name'] + ' has an invalid "until" (HH:MM, 24-hour clock).')
+        overrun = spec.get('overrun') or 'skip'
+        if overrun not in overrunPolicies:
+            raise ValueError('Job for ' + dev['name'] + ' has an invalid overrun policy "' + str(overrun) + '".')
+        dbug = False
+        if dev['type'] not in nixList and dev['type'] not in sfrclishList:
+            try:
+                dbug = sanitize_cmds(cmds)
+            except SystemExit:
+                raise ValueError('Job for ' + dev['name'] + ' has no usable commands.')
+        key = (dev['ip'],dev['port'],dev['user'],dev['type'])
+        secret = hashlib.sha256((str(dev['password']) + '\n' + str(dev['enable'])).encode('utf-8')).hexdigest()
+        with self.lock:
+            if self.stopping:
+                raise ValueError('TaSc is shutting down.')
+            held = self.sessions.get(key)
+            if held is not None and held['secret'] != secret:
+                if held['jobs'] > 0:
+                    raise ValueError('Job for ' + dev['name'] + ' has a different password than the jobs already '
+                                     'running on that device.')
+                # Nothing is using the old session, so the new passwords replace it
+                self.sessions.pop(key)['session'].close()
+            if key not in self.sessions:
+                session = TaScSession(dev['ip'],dev['user'],dev['password'],dev['enable'],dev['type'],dev['port'],
+                                      timeout=inventoryConnectTimeout,name=dev['name'])
+                self.sessions[key] = {'session':session,'lock':threading.Lock(),'jobs':0,'used':time.time(),
+                                      'secret':secret}
+            jobid = str(self.nextid)
+            self.nextid += 1
+            held = self.sessions[key]
+            held['jobs'] += 1
+            logdir = os.path.join(self.logroot,'job' + jobid + '-' + dev['name'])
+            state = self.newState(dev,held['session'],held['lock'],logdir,cmds,dbug,
+                                  TaScScheduler(interval,loops,endtime,overrun))
+            state.update({'id':jobid,'key':key,'status':'queued','submitted':str(datetime.datetime.now())})
+            self.jobs[jobid] = state
+            self.running += 1
+        if not os.path.exists(logdir):
+            os.makedirs(logdir)
+        print('Job ' + jobid + ' (' + dev['name'] + ', ' + str(len(cmds)) + ' commands) submitted.')
+        self.pool.submit(self.verify,state)
+        return jobid
+
+    def event(self,state,tick):
+        if state['status'] == 'queued':
+            state['status'] = 'running'
+        InventoryRunner.event(self,state,tick)
+
+    def cancel(self,jobid):
+        '''
+        Action: Stop a job's loop. An event that is already running is left to finish.
+        '''
+        state = self.jobs.get(jobid)
+        if state is None:
+            raise ValueError('No job ' + jobid + '.')
+        state['cancelled'] = True
+        if state['timer'] is not None:
+            state['timer'].cancel()
+        self.done(state)
+
+    def done(self,state):
+        with self.lock:
+            if state['status'] in ['done','cancelled']:
+                return
+            state['status'] = 'cancelled' if state['cancelled'] or self.stopping else 'done'
+            held = self.sessions[state['key']]
+            held['jobs'] -= 1
+            held['used'] = time.time()
+            self.running -= 1
+        print('Job ' + state['id'] + ' (' + state['dev']['name'] + ') ' + state['status'] + '.')
+
+    def status(self,jobid=None):
+        '''
+        Output: List of dicts describing every job (or just the one asked for), oldest first.
+        '''
+        result = []
+        for state in list(self.jobs.values()):
+            if jobid is not None and state['id'] != jobid:
+                continue
+            due = None
+            if state['status'] in ['queued','running'] and state['due'] is not None:
+                due = str(datetime.datetime.fromtimestamp(state['due']))
+            result.append({'id':state['id'],'name':state['dev']['name'],'ip':state['dev']['ip'],
+                           'port':state['dev']['port'],'type':state['dev']['type'],'commands':state['cmds'],
+                           'status':state['status'],'submitted':state['submitted'],'events':state['events'],
+                           'failures':state['failures'],'error':state['error'],'next':due,'logdir':state['logdir']})
+        if jobid is not None and len(result) == 0:
+            raise ValueError('No job ' + jobid + '.')
+        return result
+
+    def handle(self,request):
+        '''
+        Input: Request from the control socket (dict) with an "op" of submit (with a "job" or a list of
+        "jobs"), status (optionally with an "id"), cancel (with an "id") or shutdown.
+        Output: Reply (dict) with "ok" and whatever the op returns. Raises ValueError for a bad request.
+        '''
+        op = request.get('op')
+        if op == 'submit':
+            jobs = request.get('jobs') or [request.get('job')]
+            return {'ok':True,'ids':[self.submit(spec) for spec in jobs if isinstance(spec,dict)]}
+        elif op == 'status':
+            jobid = request.get('id')
+            return {'ok':True,'jobs':self.status(None if jobid is None else str(jobid))}
+        elif op == 'cancel':
+            self.cancel(str(request.get('id')))
+            return {'ok':True}
+        elif op == 'shutdown':
+            self.quit.set()
+            return {'ok':True}
+        raise ValueError('Unknown op "' + str(op) + '" (submit/status/cancel/shutdown).')
+
+    def closeIdle(self):
+        '''
+        Action: Log out of devices that no job has used for daemonIdleClose seconds.
+        '''
+        with self.lock:
+            idle = [key for key, held in self.sessions.items()
+                    if held['jobs'] == 0 and time.time() - held['used'] > daemonIdleClose]
+            for key in idle:
+                self.sessions.pop(key)['session'].close()
+
+    def run(self,jobs=None):
+        '''
+        Input: Jobs to start with (list of dicts, optional).
+        Action: Listen on the control socket and run jobs until a shutdown request (or Ctrl+C), then let
+        running events finish and log out of everything.
+        '''
+        if os.path.exists(self.path):
+            try:
+                daemonRequest(self.path,{'op':'status','id':None})
+            except (IOError, ValueError):
+                # Left over from a TaSc that didn't shut down cleanly
+                os.remove(self.path)
+            else:
+                print('\n\nERROR: A TaSc daemon is already listening on ' + self.path + '\n\n')
+                sys.exit(0)
+        server = unixServer(self.path,TaScDaemonHandler)
+        server.daemon_threads = True
+        server.tasc = self
+        listener = threading.Thread(target=server.serve_forever)
+        listener.daemon = True
+        listener.start()
+        print('TaSc daemon listening on ' + self.path + '; logs go to ' + self.logroot)
+        print('Startup took ' + ', '.join([name + ' ' + str(round(seconds,3)) + 's'
+                                           for name, seconds in sorted(startupTimes().items())]))
+        for spec in jobs or []:
+            try:
+                self.submit(spec)
+            except ValueError as e:
+                print('ERROR: ' + str(e))
+        try:
+            while not self.quit.wait(1):
+                self.closeIdle()
+        except KeyboardInterrupt:
+            print('\nEscape sequence detected.')
+        print('Letting running events finish, then shutting down...')
+        server.shutdown()
+        server.server_close()
+        os.remove(self.path)
+        self.stopping = True
+        with self.lock:
+            for timer in self.timers:
+                timer.cancel()
+        self.pool.shutdown(wait=True)
+        for state in list(self.jobs.values()):
+            self.done(state)
+        for held in self.sessions.values():
+            held['session'].close()
 
-#
-# INPUT COLLECTION LOOPS
-#
+class TaScDaemonHandler(socketserver.StreamRequestHandler):
+    '''
+    Action: One connection to the control socket. Each line in is a JSON request for TaScDaemon.handle(),
+    and each gets one line of JSON back: the reply, or {"ok": false, "error": ...}.
+    '''
+    def handle(self):
+        if not sameUser(self.request):
+            reply = {'ok':False,'error':'Jobs are only taken from this user.'}
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+            return
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if not isinstance(request,dict):
+                    raise ValueError('Requests must be JSON objects.')
+                reply = self.server.tasc.handle(request)
+            except ValueError as e:
+                reply = {'ok':False,'error':str(e)}
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
 
-def getCommand(goodcmd,prompt):
+def daemonRequest(path,request):
     '''
-    Input: Boolean value (must be false for the loop to work), string containing prompt for raw input.
-    Action: Validate input to make sure that command is not blank
-    Output: None, but the global commandlist should be appended with valid commands.
+    Input: Control socket path (string), request (dict; see TaScDaemon.handle()).
+    Output: Reply (dict). Raises IOError if no daemon is listening, or if the socket belongs to another user
+    (jobs carry device passwords, so they're only ever handed to our own daemon).
     '''
-    while goodcmd == False:
-        more = input(prompt)
-        if more != '':
-            goodcmd = True
-            commandlist.append(more)
-        else:
-            print('This field cannot be left blank!\n')
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        if not sameUser(sock):
+            raise IOError('The TaSc daemon on ' + path + ' belongs to another user.')
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        reply = b''
+        while not reply.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                break
+            reply += data
+    finally:
+        sock.close()
+    return json.loads(reply.decode('utf-8'))
 
-def enough_cmds(nuffcmds):
+def loadJobs(path,ask=True):
     '''
-    Input: Boolean value, must be False.
-    Action: Get commands to populate a list of commands to be run at the specified interval.
-    Output: None, but the global commandlist should be populated.
+    Input: Job file (string): a JSON job or list of jobs (see TaScDaemon.submit()), prompt for missing
+    passwords? (boolean).
+    Output: List of job dicts, with passwords filled in if asked to.
     '''
-    while nuffcmds == False:
-        more = input('Enter an additional command to run (or strike Enter to get started): ')
-        if more == '':
-            nuffcmds = True
-        else:
-            commandlist.append(more)
+    try:
+        with open(path) as f:
+            jobs = json.load(f)
+    except (IOError, ValueError) as e:
+        print('\n\nERROR: Could not read job file ' + path + ': ' + str(e) + '\n\n')
+        sys.exit(0)
+    if isinstance(jobs,dict):
+        jobs = [jobs]
+    if ask:
+        for job in jobs:
+            try:
+                job.update(inventoryDevice(job,[]))
+            except ValueError as e:
+                print('\n\nERROR: ' + str(e) + '\n\n')
+                sys.exit(0)
+    return jobs
 
-def amVerbose(goodanswer,prompt):
+def daemonMain(args):
     '''
-    Input: Boolean value, must be False.
-    Action: Get a yes or no answer w/r/t whether we are running in debug/verbose mode (default to No/False)
-    Output: True if verbose, False if not verbose
+    Input: Parsed command line arguments for the daemon subcommand.
+    Action: Run TaSc as a daemon until it's told to shut down.
     '''
-    while goodanswer == False:
-        more = input(prompt)
-        if more in NoList2:
-            goodanswer = True
-            return False
-        elif more in YesList2:
-            goodanswer = True
-            return True
-        else:
-            goodanswer = False
-            print('Please enter "Y" or "N".\n')
+    if not hasattr(socketserver,'ThreadingUnixStreamServer'):
+        print('\n\nERROR: Daemon mode needs Unix sockets, which this platform does not have.\n\n')
+        sys.exit(0)
+    ringRetention(args)
+    print(disclaimerText())
+    jobs = loadJobs(args.jobs) if args.jobs else []
+    logroot = newLogFolder()
+    global parallelChannels
+    parallelChannels = max(args.parallel,1)
+    recorders = setupStorage(args,logroot)
+    metricsserver = startMetrics(args.metrics) if args.metrics is not None else None
+    daemon = TaScDaemon(args.workers,args.verbose,logroot,recorders,args.socket)
+    daemon.run(jobs)
+    closeRecorders(recorders)
+    closeTracing()
+    if metricsserver is not None:
+        metricsserver.shutdown()
+    print('Thanks for using TaSc! Bye!\n')
 
-def bigredbutton():
+def debugMain(args):
     '''
-    Confirm that the user wants to go ahead with the action and provide an escape.
+    Input: Parsed command line arguments for the debug subcommand.
+    Action: Log in, turn the debugs on and stream their output into the log folder's ring buffer until a
+    cap is hit, the end time comes or Ctrl+C, then undebug all.
     '''
-    looper = False
-    while looper == False:
-        uin = input('CONFIRM [Type "yes" or "no"]: ')    
-        if uin in NoList:
-            print('\nOk! Terminating thread. Thanks for using TaSc.\n')
+    ringRetention(args)
+    print(disclaimerText())
+    try:
+        dev = inventoryDevice({'ip':args.ip,'port':args.port,'type':args.type,'user':args.user},[])
+    except ValueError as e:
+        print('\n\nERROR: ' + str(e) + '\n\n')
+        sys.exit(0)
+    if dev['type'] not in asaList and dev['type'] not in iosList:
+        print('\n\nERROR: Continuous debugs are only supported on ASA and IOS devices.\n\n')
+        sys.exit(0)
+    cmds = [cmd for cmd in args.command if cmd.split(' ')[0] in debuglist]
+    if len(cmds) == 0 or len(cmds) != len(args.command):
+        print('\n\nERROR: Give one or more debug commands (and only debug commands) with -c.\n\n')
+        sys.exit(0)
+    if sanitize_cmds(cmds) != True:
+        sys.exit(0)
+    maxseconds = args.max_minutes * 60
+    if args.until is not None:
+        endtime = parseEndTime(args.until)
+        if endtime is None:
+            print('\n\nERROR: --until must be a time of day as HH:MM (24-hour clock).\n\n')
             sys.exit(0)
-        elif uin in YesList2:
-            print('\nOk! Initializing...\n')
-            looper = True
+        untilseconds = (endtime - datetime.datetime.now()).total_seconds()
+        maxseconds = untilseconds if maxseconds <= 0 else min(maxseconds,untilseconds)
+    session = TaScSession(dev['ip'],dev['user'],dev['password'],dev['enable'],dev['type'],dev['port'],name=dev['name'])
+    print('Testing connectivity...')
+    if not verifySSH(dev['ip'],dev['user'],dev['password'],dev['port'],dev['type'],session):
+        print('\n\nERROR: Could not log in to ' + dev['name'] + '. Terminating TaSc.\n\n')
+        sys.exit(0)
+    logroot = newLogFolder()
+    print('\nThe following debugs will be streamed to a ring buffer in ' + logroot + ':\n' + '\n'.join(cmds) + '\n')
+    print('TaSc will send undebug all after ' + (str(round(maxseconds / 60.0,1)) + ' minutes' if maxseconds > 0
+          else 'Ctrl+C') + (', or as soon as the device prints more than ' + str(args.max_rate) + ' KB/s'
+          if args.max_rate > 0 else '') + '.\n')
+    if not args.yes:
+        bigredbutton()
+    setupRing(args,logroot)
+    metricsserver = startMetrics(args.metrics) if args.metrics is not None else None
+    capture = TaScDebugCapture(session,cmds,logroot,maxseconds,args.max_rate * 1000,args.rotate_seconds,
+                               int(args.rotate_mb * 1000000),args.verbose)
+    result = capture.run()
+    session.close()
+    closeTracing()
+    if metricsserver is not None:
+        metricsserver.shutdown()
+    print('Debug stopped (' + result['reason'] + ') after ' + str(round(result['seconds'],1)) + 's: ' +
+          str(result['bytes']) + ' bytes in ' + str(result['files']) + ' log file(s), ' + str(result['reconnects']) +
+          ' reconnect(s), ' + str(round(result['stalled'],1)) + 's waiting on the disk.')
+    if capture.error is not None:
+        print('ERROR writing the log: ' + str(capture.error))
+    print('Thanks for using TaSc! Bye!\n')
 
-def getSSHlogin(goodlogin):
+def pcapMain(args):
     '''
-    Input: Boolean value (must be false for the loop to work).
-    Action: Validate input to make sure that ssh username is not blank
-    Output: SSH Username as a string.
+    Input: Parsed command line arguments for the pcap subcommand.
+    Action: Log in to the ASA, define the capture and stream it into pcap files in a new log folder until
+    the time or size limit or Ctrl+C, then remove the capture.
     '''
-    while goodlogin == False:
-        more = input('SSH Username: ')
-        if more != '':
-            goodlogin = True
-            return more
-        else:
-            print('Username cannot be blank.\n')
+    print(disclaimerText())
+    try:
+        dev = inventoryDevice({'ip':args.ip,'port':args.port,'type':'ASA','user':args.user},[])
+    except ValueError as e:
+        print('\n\nERROR: ' + str(e) + '\n\n')
+        sys.exit(0)
+    session = TaScSession(dev['ip'],dev['user'],dev['password'],dev['enable'],dev['type'],dev['port'],name=dev['name'])
+    print('Testing connectivity...')
+    if not verifySSH(dev['ip'],dev['user'],dev['password'],dev['port'],dev['type'],session):
+        print('\n\nERROR: Could not log in to ' + dev['name'] + '. Terminating TaSc.\n\n')
+        sys.exit(0)
+    nameifs = asaNameifs(session)
+    if args.interface not in nameifs:
+        print('\n\nERROR: ' + dev['name'] + ' has no interface named ' + args.interface + ' (it has: ' +
+              ', '.join(nameifs) + ').\n\n')
+        sys.exit(0)
+    logroot = newLogFolder()
+    print('\nTaSc will capture "' + args.match + '" on ' + args.interface + ' into pcap files in ' + logroot +
+          (' for ' + str(args.minutes) + ' minutes' if args.minutes > 0 else ' until Ctrl+C') + '.\n')
+    if not args.yes:
+        bigredbutton()
+    if args.trace is not None:
+        tracer.addCallback(SpanLog(args.trace if args.trace != '' else os.path.join(logroot,traceName)))
+    capture = TaScPacketCapture(session,args.interface,args.match,logroot,int(args.buffer_mb * 1048576),
+                                args.minutes * 60,int(args.max_mb * 1000000),int(args.rotate_mb * 1000000),args.keep)
+    try:
+        result = capture.run()
+    except ValueError as e:
+        print('\n\nERROR: The ASA would not start the capture: ' + str(e) + '\n\n')
+        sys.exit(0)
+    finally:
+        session.close()
+        closeTracing()
+    print(captureSummary(result))
+    print('Thanks for using TaSc! Bye!\n')
 
-def getDevice(goodvalue,prompt):
+def ctlMain(args):
     '''
-    Input: Boolean value (must be false for the loop to work), string containing prompt for raw input.
-    Action: Validate input to make sure that device type is not blank
-    Output: Returns either 'ASA', 'IOS', 'SFR', or 'Unix'
+    Input: Parsed command line arguments for the ctl subcommand.
+    Action: Send one request to a running daemon and print the answer.
     '''
-    while goodvalue == False:
-        more = input(prompt)
-        if more != '':
-            if more in goodDeviceList:
-                goodvalue = True
-                if more in sfrList:
-                    sfrmore = input('Run commands in CLIsh? (y/N): ')
-                    goodanswer = False
-                    while goodanswer == False:
-                        if sfrmore in NoList2:
-                            goodanswer = True
-                            return more
-                        elif sfrmore in YesList2:
-                            goodanswer = True
-                            return 'sfrclish'
-                        else:
-                            goodanswer = False
-                            print('Please enter "Y" or "N".\n')
-                else:
-                    return more
-            else:
-                print('Valid responses: "ASA", "IOS", "SFR", or "Unix".\n')
-        else:
-            print('This field cannot be left blank!\n')
-    
-def getPort():
+    if args.action == 'submit':
+        if args.arg is None:
+            print('\n\nERROR: submit needs a job file.\n\n')
+            sys.exit(0)
+        request = {'op':'submit','jobs':loadJobs(args.arg)}
+    elif args.action == 'cancel':
+        if args.arg is None:
+            print('\n\nERROR: cancel needs a job ID.\n\n')
+            sys.exit(0)
+        request = {'op':'cancel','id':args.arg}
+    else:
+        request = {'op':args.action,'id':args.arg}
+    try:
+        reply = daemonRequest(args.socket,request)
+    except (IOError, ValueError) as e:
+        print('\n\nERROR: Could not reach a TaSc daemon on ' + args.socket + ': ' + str(e) + '\n\n')
+        sys.exit(0)
+    if not reply.get('ok'):
+        print('ERROR: ' + str(reply.get('error')))
+    elif args.action == 'submit':
+        print('Submitted job(s) ' + ', '.join(reply['ids']))
+    elif args.action == 'status':
+        for job in reply['jobs']:
+            print(job['id'] + '  ' + job['name'] + ' (' + job['type'] + ', ' + job['ip'] + ':' + str(job['port']) +
+                  ')  ' + job['status'] + '  events=' + str(job['events']) + '  failures=' + str(job['failures']) +
+                  ('' if job['next'] is None else '  next=' + job['next']) +
+                  ('' if job['error'] is None else '  error=' + job['error']))
+    else:
+        print('OK')
+
+#
+# COMMAND LINE
+#
+
+def parseArgs(argv=None):
     '''
-    Input: None
-    Action: Get port from raw input.
-    Output: If raw input empty, return 22. Else, return specified port.
+    Input: Command line arguments (list; defaults to sys.argv).
+    Output: argparse Namespace. mode is None when TaSc should run interactively.
     '''
-    validate = False
-    anyOldPort = input('Port [defaults to 22 if left blank]: ')
-    validate = isIntOrBlank(anyOldPort)
-    while validate == False:
-        anyOldPort = input('Please either enter an integer (1-65535) or leave this field blank to use 22: ')
-        validate = isIntOrBlank(anyOldPort)
-    if anyOldPort == '':
-        return 22
-    else:
-        return anyOldPort
+    parser = argparse.ArgumentParser(description='Process command line arguments to run TaSc from CLI.')
+    subparsers = parser.add_subparsers(dest='mode')
+    # Log options shared by inventory, daemon and debug mode
+    ring = argparse.ArgumentParser(add_help=False)
+    ring.add_argument('--keep-files',type=int,default=ringMaxFiles,help='Log files to keep per device '
+                      '(default ' + str(ringMaxFiles) + '; 0 = no limit)')
+    ring.add_argument('--keep-mb',type=float,default=0,help='Megabytes of logs to keep per device (default 0 = no limit)')
+    ring.add_argument('--keep-hours',type=float,default=0,help='Hours of logs to keep per device (default 0 = no limit)')
+    ring.add_argument('-z','--compress',action='store_true',help='Write logs as gzip segments with a timestamp index')
+    ring.add_argument('--trace',nargs='?',const='',help='Write a timing span for every connect, login and command '
+                      'as JSONL (default: ' + traceName + ' in the log folder)')
+    ring.add_argument('--metrics',type=int,metavar='PORT',help='Serve live metrics on this local HTTP port '
+                      '(Prometheus text at /metrics, JSON at /metrics.json)')
+    ring.add_argument('-v','--verbose',action='store_true',help='Log SSH sessions verbosely')
+    ring.add_argument('--broker',nargs='?',const=brokerSocket,metavar='SOCKET',help='Open channels through a running '
+                      'TaSc broker instead of logging in to each device (default socket ' + brokerSocket + ')')
+    # Recorder options shared by inventory and daemon mode
+    storage = argparse.ArgumentParser(add_help=False,parents=[ring])
+    storage.add_argument('--sqlite',nargs='?',const='',help='Also record every command in an SQLite database '
+                         '(default: ' + sqliteName + ' in the log folder)')
+    storage.add_argument('--history',nargs='?',const='',help='Also keep a deduplicated history of every output '
+                         '(default: ' + historyName + '/ in the log folder)')
+    storage.add_argument('--series',nargs='?',const='',help='Also turn parsed show output (CPU, memory, connections, '
+                         'drops, interfaces) into time series (default: ' + seriesName + ' in the log folder)')
+    storage.add_argument('-w','--workers',type=int,default=8,help='How many devices to work on at once (default 8)')
+    storage.add_argument('--parallel',type=int,default=parallelChannels,metavar='N',help='Unix/SFR: run each event\'s '
+                         'commands side by side on up to N channels of the one connection (default 1 = one at a time)')
+    storage.add_argument('--triggers',metavar='FILE',help='JSON trigger rules: watch the outputs and switch a device '
+                         'to a heavier command set, shorter interval or debug window when one matches')
+    storage.add_argument('--offload',type=int,default=offloadWorkers,metavar='N',help='Parse, diff and compress '
+                         'outputs for --history/--series in N worker processes, off the threads reading the devices '
+                         '(default 0 = in this process)')
+    storage.add_argument('--throttle',action='store_true',help='Skip heavy commands and slow down while a device is '
+                         'busy (high CPU, or commands running much slower than usual)')
+    storage.add_argument('--rate',type=float,default=deviceRate,metavar='N',help='At most N commands a minute per '
+                         'device (default 0 = no limit)')
+    storage.add_argument('--global-rate',type=float,default=globalRate,metavar='N',help='At most N commands a minute '
+                         'across all devices (default 0 = no limit)')
+    inv = subparsers.add_parser('inventory',parents=[storage],
+                                help='Run the command set against every device in an inventory file at once.')
+    inv.add_argument('inventory',help='JSON or CSV inventory file (ip, port, type, user, password, enable, name)')
+    inv.add_argument('-c','--command',action='append',default=[],help='Command to run (repeat for more than one)')
+    inv.add_argument('-l','--loops',type=int,help='How many times to run (0-25000; 0 = infinite loop)')
+    inv.add_argument('-i','--interval',type=int,default=0,help='Seconds between the start of each event, lined up on '
+                     'the clock (default 0 = back to back)')
+    inv.add_argument('--until',help='Stop at this time of day (HH:MM, 24-hour clock)')
+    inv.add_argument('--overrun',choices=overrunPolicies,default='skip',help='What to do when an event runs past '
+                     'the next start time (default skip)')
+    inv.add_argument('-y','--yes',action='store_true',help='Skip the confirmation prompt')
+    dmn = subparsers.add_parser('daemon',parents=[storage],
+                                help='Run in the background and take capture jobs over a local control socket.')
+    dmn.add_argument('--socket',default=daemonSocket,help='Control socket path (default ' + daemonSocket + ')')
+    dmn.add_argument('--jobs',help='JSON file of jobs to start with (inventory fields plus commands, interval, '
+                     'count, until, overrun)')
+    dbg = subparsers.add_parser('debug',parents=[ring],
+                                help='Stream debug output continuously into rotating logs, with no gaps.')
+    dbg.add_argument('ip',help='IP address of the ASA or IOS device')
+    dbg.add_argument('-t','--type',default='ASA',help='Device type (ASA or IOS; default ASA)')
+    dbg.add_argument('-p','--port',default='22',help='SSH port (default 22)')
+    dbg.add_argument('-u','--user',help='SSH username')
+    dbg.add_argument('-c','--command',action='append',default=[],help='Debug command to run (repeat for more than one)')
+    dbg.add_argument('--max-minutes',type=float,default=debugMaxSeconds / 60.0,help='Send undebug all after this many '
+                     'minutes (default ' + str(debugMaxSeconds // 60) + '; 0 = no limit)')
+    dbg.add_argument('--max-rate',type=float,default=debugMaxRate / 1000.0,help='Send undebug all if the device prints '
+                     'more than this many KB/s over ' + str(debugRateWindow) + ' seconds (default ' +
+                     str(debugMaxRate // 1000) + '; 0 = no limit)')
+    dbg.add_argument('--rotate-seconds',type=float,default=debugRotateSeconds,help='Start a new log file this often '
+                     '(default ' + str(debugRotateSeconds) + ')')
+    dbg.add_argument('--rotate-mb',type=float,default=debugRotateBytes / 1000000.0,help='Start a new log file at this '
+                     'size (default ' + str(debugRotateBytes // 1000000) + ')')
+    dbg.add_argument('--until',help='Stop at this time of day (HH:MM, 24-hour clock)')
+    dbg.add_argument('-y','--yes',action='store_true',help='Skip the confirmation prompt')
+    cap = subparsers.add_parser('pcap',help='Capture packets on an ASA and stream them into rotating local pcap files.')
+    cap.add_argument('ip',help='IP address of the ASA')
+    cap.add_argument('-p','--port',default='22',help='SSH port (default 22)')
+    cap.add_argument('-u','--user',help='SSH username')
+    cap.add_argument('-i','--interface',required=True,help='Interface (nameif) to capture on')
+    cap.add_argument('-m','--match',default='ip any any',help='What to capture, as an ASA capture match '
+                     '(e.g. "tcp host 10.1.1.1 host 10.2.2.2 eq 443"; default "ip any any")')
+    cap.add_argument('--buffer-mb',type=float,default=pcapBuffer / 1048576.0,help='Capture buffer on the ASA '
+                     '(default ' + str(pcapBuffer // 1048576) + ' MB; at most 32)')
+    cap.add_argument('--minutes',type=float,default=0,help='Stop after this many minutes (default 0 = Ctrl+C)')
+    cap.add_argument('--max-mb',type=float,default=0,help='Stop after this many megabytes of packets (default 0 = no limit)')
+    cap.add_argument('--rotate-mb',type=float,default=pcapRotateBytes / 1000000.0,help='Start a new pcap file at this '
+                     'size (default ' + str(pcapRotateBytes // 1000000) + ')')
+    cap.add_argument('--keep',type=int,default=pcapKeepFiles,help='Pcap files to keep (default 0 = all of them)')
+    cap.add_argument('--trace',nargs='?',const='',help='Write a timing span for the capture (default: ' + traceName +
+                     ' in the log folder)')
+    cap.add_argument('-v','--verbose',action='store_true',help='Log SSH sessions verbosely')
+    cap.add_argument('-y','--yes',action='store_true',help='Skip the confirmation prompt')
+    brk = subparsers.add_parser('broker',help='Hold one SSH connection per device for every TaSc process on this host.')
+    brk.add_argument('--socket',default=brokerSocket,help='Socket path (default ' + brokerSocket + ')')
+    brk.add_argument('--idle',type=float,default=brokerIdleClose,help='Seconds to keep an unused connection up '
+                     '(default ' + str(brokerIdleClose) + ')')
+    brk.add_argument('--status',action='store_true',help='Show a running broker\'s connections')
+    brk.add_argument('--stop',action='store_true',help='Stop a running broker')
+    ctl = subparsers.add_parser('ctl',help='Talk to a running TaSc daemon.')
+    ctl.add_argument('action',choices=['submit','status','cancel','shutdown'],help='What to ask the daemon to do')
+    ctl.add_argument('arg',nargs='?',help='Job file (submit) or job ID (status, cancel)')
+    ctl.add_argument('--socket',default=daemonSocket,help='Control socket path (default ' + daemonSocket + ')')
+    ext = subparsers.add_parser('extract',help='Pull command output back out of compressed log segments by time.')
+    ext.add_argument('logdir',help='Folder holding the .log.gz segments')
+    ext.add_argument('--start',help='Earliest timestamp (YYYY-MM-DD HH:MM:SS)')
+    ext.add_argument('--end',help='Latest timestamp (YYYY-MM-DD HH:MM:SS)')
+    ext.add_argument('-c','--command',help='Only output from commands containing this text')
+    sch = subparsers.add_parser('search',help='Find command output across TaSc logs through an index kept up to date '
+                                'as they grow.')
+    sch.add_argument('folder',nargs='?',default=logloc,help='Folder to search: one session folder, or (the default) '
+                     'all of ' + logloc)
+    sch.add_argument('-c','--command',help='Only commands containing this text')
+    sch.add_argument('--start',help='Earliest timestamp (YYYY-MM-DD HH:MM:SS)')
+    sch.add_argument('--end',help='Latest timestamp (YYYY-MM-DD HH:MM:SS)')
+    sch.add_argument('-p','--pattern',help='Regular expression to look for in the output; matching lines are printed')
+    sch.add_argument('-w','--word',help='Word the output has to contain, e.g. an address or interface name (answered '
+                     'from the index once it has words)')
+    sch.add_argument('-t','--tokens',action='store_true',help='Index the words in every output too. The first time '
+                     'reads everything again; the index keeps them from then on')
+    sch.add_argument('-o','--output',action='store_true',help='Print each matching output in full')
+    sch.add_argument('--index',help='Index file (default ' + searchIndexName + ' in the folder)')
+    sch.add_argument('--rebuild',action='store_true',help='Throw the index away and build it again')
+    sch.add_argument('--no-update',action='store_true',help='Answer from the index as it is, without looking for '
+                     'new logs')
+    qry = subparsers.add_parser('query',help='Look up recorded commands in a TaSc SQLite database.')
+    qry.add_argument('database',help='Path of the SQLite database')
+    qry.add_argument('-d','--device',help='Only this device')
+    qry.add_argument('-c','--command',help='Only commands containing this text')
+    qry.add_argument('--start',help='Earliest timestamp (YYYY-MM-DD HH:MM:SS)')
+    qry.add_argument('--end',help='Latest timestamp (YYYY-MM-DD HH:MM:SS)')
+    qry.add_argument('-o','--output',action='store_true',help='Print each output too')
+    his = subparsers.add_parser('history',help='List or rebuild outputs from a deduplicated history.')
+    his.add_argument('root',help='History folder')
+    his.add_argument('-d','--device',help='Device (as named in the history)')
+    his.add_argument('-c','--command',help='Command (as named in the history)')
+    his.add_argument('--changed',action='store_true',help='Only list events where the output changed')
+    his.add_argument('-n','--event',type=int,help='Print the full output of this event')
+    trc = subparsers.add_parser('trace',help='Show where the time goes, from a trace written with --trace.')
+    trc.add_argument('file',help='Trace file (' + traceName + ')')
+    trc.add_argument('-d','--device',help='Only this device')
+    ser = subparsers.add_parser('series',help='Summarize the time series parsed out of show commands.')
+    ser.add_argument('file',help='Series file written by TaSc (' + seriesName + ')')
+    ser.add_argument('-d','--device',help='Only this device')
+    ser.add_argument('-f','--field',help='Only fields starting with this (e.g. cpu, if.outside)')
+    ser.add_argument('--start',help='Earliest timestamp (YYYY-MM-DD HH:MM:SS)')
+    ser.add_argument('--end',help='Latest timestamp (YYYY-MM-DD HH:MM:SS)')
+    cst = subparsers.add_parser('costs',help='Show how long each command has taken, and the timeout TaSc now gives it.')
+    cst.add_argument('-f','--file',help='Cost model file (default ' + costModelPath + ')')
+    cst.add_argument('-t','--family',choices=['asa','ios','unix','sfr','sfrclish'],help='Only this device family')
+    return parser.parse_args(argv)
 
-def getLoops(prompt):
+def searchMain(args):
     '''
-    Input: A prompt (str) to feed to the user to retrieve the number of loops to run.
-    Action: Get loop count & verify format.
-    Output: Return loop count as an integer.
+    Input: Parsed command line arguments for the search subcommand.
+    Action: Bring the folder's search index up to date, then print the events that match, oldest first.
     '''
-    goodLoop = False
-    while goodLoop == False:
-        more = input(prompt)
+    try:
+        start = parseStamp(args.start) if args.start else None
+        end = parseStamp(args.end) if args.end else None
+    except ValueError:
+        print('\n\nERROR: --start and --end must look like YYYY-MM-DD HH:MM:SS\n\n')
+        sys.exit(0)
+    if args.pattern is not None:
         try:
-            intmore = int(more)
-        except:
-            print('\nError: Value must be an integer between 0 and 25000.\n')
-        else:
-            if intmore < 0:
-                goodLoop = False
-                print('\nError: Value must be an integer between 0 and 25000.\n')
-            elif intmore > 25000:
-                goodLoop = False
-                print('\nError: Value must be an integer between 0 and 25000.\n')
-            else:
-                goodLoop = True
-                return intmore
+            re.compile(args.pattern)
+        except re.error as e:
+            print('\n\nERROR: --pattern is not a valid regular expression (' + str(e) + ')\n\n')
+            sys.exit(0)
+    if not os.path.isdir(args.folder):
+        print('\n\nERROR: ' + args.folder + ' is not a folder\n\n')
+        sys.exit(0)
+    started = time.monotonic()
+    index = LogIndex(args.folder,args.index,args.tokens)
+    if args.rebuild:
+        index.clear()
+    if not args.no_update:
+        nfiles, nevents = index.update()
+        if nfiles > 0:
+            print('Indexed ' + str(nevents) + ' events from ' + str(nfiles) + ' new or changed logs in ' +
+                  str(round(time.monotonic() - started,2)) + 's')
+    started = time.monotonic()
+    matched = 0
+    for path, event, lines in index.search(args.command,start,end,args.pattern,args.word):
+        matched += 1
+        print(path + '@' + str(event['start']) + ' [' + event['time'] + '] ' + event['kind'] + ' from command "' +
+              event['command'] + '"')
+        for line in lines:
+            print('    ' + line.decode('utf-8',errors='replace').rstrip('\r'))
+        if args.output:
+            print(searchOutput(path,event))
+    print(str(matched) + ' matching events (' + str(round((time.monotonic() - started) * 1000,1)) + ' ms)')
+    index.close()
 
-def verifySSH(ip,user,pw,port,dtype):
+def queryMain(args):
     '''
-    Input: SSH IP address, username, password, device type
-    Action: SSH/login to specified address with given credentials.
-    Output: True if SSH connection works, False if it fails in some way.
+    Input: Parsed command line arguments for the query subcommand.
+    Action: Print the commands in an SQLite store that match, oldest first.
     '''
-    # Create instance of SSHClient object
-    run_pre = paramiko.SSHClient()
-    # Automatically add untrusted hosts (make sure okay for security policy in your environment)
-    run_pre.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    # initiate test SSH connection
-    value = False
-    if str(dtype) not in sfrclishList:
-        try:
-            run_pre.connect(ip, username=user, password=pw, look_for_keys=False, allow_agent=False, timeout=4, port=port)
-        except:
-            value = False
-        else:
-            value = True
+    try:
+        start = parseStamp(args.start) if args.start else None
+        end = parseStamp(args.end) if args.end else None
+    except ValueError:
+        print('\n\nERROR: --start and --end must look like YYYY-MM-DD HH:MM:SS\n\n')
+        sys.exit(0)
+    for row in queryStore(args.database,args.device,args.command,start,end):
+        print('[' + row['time'] + '] ' + row['device'] + ' "' + row['command'] + '" ' + str(round(row['duration'],2)) +
+              's, ' + str(row['bytes']) + ' bytes' + ('' if row['finished'] else ' (incomplete)'))
+        if args.output:
+            if row['output'] is not None:
+                print(row['output'])
+            elif row['pointer'] is not None:
+                print(readPointer(row['pointer'],row['bytes']))
+
+def historyMain(args):
+    '''
+    Input: Parsed command line arguments for the history subcommand.
+    Action: Without a device and command, list the streams in the history. With them, list the stream's
+    events (or only the ones that changed), or print one event's output in full.
+    '''
+    reader = HistoryReader(args.root)
+    if args.device is None or args.command is None:
+        for device, command in reader.streams():
+            print(device + '  ' + command)
+        return
+    device = re.sub(r'[^\w\-.]+','_',args.device)
+    command = re.sub(r'[^\w\-.]+','_',args.command)
+    if args.event is not None:
+        print(reader.rebuild(device,command,args.event))
+    elif args.changed:
+        for entry in reader.changes(device,command):
+            print(str(entry['n']) + '  [' + entry['time'] + ']  ' + entry['kind'] + '  ' + str(entry['bytes']) + ' bytes')
     else:
-        try:
-            run_pre.connect(ip, username=user, password=pw, port=port)
-        except:
-            value = False
-        else:
-            value = True
-    # Close connection
-    run_pre.close()
-    return value
+        for entry in reader.events(device,command):
+            print(str(entry['n']) + '  [' + entry['time'] + ']  ' + entry['kind'] + '  ' + str(entry['bytes']) + ' bytes')
 
-#
-# INTERACTIVE ASA PACKET CAPTURE
-#
+def traceMain(args):
+    '''
+    Input: Parsed command line arguments for the trace subcommand.
+    Action: Print, per device, phase and command, how many spans there were, their mean, 90th percentile,
+    worst and total time, and how many timed out or failed, most total time first.
+    '''
+    groups = {}
+    for span in readTrace(args.file):
+        if args.device is not None and span['device'] != args.device:
+            continue
+        key = (span['device'],span['name'],span['command'] or '')
+        groups.setdefault(key,[]).append(span)
+    rows = []
+    for key, spans in groups.items():
+        times = sorted([span['duration'] for span in spans])
+        bad = len([span for span in spans if span['outcome'] not in ['ok','interrupted']])
+        rows.append((sum(times),key,len(times),times,bad,sum([span['bytes'] for span in spans])))
+    for total, (device, name, command), count, times, bad, nbytes in sorted(rows,reverse=True):
+        print(device + '  ' + name + ('  "' + command + '"' if command != '' else '') + '  n=' + str(count) +
+              '  mean=' + str(round(total / count,3)) + 's  p90=' + str(round(times[max(int(math.ceil(0.9 * count)) - 1,0)],3)) +
+              's  max=' + str(round(times[-1],3)) + 's  total=' + str(round(total,1)) + 's  bytes=' + str(nbytes) +
+              ('  failed/timed out=' + str(bad) if bad > 0 else ''))
 
-def shallWePlay(prompt):
+def seriesMain(args):
     '''
-    Input: Prompt to display to user
-    Action: Get a yes or no answer w/r/t whether to take an ASA pcap
-    Output: True if taking a pcap, False if not taking a pcap
+    Input: Parsed command line arguments for the series subcommand.
+    Action: Print min/mean/max, percentiles and rate for every series that matches.
     '''
-    goodanswer = False
-    while goodanswer == False:
-        more = input(prompt)
-        if more in NoList2:
-            goodanswer = True
-            return False
-        elif more in YesList2:
-            goodanswer = True
-            return True
-        else:
-            goodanswer = False
-            print('Please enter "Y" or "N".\n')
+    try:
+        start = time.mktime(parseStamp(args.start).timetuple()) if args.start else None
+        end = time.mktime(parseStamp(args.end).timetuple()) if args.end else None
+    except ValueError:
+        print('\n\nERROR: --start and --end must look like YYYY-MM-DD HH:MM:SS\n\n')
+        sys.exit(0)
+    store = loadSeries(args.file)
+    for (device, field), stats in sorted(store.summary(args.device,args.field,start,end).items()):
+        if len(stats) == 0:
+            continue
+        rate = 'n/a' if stats['rate'] is None else str(round(stats['rate'],3)) + '/s'
+        print(device + '  ' + field + '  n=' + str(stats['count']) + '  min=' + str(stats['min']) + '  mean=' +
+              str(round(stats['mean'],2)) + '  max=' + str(stats['max']) + '  p50=' + str(stats['p50']) + '  p90=' +
+              str(stats['p90']) + '  p99=' + str(stats['p99']) + '  last=' + str(stats['last']) + '  rate=' + rate)
 
-def pcap(asaip,port,user,pw,enpw,vb):
+def costsMain(args):
     '''
-    Outline: This function steps in after we give the details for an ASA in the Main() loop and verify it.
-                We'll ask if they want to run a packet capture. If yes, get a server for the ASA to dump the pcaps,
-                the five-tuple, the interface, and an interval to run at.
-    
-    Input: The following should be passed from Main():
-            IP address of ASA, dest port for SSH (if not 22), username, password, enable password,
-            whether we're verbose.
-           
-           pcap() should get the following from the user:
-            Five-tuple, interface (list nameifs on ASA for user and pass them back as a reminder),
-            IP address for (t)ftp server to send captures to, 
-    '''
-    # Initialize list for nameifs
-    nameifList = []
-    # Initialize list of (ifc_id,nameif) tuples
-    nameifTuples = []
-    # Initialize ifc_id for for-loop
-    ifc_id=0
-    # Create instance of SSHClient object
-    run = paramiko.SSHClient()
-    # Automatically add untrusted hosts
-    run.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    # Connect to ASA
-    run.connect(asaip, username=user, password=pw, port=port, look_for_keys=False, allow_agent=False)
-    # Enable
-    stdin, stdout, stderr = run.exec_command(('enable\n'+enpw+'\n'),bufsize=10000000)
-    time.sleep(1)
-    # Term page 0
-    stdin.write("terminal page 0\n")
-    stdin.flush()
-    time.sleep(1)
-    d_out1 = stdout.channel.recv(10000000)
-    d_out2 = d_out1.decode('ISO-8859-1')
-    # Get nameifs for dialogue
-    stdin.write("show nameif\n")
-    stdin.flush()
-    d_out1 = stdout.channel.recv(10000000)
-    d_out2 = d_out1.decode('ISO-8859-1')
-    nameifList = d_out2.split('\n')
-    # Get a list of nameifs and assign an ifc id to each one
-    # So we can later verify that the nameif given is valid
-    #
-    for line in nameifList[2:]:
-        noSpacesLine = line.split(' ')
-        nameifTuples.append((ifc_id,noSpacesLine[1]))
-        ifc_id +=1
-    # Result = we now have a list of ASA nameifs, each assigned to an ifc id
-    # inside nameifTuples, which now looks like [(0,'inside'),(1,'dmz'),(2,'outside')]
-    #
-    #
-    # Give user a list of ASA nameifs to help with the capture tool
-    print('\n\n Current interface names on device:\n')
-    n = 1
-    for line in nameifList[1:]:
-        print(str(n) + '.     ' + str(line))
-        n+=1
-    ingress_ifc = input('Select the ingress interface (Enter a number from the list 1-'+str(n-1)+':\n\n')
-    pass
+    Input: Parsed command line arguments for the costs subcommand.
+    Action: Print, per device family and command, the recent runs, their mean and worst time and size,
+    how many timed out, and the timeout the command gets now.
+    '''
+    model = CostModel(args.file) if args.file is not None else costs
+    for row in model.rows(args.family):
+        print(row['family'] + '  "' + row['command'] + '"  n=' + str(row['runs']) + '  mean=' + str(round(row['mean'],2)) +
+              's  max=' + str(round(row['max'],2)) + 's  bytes=' + str(row['bytes']) + '  timeout=' + str(row['timeout']) +
+              's' + ('  timed out=' + str(row['timeouts']) if row['timeouts'] > 0 else ''))
+
+def extractMain(args):
+    '''
+    Input: Parsed command line arguments for the extract subcommand.
+    Action: Print every matching command output from the compressed segments in a folder.
+    '''
+    try:
+        start = parseStamp(args.start) if args.start else None
+        end = parseStamp(args.end) if args.end else None
+    except ValueError:
+        print('\n\nERROR: --start and --end must look like YYYY-MM-DD HH:MM:SS\n\n')
+        sys.exit(0)
+    for name, entry, text in extractEvents(args.logdir,start,end,args.command):
+        print('===== ' + name + ' @ ' + entry['time'] + ' =====' + text)
 
 
 #
@@ -727,7 +6150,9 @@ def pcap(asaip,port,user,pw,enpw,vb):
 #
 
 def main():
-    print(disclaimer)
+    print(disclaimerText())
+    logfolder = newLogFolder()
+    os.chdir(logfolder)
     verbose = amVerbose(False,'\n\nRun in verbose mode? (y/N): ')
     #
     # SSH info
@@ -757,7 +6182,8 @@ def main():
         sshenpw = 'UnixHasNoEnablePassword'
     while goodSSH == False:
         print('Testing connectivity...')
-        goodSSH = verifySSH(sship,sshuser,sshpw,sshport,deviceType)
+        session = TaScSession(sship,sshuser,sshpw,sshenpw,deviceType,sshport)
+        goodSSH = verifySSH(sship,sshuser,sshpw,sshport,deviceType,session)
         if goodSSH == False:
             while goodSSH == False:
                 print('Error connecting to remote host! Please re-enter IP address and credentials:\n')
@@ -769,7 +6195,8 @@ def main():
                 sshuser = getSSHlogin(False)
                 sshpw = getpass.getpass('SSH Password: ')
                 print('Testing connectivity...')
-                goodSSH = verifySSH(sship,sshuser,sshpw,sshport,deviceType)
+                session = TaScSession(sship,sshuser,sshpw,sshenpw,deviceType,sshport)
+                goodSSH = verifySSH(sship,sshuser,sshpw,sshport,deviceType,session)
                 if goodSSH:
                     print('Success!')
         else:
@@ -778,10 +6205,11 @@ def main():
     #
     # Check whether we want to run a pcap
     #
+    upForCap = False
     if str(deviceType) in asaList:
         upForCap = shallWePlay('\n\nWould you like to run a Packet Capture on this ASA? (y/N): ')
     if upForCap == True:
-        pcap(sship,sshport,sshuser,sshpw,sshenpw,verbose)
+        pcap(session,verbose)
     else:
         pass
     #
@@ -796,25 +6224,93 @@ def main():
             debugchk = False
     else:
         debugchk = False
+    if deviceFamily(deviceType) in markerDevices and len(commandlist) > 1:
+        if amVerbose(False,'Run the commands side by side on up to ' + str(parallelDefault) + ' channels of the one '
+                     'connection? (y/N): ') == True:
+            global parallelChannels
+            parallelChannels = parallelDefault
+    continuous = False
+    if debugchk == True:
+        continuous = amVerbose(False,'Stream debug output continuously instead of ' + str(debugWindow) +
+                               ' seconds per event? (y/N): ')
+    if continuous == True:
+        dropped = [cmd for cmd in commandlist if cmd.split(' ')[0] not in debuglist]
+        for cmd in dropped:
+            commandlist.remove(cmd)
+        if len(dropped) > 0:
+            print('NOTE: Show commands can\'t share the session with a continuous debug, so these will not be run: ' +
+                  ', '.join(dropped))
     #
     # Time
     #
-    numberoftimes = getLoops('How many times should TaSc run? (0-25000; 0 = infinite loop): ')
+    if continuous == True:
+        maxminutes = getLoops('Send undebug all after how many minutes? (0-25000; 0 = only on Ctrl+C or if the device '
+                              'prints more than ' + str(debugMaxRate // 1000) + ' KB/s): ')
+        numberoftimes = 1
+        interval = 0
+    else:
+        numberoftimes = getLoops('How many times should TaSc run? (0-25000; 0 = infinite loop): ')
+        interval = getInterval('How many seconds between the start of each event? (0-86400; blank or 0 = back to back): ')
+    endtime = getEndTime('Stop at what time? (HH:MM, 24-hour clock; leave blank to only use the loop count): ')
+    if interval > 0:
+        overrun = getOverrun('If an event runs past the next start time, should TaSc skip the missed event, '
+                             'coalesce missed events into one, or run them late? (skip/coalesce/late) [skip]: ')
+    else:
+        overrun = 'skip'
+    if continuous == False:
+        global throttling
+        throttling = amVerbose(False,'Skip heavy commands (show tech, show conn...) and slow down while the device '
+                               'is busy? (y/N): ')
     #
     # Log
     #
+    global logCompression
+    logCompression = amVerbose(False,'Compress logs as they are written (gzip segments with a timestamp index)? (y/N): ')
+    recorders = []
+    # A continuous debug is one long output, not a command per event, so there's nothing to record
+    if continuous == False:
+        if amVerbose(False,'Also record every command in an SQLite database in the log folder? (y/N): ') == True:
+            store = SQLiteStore(os.path.join(os.getcwd(),sqliteName))
+            recorders.append(store)
+        if amVerbose(False,'Keep a deduplicated history of every output (only changes are stored)? (y/N): ') == True:
+            recorders.append(HistoryStore(os.path.join(os.getcwd(),historyName)))
+        if amVerbose(False,'Turn CPU, memory, connection, drop and interface counters into time series? (y/N): ') == True:
+            recorders.append(SeriesStore(os.path.join(os.getcwd(),seriesName)))
+        if len([recorder for recorder in recorders if isinstance(recorder,(HistoryStore,SeriesStore))]) > 0:
+            workers = getOffloadWorkers('Parse and diff outputs in how many worker processes? (leave blank to do it '
+                                        'in this one): ')
+            if workers > 0:
+                startOffload(workers)
+        triggers = getTriggerFile('Escalate on trigger rules from a JSON file? (path; leave blank for none): ')
+        if triggers is not None:
+            recorders.append(loadTriggers(triggers))
+    if amVerbose(False,'Write a timing trace of every connect, login and command (JSONL)? (y/N): ') == True:
+        tracer.addCallback(SpanLog(os.path.join(os.getcwd(),traceName)))
+    metricsport = getMetricsPort('Serve live metrics over local HTTP on which port? (leave blank for none): ')
     print(('\n\nA directory called TaScLog has been generated on your Desktop. This program will '
-           'write to a ring buffer of timestamped files in this directory and has been hard-coded '
-           'not to exceed 120 files. This should allow sufficient space for approximately 10 hours of logs.'))
+           'write to a ring buffer of timestamped files in this directory and keep ' + ringLimits() + '.'))
     #
     # Confirm
     #
-    if numberoftimes != 0:
+    if continuous == True:
+        print(('\nTaSc will turn on the following debugs and stream their output until ' +
+               (str(maxminutes) + ' minutes have passed, ' if maxminutes > 0 else '') + 'it is stopped with Ctrl+C ' +
+               'or the device prints too much, and then send undebug all:\n' + '\n'.join(commandlist) + '\n\n'))
+    elif numberoftimes != 0:
         print(('\nThe script will run the following commands:\n' + '\n'.join(commandlist) + '\n\n'
                 + 'These commands will be run ' + str(numberoftimes) + ' times.\n\n'))
     else:
         print(('TaSc will run the following commands continuously, either until it is manually stopped '
                'with Ctrl+C or until it encounters an error:\n' + '\n'.join(commandlist) + '\n\n'))
+    if interval > 0:
+        print('Events will start every ' + str(interval) + ' seconds, lined up on the clock (overruns: ' + overrun + ').')
+    if endtime is not None:
+        print('TaSc will stop at ' + str(endtime) + '.')
+    if continuous == False:
+        print(runEstimate(commandlist,deviceFamily(deviceType),interval,numberoftimes))
+        warning = cycleWarning(commandlist,deviceFamily(deviceType),interval)
+        if warning is not None:
+            print(warning)
     bigredbutton()
     #
     # PROGRESS BAR
@@ -822,67 +6318,113 @@ def main():
     #
     # Find how much we can increment progress bar every second
     # total time the full operation will take is equal to t
-    # so t = (num of non-debug events * 45) + (num of debug events * 60)
+    # so t = the sum of how long each command took last time it ran, this run or earlier ones (see estimateCycle())
     # and we will come up with a tvalue (sshtvalue), which is
     # the amount that we need to increment the bar every second to ensure
     # that we hit 75 units of bar in the anticipated amount of time.
-    t = float(0)
-    for cmd in commandlist:
-        split3 = cmd.split(' ')   
-        if split3[0] in debuglist:
-            t += 60.0
-        else:
-            t += 45.0
+    # measured is refreshed after every event, so the bar (and ETA) track what the device really needs.
+    measured = {}
+    t = estimateCycle(commandlist,measured,deviceFamily(deviceType))
     sshtvalue = float(75/t)
     #
     # Run
     #
-    # Loop counters
-    i = numberoftimes
-    n = 1
+    scheduler = TaScScheduler(interval,numberoftimes,endtime,overrun)
+    metricsserver = None
+    if metricsport is not None:
+        try:
+            metricsserver = startMetrics(metricsport)
+        except (OSError, OverflowError) as e:
+            print('Could not serve metrics on port ' + str(metricsport) + ' (' + str(e) + '); carrying on without them.')
     if verbose == True:
+        logger = open(os.path.basename(logfolder) + '.log','a',1)
+        logger.write('\n\n[' + str(datetime.datetime.now()) + '] Startup times: ' + str(startupTimes()) + '\n')
         logger.write('\n\n[' + str(datetime.datetime.now()) + '] Initializing main loop.\n')
         logger.write('\n\n[' + str(datetime.datetime.now()) + '] Vars: ' + 'sship=' + str(sship) +
                      ', sshuser=' + sshuser + ', commandlist=' + str(commandlist) + ', deviceType=' +
                      deviceType + ', debugchk=' + str(debugchk) + ', verbose='+str(verbose) + ', sshport=' +
-                     str(sshport) + ', sshtvalue=' + str(sshtvalue) + '\n')        
+                     str(sshport) + ', sshtvalue=' + str(sshtvalue) + ', interval=' + str(interval) +
+                     ', endtime=' + str(endtime) + ', overrun=' + overrun + '\n')
         logger.close()
     else:
         pass
     #
+    # CONTINUOUS DEBUG
+    #
+    if continuous == True:
+        maxseconds = maxminutes * 60
+        if endtime is not None:
+            untilseconds = (endtime - datetime.datetime.now()).total_seconds()
+            maxseconds = untilseconds if maxseconds <= 0 else min(maxseconds,untilseconds)
+        print('Streaming debug output; press Ctrl+C to send undebug all and stop.')
+        capture = TaScDebugCapture(session,commandlist,'.',maxseconds,debugMaxRate,debugRotateSeconds,
+                                   debugRotateBytes,verbose)
+        result = capture.run()
+        session.close()
+        closeTracing()
+        if metricsserver is not None:
+            metricsserver.shutdown()
+        print('Debug stopped (' + result['reason'] + ') after ' + str(round(result['seconds'],1)) + 's: ' +
+              str(result['bytes']) + ' bytes in ' + str(result['files']) + ' log file(s).')
+        print('Thanks for using TaSc! Bye!\n')
+        exit()
+    #
     # MAIN LOOP
     #
-    if i == 0:
-        while True:
+    log = None
+    try:
+        for tick in scheduler:
+            n = tick.n
+            if tick.missed > 0:
+                print('Previous event overran; ' + str(tick.missed) + ' scheduled start(s) ' +
+                      ('skipped.' if overrun == 'skip' else 'folded into this event.'))
             print('Running TaSc event number ' + str(n) + '...')
-            log = newLog()
-            try:
-                ssh(sship,sshuser,sshpw,sshenpw,commandlist,deviceType,debugchk,verbose,sshport,sshtvalue,log)
-                print('Data for TaSc event ' + str(n) + ' written to log.')
-                n += 1
-            except:
-                print ('\nTaSc encountered an error or an escape sequence was detected.'
-                       '\nShutting down as gracefully as possible, given the circumstances.')
-                log.write('\n\n[' + str(datetime.datetime.now()) + '] Detected an error or '
-                             'escape sequence; exiting main loop.\n')
+            # The last event's log stays open for the shutdown banner
+            if log is not None:
                 log.close()
-                sys.exit(0)
-    else:
-        while i > 0:
-            print('Running TaSc event number ' + str(n) + '...')
             log = newLog()
-            try:
-                ssh(sship,sshuser,sshpw,sshenpw,commandlist,deviceType,debugchk,verbose,sshport,sshtvalue,log)
-                i -= 1
-                print('Data for TaSc event ' + str(n) + ' written to log.')
-                n += 1
-            except:
-                print ('\nTaSc encountered an error or an escape sequence was detected.'
-                       '\nShutting down as gracefully as possible, given the circumstances.')
-                log.write('\n\n[' + str(datetime.datetime.now()) + '] Detected an error or '
-                             'escape sequence; exiting main loop.\n')
-                log.close()
-                sys.exit(0)
+            metrics.event(session.name,tick)
+            eventstart = time.time()
+            if verbose == True and interval > 0:
+                logNote(log,'TaSc event ' + str(n) + ' scheduled for ' + str(tick.due) + ' ('
+                        + str(round(tick.late,3)) + 's late).\n\n')
+            cmds, dbug, window, rule = escalate(recorders,session.name,commandlist,debugchk)
+            if rule is not None:
+                logNote(log,'Escalated by trigger "' + rule['name'] + '" (' + str(triggerWatch(recorders)
+                        .why(session.name)) + ').\n\n')
+                sshtvalue = float(75/estimateCycle(cmds,measured,session.family))
+            durations = ssh(sship,sshuser,sshpw,sshenpw,cmds,deviceType,dbug,verbose,sshport,sshtvalue,log,session,
+                            True,recorders,window)
+            if rule is not None:
+                triggerWatch(recorders).step(session.name)
+            measured.update(durations)
+            sshtvalue = float(75/estimateCycle(commandlist,measured,session.family))
+            wanted = escalatedInterval(recorders,session.name,interval)
+            if scheduler.interval != wanted:
+                scheduler.retime(wanted)
+            print('Data for TaSc event ' + str(n) + ' written to log (' +
+                  str(round(time.time() - eventstart,1)) + 's).')
+    except:
+        if sys.exc_info()[0] is not KeyboardInterrupt:
+            metrics.error(session.name,'event')
+        print ('\nTaSc encountered an error or an escape sequence was detected.'
+               '\nShutting down as gracefully as possible, given the circumstances.')
+        if log is not None:
+            logNote(log,'Detected an error or escape sequence; exiting main loop.\n','\n\n')
+            log.close()
+        session.close()
+        closeRecorders(recorders)
+        closeTracing()
+        if metricsserver is not None:
+            metricsserver.shutdown()
+        sys.exit(0)
+    if log is None:
+        log = newLog()
+    session.close()
+    closeRecorders(recorders)
+    closeTracing()
+    if metricsserver is not None:
+        metricsserver.shutdown()
     print('Thanks for using TaSc! Bye!\n')
     log.write('****************************\n****************************\n**************'
                  '**************\n****************************\n****************************\n['
@@ -891,5 +6433,35 @@ def main():
     log.close()
     exit()
 
+importTime = time.time() - importStarted
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parseArgs()
+    if args.mode == 'inventory':
+        inventoryMain(args)
+    elif args.mode == 'extract':
+        extractMain(args)
+    elif args.mode == 'query':
+        queryMain(args)
+    elif args.mode == 'history':
+        historyMain(args)
+    elif args.mode == 'series':
+        seriesMain(args)
+    elif args.mode == 'trace':
+        traceMain(args)
+    elif args.mode == 'costs':
+        costsMain(args)
+    elif args.mode == 'pcap':
+        pcapMain(args)
+    elif args.mode == 'broker':
+        brokerMain(args)
+    elif args.mode == 'search':
+        searchMain(args)
+    elif args.mode == 'daemon':
+        daemonMain(args)
+    elif args.mode == 'ctl':
+        ctlMain(args)
+    elif args.mode == 'debug':
+        debugMain(args)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+
+import argparse # for CLI arguments
+import contextlib, io # for keeping TaSc's progress messages off the console
+import datetime # for stamping results
+import json # for results files
+import os, os.path # for walking the log folders
+import platform # for recording what the benchmark ran on
+import resource # for peak memory
+import shutil, tempfile # for scratch log folders
+import socket # for the mock server's listener
+import threading # for the mock server
+import time # for timing
+import paramiko # for the mock server's side of SSH
+
+import tasc
+
+# TaSc Benchmarks
+# Purpose: Measure TaSc's throughput, per-event latency, memory use and disk write rate without a real
+# firewall. A local paramiko server stands in for ASA, IOS, SFR (expert and CLIsh) and Unix hosts: it checks
+# passwords, answers enable, turns paging off, prints the prompt TaSc waits for (or echoes its marker),
+# and answers every command with output of a given size after a given delay.
+# Use Case: 'python tasc_bench.py --out before.json', change TaSc, then
+# 'python tasc_bench.py --out after.json --compare before.json'.
+
+benchUser = 'tasc'
+benchPassword = 'tasc-bench'
+benchEnable = 'tasc-enable'
+# What each mock device calls itself at the prompt
+benchHostnames = {'asa':'bench-asa','ios':'bench-rtr','sfrclish':''}
+# Commands each family is benchmarked with
+benchCommands = {'asa':['show cpu usage','show conn count','show interface'],
+                 'ios':['show processes cpu','show interface'],
+                 'unix':['uptime','netstat -s','df -k','ps -ef'],
+                 'sfr':['uptime','top -b -n 1','df -k','ps -ef'],
+                 'sfrclish':['show summary','show version']}
+# TaSc's device type for each family
+benchTypes = {'asa':'asa','ios':'ios','unix':'unix','sfr':'sfr','sfrclish':'sfrclish'}
+# First line of output for commands TaSc has a parser for, so --series has something to chew on
+benchHeads = {'show cpu usage':'CPU utilization for 5 seconds = 1%; 1 minute: 2%; 5 minutes: 3%',
+              'show processes cpu':'CPU utilization for five seconds: 3%/0%; one minute: 2%; five minutes: 1%',
+              'show conn count':'15 in use, 1234 most used',
+              'uptime':' 12:00:00 up 10 days,  1:00,  1 user,  load average: 0.10, 0.20, 0.30'}
+# Pieces of output are sent in chunks this big
+benchChunk = 16384
+
+#
+# MOCK DEVICE
+#
+
+def mockOutput(cmd,size):
+    '''
+    Input: Command (string), bytes of output to make (int).
+    Output: Output for the command: its canned first line (if it has one) and numbered filler lines up to
+    roughly size bytes. Lines end in \\r\\n like a device's, and none of them look like a prompt.
+    '''
+    lines = []
+    total = 0
+    if cmd in benchHeads:
+        lines.append(benchHeads[cmd] + '\r\n')
+        total += len(lines[0])
+    n = 0
+    while total < size:
+        n += 1
+        line = '  line ' + str(n).zfill(7) + ' of "' + cmd + '": ' + 'x' * 40 + '\r\n'
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines)
+
+class MockShell(object):
+    '''
+    Input: paramiko channel, device family (string), bytes of output per command (int), seconds before each
+    command's output starts (float), exec command the channel was opened with (string, or None for a shell).
+    Action: Play the device's side of one TaSc session on its own thread: read lines from the channel and
+    answer them the way that kind of device does on the channel TaSc opens.
+        asa/ios  - enable asks for a password; afterwards every line is answered with output and the prompt,
+                   and debug commands print lines until undebug all
+        unix/sfr - no prompt; 'echo X' prints X (TaSc's end-of-command marker), setup lines print nothing
+        sfrclish - interactive shell with a '> ' prompt
+    '''
+    def __init__(self,chan,family,size,latency,command=None):
+        self.chan = chan
+        self.family = family
+        self.size = size
+        self.latency = latency
+        self.awaiting = None
+        self.prompt = benchHostnames.get(family,'') + ('#' if family in ['asa','ios'] else '>') + ' '
+        self.outputs = {}
+        # Debug lines a second while a debug is on
+        self.debugRate = 200
+        self.debugging = threading.Event()
+        self.pending = []
+        if command is not None and command != '/bin/sh':
+            # ASA/IOS send 'enable\n<password>\n' and SFR 'expert\nsudo -i\n<password>\n' as the exec command
+            self.pending = command.split('\n')
+            if command.endswith('\n'):
+                self.pending.pop()
+        self.thread = threading.Thread(target=self.serve,name='TaSc-bench-shell')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self,text):
+        data = text.encode('ISO-8859-1')
+        for i in range(0,len(data),benchChunk):
+            self.chan.sendall(data[i:i + benchChunk])
+
+    def serve(self):
+        try:
+            if self.family == 'sfrclish':
+                self.send('Copyright 2004-2016, Cisco and/or its affiliates.\r\n\r\n' + self.prompt)
+            for line in self.pending:
+                self.answer(line)
+            buf = ''
+            while True:
+                data = self.chan.recv(65536)
+                if not data:
+                    break
+                buf += data.decode('ISO-8859-1')
+                while '\n' in buf:
+                    line, buf = buf.split('\n',1)
+                    self.answer(line.rstrip('\r'))
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            self.chan.close()
+
+    def answer(self,line):
+        if self.awaiting is not None:
+            # The line is a password
+            self.awaiting = None
+            if self.family in ['asa','ios']:
+                self.send('\r\n' + self.prompt)
+            return
+        if line in ['enable','sudo -i']:
+            self.awaiting = line
+            self.send('Password: ')
+            return
+        if self.family in tasc.markerDevices:
+            if line.startswith('echo '):
+                self.send(line[len('echo '):] + '\n')
+            elif line not in ['','expert']:
+                self.command(line)
+            return
+        if line.startswith('undebug'):
+            self.debugging.clear()
+        if line.strip() == '' or line.startswith('terminal ') or line.startswith('undebug'):
+            self.send('\r\n' + self.prompt)
+            return
+        if line.split(' ')[0] in tasc.debuglist:
+            self.debug(line)
+            self.send(self.prompt)
+            return
+        self.command(line)
+        self.send(self.prompt)
+
+    def debug(self,line):
+        '''
+        Action: Print debug lines at debugRate lines a second on another thread until undebug all.
+        '''
+        def emit():
+            n = 0
+            while self.debugging.is_set() and not self.chan.closed:
+                n += 1
+                try:
+                    self.send('DEBUG ' + str(n).zfill(7) + ' from "' + line + '": ' + 'y' * 40 + '\r\n')
+                except (EOFError, OSError, paramiko.SSHException):
+                    return
+                time.sleep(1.0 / self.debugRate)
+        if not self.debugging.is_set():
+            self.debugging.set()
+            thread = threading.Thread(target=emit,name='TaSc-bench-debug')
+            thread.daemon = True
+            thread.start()
+
+    def command(self,line):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if line not in self.outputs:
+            self.outputs[line] = mockOutput(line,self.size)
+        self.send(self.outputs[line])
+
+class MockServer(paramiko.ServerInterface):
+    '''
+    Input: MockDevice the connection belongs to.
+    Action: paramiko's view of one incoming connection: password auth, session channels, and a MockShell
+    for every exec or shell request.
+    '''
+    def __init__(self,device):
+        self.device = device
+
+    def get_allowed_auths(self,username):
+        return 'password'
+
+    def check_auth_password(self,username,password):
+        if username == benchUser and password == benchPassword:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self,kind,chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self,channel,command):
+        MockShell(channel,self.device.family,self.device.size,self.device.latency,command.decode('utf-8'))
+        return True
+
+    def check_channel_pty_request(self,channel,term,width,height,pixelwidth,pixelheight,modes):
+        return True
+
+    def check_channel_shell_request(self,channel):
+        MockShell(channel,self.device.family,self.device.size,self.device.latency)
+        return True
+
+class MockDevice(object):
+    '''
+    Input: Device family (asa/ios/unix/sfr/sfrclish), bytes of output per command (int), seconds before each
+    command's output starts (float), host key (paramiko key, optional; making one takes a moment).
+    Action: Listen on a free port on 127.0.0.1 and serve every connection on its own paramiko Transport.
+    Output: port is the port to point TaSc at; call close() when done.
+    '''
+    def __init__(self,family,size=10000,latency=0.05,key=None):
+        self.family = family
+        self.size = size
+        self.latency = latency
+        self.key = key or paramiko.RSAKey.generate(2048)
+        self.transports = []
+        self.listener = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self.listener.bind(('127.0.0.1',0))
+        self.listener.listen(100)
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.accept,name='TaSc-bench-server')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def accept(self):
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.key)
+            try:
+                transport.start_server(server=MockServer(self))
+            except paramiko.SSHException:
+                continue
+            self.transports.append(transport)
+
+    def close(self):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+
+#
+# MEASUREMENT
+#
+
+def currentRSS():
+    '''
+    Output: Resident memory of this process in bytes (int), or None where /proc isn't available.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError, OSError):
+        return None
+
+def peakRSS():
+    '''
+    Output: High-water mark of this process's resident memory in bytes (int). Linux reports KB, macOS bytes.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+class MemorySampler(object):
+    '''
+    Action: Sample resident memory every interval seconds on a background thread and keep the highest,
+    so each benchmark gets its own peak (ru_maxrss only ever goes up over the whole process).
+    '''
+    def __init__(self,interval=0.1):
+        self.interval = interval
+        self.peak = currentRSS()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample,name='TaSc-bench-memory')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            rss = currentRSS()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.peak
+
+class SpanCollector(object):
+    '''
+    Action: Tracer callback (see tasc.TaScTracer) that keeps every finished span for the summary.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+
+    def __call__(self,span):
+        with self.lock:
+            self.spans.append(span)
+
+def percentile(ordered,pct):
+    '''
+    Input: Sorted list of numbers, percentile (0-100).
+    Output: Nearest-rank percentile, or None for an empty list.
+    '''
+    if len(ordered) == 0:
+        return None
+    return ordered[max(int(-(-pct * len(ordered) // 100)) - 1,0)]
+
+def folderBytes(folder):
+    total = 0
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root,name))
+            except OSError:
+                pass
+    return total
+
+def summarize(name,family,ndevices,spans,wall,logroot,memory):
+    '''
+    Input: Benchmark name, device family, number of devices, spans collected during the run, seconds the
+    run took, log folder it wrote to, peak resident memory (bytes or None).
+    Output: Result dict. Throughput is measured from the start of the first event to the end of the last
+    one, so the initial logins and connectivity tests don't count against it (they're in 'phases').
+    '''
+    events = [span for span in spans if span.name == 'event']
+    latencies = sorted([span.duration for span in events])
+    phases = {}
+    for span in spans:
+        if span.name != 'event':
+            phases.setdefault(span.name,[]).append(span.duration)
+    if len(events) > 0:
+        busy = max([span.end for span in events]) - min([span.start for span in events])
+    else:
+        busy = 0
+    disk = folderBytes(logroot)
+    return {'name':name,'family':family,'devices':ndevices,'events':len(events),
+            'errors':len([span for span in spans if span.outcome not in ['ok']]),
+            'wall_seconds':wall,
+            'events_per_second':len(events) / busy if busy > 0 else None,
+            'latency_seconds':{'mean':sum(latencies) / len(latencies) if len(latencies) > 0 else None,
+                               'p50':percentile(latencies,50),'p90':percentile(latencies,90),
+                               'p99':percentile(latencies,99),'max':latencies[-1] if len(latencies) > 0 else None},
+            'phase_mean_seconds':dict([(phase,sum(times) / len(times)) for phase, times in sorted(phases.items())]),
+            'received_bytes':sum([span.nbytes for span in events]),
+            'disk_bytes':disk,
+            'disk_bytes_per_second':disk / busy if busy > 0 else None,
+            'rss_peak_bytes':memory}
+
+#
+# BENCHMARKS
+#
+
+def benchSingle(family,events,size,latency,key,scratch):
+    '''
+    Input: Device family, number of events (int), bytes of output per command, seconds before each command's
+    output starts, host key for the mock device, scratch folder.
+    Action: Run events back to back against one mock device through a TaScJob (one persistent session).
+    Output: Result dict (see summarize()).
+    '''
+    device = MockDevice(family,size,latency,key)
+    logroot = os.path.join(scratch,'single-' + family)
+    job = tasc.TaScJob('127.0.0.1',benchUser,benchPassword,benchEnable,benchTypes[family],benchCommands[family],
+                       device.port,logroot,name='bench-' + family)
+    collector = SpanCollector()
+    tasc.tracer.addCallback(collector)
+    sampler = MemorySampler()
+    started = time.monotonic()
+    try:
+        if not job.verify():
+            raise RuntimeError('Could not log in to the mock ' + family + ' device.')
+        for n in range(events):
+            job.event()
+    finally:
+        wall = time.monotonic() - started
+        memory = sampler.stop()
+        tasc.tracer.removeCallback(collector)
+        job.close()
+        device.close()
+    return summarize('single-' + family,family,1,collector.spans,wall,logroot,memory)
+
+def benchMany(family,ndevices,events,workers,size,latency,key,scratch):
+    '''
+    Input: Device family, number of devices (int), events per device (int), worker pool size (int), bytes of
+    output per command, seconds before each command's output starts, host key, scratch folder.
+    Action: Run the same commands against ndevices mock devices at once through an InventoryRunner, the
+    way 'tasc.py inventory' does. Each device gets its own mock server and session.
+    Output: Result dict (see summarize()).
+    '''
+    servers = [MockDevice(family,size,latency,key) for i in range(ndevices)]
+    devices = [{'name':'bench-' + family + '-' + str(i),'ip':'127.0.0.1','port':servers[i].port,
+                'type':benchTypes[family],'user':benchUser,'password':benchPassword,'enable':benchEnable}
+               for i in range(ndevices)]
+    logroot = os.path.join(scratch,'many-' + family + '-' + str(ndevices))
+    collector = SpanCollector()
+    tasc.tracer.addCallback(collector)
+    sampler = MemorySampler()
+    started = time.monotonic()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            runner = tasc.InventoryRunner(devices,benchCommands[family],events,workers,False,logroot)
+            runner.run()
+    finally:
+        wall = time.monotonic() - started
+        memory = sampler.stop()
+        tasc.tracer.removeCallback(collector)
+        for server in servers:
+            server.close()
+    return summarize('many-' + family + '-' + str(ndevices),family,ndevices,collector.spans,wall,logroot,memory)
+
+def compareResults(old,new):
+    '''
+    Input: Two results files' contents (dicts, as written by main()).
+    Output: Lines comparing the headline numbers of every benchmark the two have in common.
+    '''
+    lines = []
+    before = dict([(result['name'],result) for result in old['results']])
+    for result in new['results']:
+        if result['name'] not in before:
+            continue
+        was = before[result['name']]
+        for label, a, b in [('events/s',was['events_per_second'],result['events_per_second']),
+                            ('p50 latency',was['latency_seconds']['p50'],result['latency_seconds']['p50']),
+                            ('p90 latency',was['latency_seconds']['p90'],result['latency_seconds']['p90']),
+                            ('peak RSS',was['rss_peak_bytes'],result['rss_peak_bytes']),
+                            ('disk bytes/s',was['disk_bytes_per_second'],result['disk_bytes_per_second'])]:
+            if a is None or b is None:
+                continue
+            change = '' if a == 0 else '  (' + ('+' if b >= a else '') + str(round((b - a) * 100.0 / a,1)) + '%)'
+            lines.append(result['name'] + '  ' + label + ': ' + str(round(a,4)) + ' -> ' + str(round(b,4)) + change)
+    return lines
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark TaSc against local mock ASA/IOS/SFR/Unix SSH servers.')
+    parser.add_argument('-f','--family',action='append',choices=sorted(benchCommands),
+                        help='Device family to benchmark (repeat for more than one; default all)')
+    parser.add_argument('-n','--events',type=int,default=20,help='Events per device (default 20)')
+    parser.add_argument('-d','--devices',type=int,default=10,help='Devices in the many-device benchmark '
+                        '(default 10; 0 = skip it)')
+    parser.add_argument('-w','--workers',type=int,default=8,help='Worker pool size for the many-device benchmark')
+    parser.add_argument('-s','--size',type=int,default=10000,help='Bytes of output per command (default 10000)')
+    parser.add_argument('-l','--latency',type=float,default=0.05,help='Seconds before each command\'s output starts '
+                        '(default 0.05)')
+    parser.add_argument('-z','--compress',action='store_true',help='Write gzip log segments')
+    parser.add_argument('-P','--parallel',type=int,default=1,help='Channels to run Unix/SFR commands on side by side '
+                        '(default 1)')
+    parser.add_argument('-o','--out',help='Write the results to this JSON file')
+    parser.add_argument('--compare',help='Results file from an earlier run to compare against')
+    parser.add_argument('--keep',action='store_true',help='Keep the scratch log folders')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    families = args.family or ['asa','ios','unix','sfr','sfrclish']
+    # Keep every log so the disk numbers count everything that was written
+    tasc.ringMaxFiles = 0
+    tasc.logCompression = args.compress
+    tasc.parallelChannels = args.parallel
+    scratch = tempfile.mkdtemp(prefix='tasc-bench-')
+    # Mock timings shouldn't end up in the real cost model
+    tasc.costs = tasc.CostModel(os.path.join(scratch,'costs.json'))
+    key = paramiko.RSAKey.generate(2048)
+    results = []
+    try:
+        for family in families:
+            print('Benchmarking one ' + family + ' device (' + str(args.events) + ' events)...')
+            results.append(benchSingle(family,args.events,args.size,args.latency,key,scratch))
+        if args.devices > 0:
+            print('Benchmarking ' + str(args.devices) + ' ' + families[0] + ' devices (' + str(args.events) +
+                  ' events each, ' + str(args.workers) + ' workers)...')
+            results.append(benchMany(families[0],args.devices,args.events,args.workers,args.size,args.latency,key,
+                                     scratch))
+    finally:
+        if args.keep:
+            print('Logs kept in ' + scratch)
+        else:
+            shutil.rmtree(scratch,ignore_errors=True)
+    report = {'tasc':tasc.tascVersion,'python':platform.python_version(),'platform':platform.platform(),
+              'time':str(datetime.datetime.now()),'process_rss_peak_bytes':peakRSS(),
+              'settings':{'events':args.events,'devices':args.devices,'workers':args.workers,'size':args.size,
+                          'latency':args.latency,'compress':args.compress,'parallel':args.parallel},
+              'results':results}
+    for result in results:
+        latency = result['latency_seconds']
+        print(result['name'] + '  events=' + str(result['events']) + '  errors=' + str(result['errors']) +
+              '  events/s=' + str(round(result['events_per_second'] or 0,2)) +
+              '  p50=' + str(round(latency['p50'] or 0,3)) + 's  p90=' + str(round(latency['p90'] or 0,3)) +
+              's  disk=' + str(round((result['disk_bytes_per_second'] or 0) / 1000000.0,2)) + 'MB/s' +
+              '  rss=' + ('n/a' if result['rss_peak_bytes'] is None else
+                          str(round(result['rss_peak_bytes'] / 1000000.0,1)) + 'MB'))
+    if args.out:
+        with open(args.out,'w') as f:
+            json.dump(report,f,indent=2)
+        print('Results written to ' + args.out)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if old.get('settings') != report['settings']:
+            print('NOTE: ' + args.compare + ' was run with different settings: ' + json.dumps(old.get('settings')))
+        for line in compareResults(old,report):
+            print(line)
+    return report
+
+if __name__ == "__main__":
+    main()
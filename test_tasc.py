@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+'''
+Unit tests for the parts of TaSc that don't need a device: python -m unittest test_tasc
+'''
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import tasc
+
+# Two packets as 'show capture NAME dump' prints them
+pcapDump = ('2 packets captured\r\n\r\n'
+            '   1: 12:00:01.123456 10.0.0.1.1234 > 10.0.0.2.80: S 1:1(0) win 8192\r\n'
+            '0x0000\t 0050 56ab cdef 0050 56ab 0001 0800 4500 \t.PV..PV.......E.\r\n'
+            '0x0010\t 002c 0001 0000 4006 66c5 0a00 0001 0a00 \t.,....@.f.......\r\n'
+            '0x0020\t 0002 04d2 0050 0000 0001 0000 0000 6002 \t.....P........`.\r\n'
+            '0x0030\t 2000 4ac5 0000                          \t .J...\r\n'
+            '   2: 12:00:01.223456 10.0.0.2.80 > 10.0.0.1.1234: S 1:1(0) ack 2 win 8192\r\n'
+            '0x0000\t 0050 56ab 0001 0050 56ab cdef 0800 4500 \t.PV..PV.......E.\r\n'
+            '0x0010\t 002c 0002 0000 4006 66c4 0a00 0002 0a00 \t.,....@.f.......\r\n'
+            '0x0020\t 0001 0050 04d2 0000 0001 0000 0002 6012 \t...P..........`.\r\n'
+            '0x0030\t 2000 4ab2 0000                          \t .J...\r\n'
+            '2 packets shown\r\n')
+
+class PcapDumpParserTest(unittest.TestCase):
+    def parse(self,size):
+        packets = []
+        parser = tasc.PcapDumpParser(lambda stamp, frame: packets.append((stamp,frame)))
+        for i in range(0,len(pcapDump),size):
+            parser.write(pcapDump[i:i + size])
+        parser.finish()
+        return packets
+
+    def testChunkSizes(self):
+        whole = self.parse(len(pcapDump))
+        self.assertEqual(len(whole),2)
+        self.assertEqual([len(frame) for stamp, frame in whole],[54,54])
+        self.assertEqual(whole[0][0].time(),datetime.time(12,0,1,123456))
+        for size in [1,7,13,64,100,1000]:
+            self.assertEqual(self.parse(size),whole,'chunks of ' + str(size))
+
+class GzipSegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testFlushedMemberReadsBack(self):
+        # A big output is read back out of the log before its member is finished (see ssh())
+        log = tasc.LogWriter(tasc.GzipSegment(os.path.join(self.folder,'a.log.gz')))
+        tasc.logHeader(log,'2026-01-01 00:00:00','Output','show tech')
+        pointer = tasc.logPointer(log).get()
+        output = ''.join(['line ' + str(n) + '\n' for n in range(100000)])
+        log.write(output)
+        log.flush()
+        self.assertEqual(tasc.readPointer(pointer,len(output)),output)
+        log.close()
+
+class ReadPointerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self,log,output):
+        # What ssh() writes for a command that timed out, followed by the next command
+        tasc.logHeader(log,'2026-01-01 00:00:00','Output','show conn')
+        pointer = tasc.logPointer(log)
+        log.write(output)
+        log.write('\n')
+        tasc.logNote(log,'WARNING: prompt did not return within 900 seconds; output above may be incomplete.\n')
+        tasc.logHeader(log,'2026-01-01 00:00:01','Output','show version')
+        log.write('Cisco Adaptive Security Appliance\r\nasa# ')
+        return pointer
+
+    def testStopsAtOutputEnd(self):
+        output = '12 in use, 40 most used\r\n\r\nTCP outside 10.0.0.1:443 inside 10.0.0.2:51234\r\n'
+        for name in ['a.log','a.log.gz']:
+            path = os.path.join(self.folder,name)
+            log = tasc.GzipSegment(path) if name.endswith('.gz') else open(path,'w',newline='')
+            pointer = self.write(log,output)
+            log.close()
+            self.assertEqual(tasc.readPointer(pointer,len(output)),output,name)
+            self.assertEqual(tasc.readPointer(pointer),output,name)
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.folder)
+
+    def testDeltaRoundTrip(self):
+        old = ''.join(['Interface GigabitEthernet0/' + str(n) + ', packets input ' + str(n * 7) + '\r\n'
+                       for n in range(20)]) + 'asa# '
+        new = old.replace('packets input 21\r\n','packets input 22\r\n')
+        cases = [(old,new),
+                 (old,old.replace('/5,','/5 (shutdown),\r\n  admin down\r\n',1)),
+                 (old,'New banner\r\n' + old + '\r\nasa# '),
+                 (old,old[:-len('asa# ')]),
+                 (old,''),
+                 ('','one line, no newline'),
+                 ('a\nb\nc','a\nB\nc\n')]
+        for before, after in cases:
+            self.assertEqual(tasc.applyDelta(before,tasc.lineDelta(before,after)),after)
+
+    def testRebuild(self):
+        lines = ['  line ' + str(n) + ' of show conn\r\n' for n in range(50)]
+        outputs = [''.join(lines),
+                   ''.join(lines[:10] + ['  replaced\r\n'] + lines[11:]),
+                   ''.join(lines[:10] + ['  replaced\r\n'] + lines[11:]),
+                   ''.join(lines[:30] + ['  inserted\r\n'] + lines[30:]) + 'asa# ',
+                   ''.join(lines)]
+        store = tasc.HistoryStore(self.folder)
+        for n in range(len(outputs)):
+            store.record(tasc.CommandRecord('2026-01-01 00:00:0' + str(n),n,'asa1','asa','show conn',0.1,
+                                            len(outputs[n]),outputs[n],None,True))
+        store.close()
+        reader = tasc.HistoryReader(self.folder)
+        kinds = [entry['kind'] for entry in reader.events('asa1','show conn')]
+        self.assertEqual(kinds,['full','delta','same','delta','ref'])
+        for n in range(len(outputs)):
+            self.assertEqual(reader.rebuild('asa1','show conn',n + 1),outputs[n],'event ' + str(n + 1))
+
+class FakeChannel(object):
+    '''
+    Stand-in for a paramiko channel that hands out a fixed list of chunks.
+    '''
+    def __init__(self,chunks):
+        self.chunks = [chunk.encode('ISO-8859-1') for chunk in chunks]
+        self.closed = False
+
+    def recv_ready(self):
+        return len(self.chunks) > 0
+
+    def recv(self,n):
+        return self.chunks.pop(0)
+
+    def exit_status_ready(self):
+        return len(self.chunks) == 0
+
+class FakeStdin(object):
+    def write(self,text):
+        pass
+
+    def flush(self):
+        pass
+
+class MarkerTest(unittest.TestCase):
+    def capture(self,chunks):
+        session = tasc.TaScSession('192.0.2.1','user','pw','pw','unix',22)
+        session.stdin = FakeStdin()
+        session.stdout = unittest.mock.Mock(channel=FakeChannel(chunks))
+        sink = tasc.CaptureSink(io.StringIO())
+        output, finished = session.run('ls',5,sink=sink)
+        return sink.log.getvalue(), finished
+
+    def testMarkerSplitWithLateOutput(self):
+        # Output from something backgrounded lands right behind the marker, in the same read
+        chunks = ['x' * 100 + '\nfile1\nTASC-E','OC-1\nlate stderr\n']
+        self.assertEqual(self.capture(chunks),('x' * 100 + '\nfile1\n',True))
+        self.assertEqual(self.capture(['file1\nTASC-EOC-1\nlate\n']),('file1\n',True))
+
+class FullDisk(object):
+    name = 'full.log'
+
+    def write(self,text):
+        raise OSError(28,'No space left on device')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class LogWriterTest(unittest.TestCase):
+    def testWriteErrorIsRaised(self):
+        log = tasc.LogWriter(FullDisk())
+        log.write('output\n')
+        self.assertRaises(OSError,log.flush)
+        log.write('more output\n')
+        self.assertRaises(OSError,log.close)
+
+class LogRingTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.folder)
+        patcher = unittest.mock.patch('tasc.asyncLogs',False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fill(self,ring,n,size=100):
+        names = []
+        for i in range(n):
+            log = ring.next()
+            log.write('x' * size)
+            log.close()
+            names.append(os.path.basename(log.name))
+        return names
+
+    def files(self):
+        return sorted([name for name in os.listdir(self.folder) if name.startswith('TaSc-log-')])
+
+    def testMaxFiles(self):
+        names = self.fill(tasc.LogRing(self.folder,maxfiles=3),5)
+        self.assertEqual(self.files(),sorted(names[2:]))
+
+    def testMaxBytes(self):
+        ring = tasc.LogRing(self.folder,maxfiles=0,maxbytes=250)
+        names = self.fill(ring,4)
+        # The newest file's size isn't known until the next rotation, so the three before it are what's counted
+        self.assertEqual(self.files(),sorted(names[1:]))
+        self.assertLessEqual(ring.totalbytes,250)
+
+    def testMaxAge(self):
+        clock = Clock(1000000.0,100.0)
+        with unittest.mock.patch('time.time',side_effect=lambda: clock.wall):
+            ring = tasc.LogRing(self.folder,maxfiles=0,maxage=60)
+            names = self.fill(ring,2)
+            clock.advance(50)
+            names += self.fill(ring,1)
+        # 50s old is still within the limit, 80s old isn't
+        self.assertEqual(self.files(),sorted(names))
+        with unittest.mock.patch('time.time',side_effect=lambda: clock.wall + 30):
+            names += self.fill(ring,1)
+        self.assertEqual(self.files(),sorted(names[2:]))
+
+    def testManifestReload(self):
+        names = self.fill(tasc.LogRing(self.folder,maxfiles=3),2)
+        # A restarted TaSc picks the ring up from its manifest and keeps evicting oldest first
+        ring = tasc.LogRing(self.folder,maxfiles=3)
+        self.assertEqual([segment[0] for segment in ring.segments],names)
+        names += self.fill(ring,2)
+        self.assertEqual(self.files(),sorted(names[1:]))
+        os.remove(os.path.join(self.folder,tasc.LogRing.manifestName))
+        ring = tasc.LogRing(self.folder,maxfiles=3)
+        self.assertEqual(sorted([segment[0] for segment in ring.segments]),sorted(names[1:]))
+
+class Clock(object):
+    '''
+    Stand-in for time.time(), time.monotonic() and time.sleep() that only moves when the test (or a sleep)
+    moves it.
+    '''
+    def __init__(self,wall,mono):
+        self.wall = wall
+        self.mono = mono
+
+    def advance(self,seconds):
+        self.wall += seconds
+        self.mono += seconds
+
+    def patch(self,test):
+        for name, fn in [('time',lambda: self.wall),('monotonic',lambda: self.mono),('sleep',self.advance)]:
+            patcher = unittest.mock.patch('time.' + name,side_effect=fn)
+            patcher.start()
+            test.addCleanup(patcher.stop)
+
+class TaScSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock(1000000.0,100.0)
+        self.clock.patch(self)
+
+    def due(self,tick):
+        return tick.due.timestamp() - 1000000.0
+
+    def overrun(self,policy):
+        # Events every 10s; the first one runs 25s, blowing through the boundaries at +10 and +20
+        scheduler = tasc.TaScScheduler(10,policy=policy,align=False)
+        first = scheduler.next()
+        self.assertEqual((first.n,first.wait,first.late,first.missed,self.due(first)),(1,0,0,0,0))
+        self.clock.advance(25)
+        return scheduler
+
+    def testSkip(self):
+        scheduler = self.overrun('skip')
+        tick = scheduler.next()
+        self.assertEqual((tick.n,tick.missed,self.due(tick),tick.wait,tick.late),(2,2,30,5,0))
+        self.assertEqual(scheduler.k,4)
+
+    def testCoalesce(self):
+        scheduler = self.overrun('coalesce')
+        tick = scheduler.next()
+        self.assertEqual((tick.n,tick.missed,self.due(tick),tick.wait,tick.late),(2,1,20,0,5))
+        self.assertEqual(scheduler.k,3)
+        # Back on the grid afterwards
+        tick = scheduler.next()
+        self.assertEqual((tick.missed,self.due(tick),tick.wait),(0,30,5))
+
+    def testLate(self):
+        scheduler = self.overrun('late')
+        ticks = [scheduler.next() for i in range(3)]
+        self.assertEqual([self.due(tick) for tick in ticks],[10,20,30])
+        self.assertEqual([tick.late for tick in ticks],[15,5,0])
+        self.assertEqual([tick.missed for tick in ticks],[0,0,0])
+        self.assertEqual(scheduler.k,4)
+
+    def testLateTolerance(self):
+        scheduler = tasc.TaScScheduler(10,align=False)
+        scheduler.next()
+        self.clock.advance(10 + tasc.lateTolerance / 2)
+        tick = scheduler.next()
+        self.assertEqual((tick.missed,self.due(tick)),(0,10))
+
+    def testCount(self):
+        scheduler = tasc.TaScScheduler(10,count=2,align=False)
+        self.assertEqual([tick.n for tick in scheduler],[1,2])
+        self.assertIsNone(scheduler.next())
+
+    def testEndTime(self):
+        end = datetime.datetime.fromtimestamp(1000000.0 + 25)
+        ticks = list(tasc.TaScScheduler(10,endtime=end,align=False))
+        self.assertEqual([self.due(tick) for tick in ticks],[0,10,20])
+
+    def testMidnightAlignment(self):
+        midnight = datetime.datetime.combine(datetime.date.today(),datetime.time()).timestamp()
+        self.clock.wall = midnight + 1234.5
+        tick = tasc.TaScScheduler(300).next()
+        self.assertEqual(tick.due.timestamp() - midnight,1500)
+        self.assertAlmostEqual(tick.wait,265.5)
+
+class CostModelTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.folder)
+        self.path = os.path.join(self.folder,'costs.json')
+        self.costs = tasc.CostModel(self.path)
+
+    def record(self,seconds,finished=True,cmd='show conn'):
+        for taken in seconds:
+            self.costs.record('asa',cmd,taken,1000,finished)
+
+    def testLearnedTimeout(self):
+        self.record([4,10])
+        # Not enough finished runs yet to learn from
+        self.assertIsNone(self.costs.timeout('asa','show conn'))
+        self.record([6])
+        self.assertEqual(self.costs.timeout('asa','show conn'),3 * 10 + tasc.costTimeoutMargin)
+        self.assertEqual(self.costs.timeout('asa','sh conn'),3 * 10 + tasc.costTimeoutMargin)
+
+    def testFloorAndCeiling(self):
+        self.record([0.1,0.2,0.1],cmd='show version')
+        self.assertEqual(self.costs.timeout('asa','show version'),tasc.costMinTimeout)
+        self.record([5000,5000,5000],cmd='show tech')
+        self.assertEqual(self.costs.timeout('asa','show tech'),tasc.costMaxTimeout)
+
+    def testTimedOut(self):
+        self.record([4,5,6])
+        # Twice as long as the run that just timed out, and never less than the static timeout
+        self.record([50],False)
+        self.assertEqual(self.costs.timeout('asa','show conn',300),300)
+        self.record([400],False)
+        self.assertEqual(self.costs.timeout('asa','show conn',300),800)
+        # Once it finishes again, it keeps at least the static timeout
+        self.record([700])
+        self.assertEqual(self.costs.timeout('asa','show conn',300),int(3 * 700 + tasc.costTimeoutMargin))
+
+    def testDebugsNotRecorded(self):
+        self.record([60,60,60],cmd='debug ip packet')
+        self.assertEqual(self.costs.samples('asa','debug ip packet'),[])
+
+    def testSaveAndReload(self):
+        with unittest.mock.patch('tasc.costSaveSeconds',0):
+            self.record([4,5,6])
+        reloaded = tasc.CostModel(self.path)
+        self.assertEqual(reloaded.timeout('asa','show conn'),self.costs.timeout('asa','show conn'))
+        self.assertEqual(len(reloaded.samples('asa','show conn')),3)
+
+class TaScThrottleTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.folder)
+        self.clock = Clock(1000000.0,100.0)
+        self.clock.patch(self)
+        for name, value in [('throttling',True),('throttleBusyPause',0),
+                            ('costs',tasc.CostModel(os.path.join(self.folder,'costs.json')))]:
+            patcher = unittest.mock.patch('tasc.' + name,value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.throttle = tasc.TaScThrottle()
+
+    def command(self,cmd,seconds,output=''):
+        # What ssh() does with every command: observe first, then into the cost model
+        change = self.throttle.observe('asa1','asa',cmd,seconds,True,output)
+        tasc.costs.record('asa',cmd,seconds,1000,True)
+        return change
+
+    def testCpu(self):
+        busy = 'CPU utilization for 5 seconds = 91%; 1 minute: 85%; 5 minutes: 70%\r\nasa# '
+        calm = 'CPU utilization for 5 seconds = 20%; 1 minute: 40%; 5 minutes: 60%\r\nasa# '
+        self.assertTrue(self.throttle.wants('asa','show cpu'))
+        self.assertEqual(self.command('show cpu usage',0.1,busy),'busy')
+        self.assertIsNotNone(self.throttle.admit('asa1','asa','show tech-support'))
+        self.assertIsNone(self.throttle.admit('asa1','asa','show version'))
+        self.assertEqual(self.command('show cpu',0.1,calm),'clear')
+        self.assertIsNone(self.throttle.admit('asa1','asa','show tech-support'))
+
+    def testLatency(self):
+        for i in range(tasc.costMinSamples):
+            self.assertIsNone(self.command('show version',1))
+        # Ten times slower than usual: 0.7 * 1 + 0.3 * 10 crosses throttleLatencyBusy
+        self.assertEqual(self.command('show version',10),'busy')
+        changes = [self.command('show version',1) for i in range(5)]
+        # It has to fall below throttleLatencyClear, not just below throttleLatencyBusy, before it clears
+        self.assertEqual(changes,[None,None,None,None,'clear'])
+        self.assertFalse(self.throttle.busy('asa1'))
+
+    def testProbe(self):
+        self.command('show cpu usage',0.1,'CPU utilization for 5 seconds = 95%; 1 minute: 90%; 5 minutes: 80%')
+        self.assertIsNotNone(self.throttle.admit('asa1','asa','show tech-support'))
+        self.clock.advance(tasc.throttleProbeSeconds)
+        # One heavy command goes through to see whether the device has recovered, then it's skipped again
+        self.assertIsNone(self.throttle.admit('asa1','asa','show tech-support'))
+        self.assertIsNotNone(self.throttle.admit('asa1','asa','show tech-support'))
+
+    def testLatencyFades(self):
+        for i in range(tasc.costMinSamples):
+            self.command('show version',1)
+        self.command('show version',10)
+        self.assertTrue(self.throttle.busy('asa1'))
+        # Only heavy commands run while it's busy, and they have no usual time to compare with, yet the slowdown
+        # fades by half every throttleProbeSeconds until the device clears
+        changes = []
+        for i in range(3):
+            self.clock.advance(tasc.throttleProbeSeconds)
+            changes.append(self.throttle.observe('asa1','asa','show tech-support',600,True))
+        self.assertIn('clear',changes)
+
+class TriggerWatchTest(unittest.TestCase):
+    rules = [{'name':'drops','command':'sh asp drop','regex':r'ACL Drop \(acl-drop\)','commands':['show conn count'],
+              'events':2},
+             {'name':'cpu','type':'ASA','command':'show cpu usage','field':'cpu.5s','above':80,'interval':10},
+             {'name':'failover','command':'show failover','changed':True}]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.folder)
+        path = os.path.join(self.folder,'triggers.json')
+        with open(path,'w') as f:
+            json.dump(self.rules,f)
+        self.watch = tasc.loadTriggers(path)
+
+    def record(self,cmd,output,device='asa1',family='asa'):
+        self.watch.record(tasc.CommandRecord('2026-01-01 00:00:00',0,device,family,cmd,0.1,len(output),output,None,
+                                             True))
+
+    def testRegexEscalation(self):
+        self.record('show asp drop','Flow is denied by configured rule (acl-drop)   12\r\n')
+        self.assertIsNone(self.watch.active('asa1'))
+        self.record('show asp drop','  ACL Drop (acl-drop)   12\r\n')
+        self.assertEqual(self.watch.active('asa1')['name'],'drops')
+        self.assertIsNone(self.watch.active('asa2'))
+        cmds, dbug, window, rule = tasc.escalate([self.watch],'asa1',['show asp drop'],False)
+        self.assertEqual(cmds,['show asp drop','show conn count'])
+        # Back to the baseline after the rule's events
+        self.assertEqual([self.watch.step('asa1'),self.watch.step('asa1')],[False,True])
+        self.assertIsNone(self.watch.active('asa1'))
+        self.assertEqual(tasc.escalate([self.watch],'asa1',['show asp drop'],False)[0],['show asp drop'])
+
+    def testFiringAgainRestartsCount(self):
+        self.record('show asp drop','  ACL Drop (acl-drop)   12\r\n')
+        self.watch.step('asa1')
+        self.record('show asp drop','  ACL Drop (acl-drop)   15\r\n')
+        self.assertEqual([self.watch.step('asa1'),self.watch.step('asa1')],[False,True])
+
+    def testFieldThreshold(self):
+        self.record('show cpu usage','CPU utilization for 5 seconds = 50%; 1 minute: 50%; 5 minutes: 50%')
+        self.assertIsNone(self.watch.active('asa1'))
+        # Only for the rule's device type
+        self.record('show cpu usage','CPU utilization for 5 seconds = 95%; 1 minute: 50%; 5 minutes: 50%',
+                    family='ios')
+        self.assertIsNone(self.watch.active('asa1'))
+        self.record('show cpu usage','CPU utilization for 5 seconds = 95%; 1 minute: 50%; 5 minutes: 50%')
+        self.assertEqual(self.watch.why('asa1'),'cpu.5s=95.0')
+        self.assertEqual(tasc.escalatedInterval([self.watch],'asa1',60),10)
+        self.assertEqual(tasc.escalatedInterval([self.watch],'asa2',60),60)
+
+    def testChanged(self):
+        self.record('show failover','This host: Primary - Active\r\n')
+        self.record('show failover','This host: Primary - Active\r\n')
+        self.assertIsNone(self.watch.active('asa1'))
+        self.record('show failover','This host: Primary - Standby Ready\r\n')
+        self.assertEqual(self.watch.active('asa1')['name'],'failover')
+
+class PromptTest(unittest.TestCase):
+    def ask(self,fn,answers):
+        with unittest.mock.patch('builtins.input',side_effect=answers) as prompt:
+            result = fn('? ')
+        return result, prompt.call_count
+
+    def testMetricsPort(self):
+        self.assertEqual(self.ask(tasc.getMetricsPort,['abc','0','70000','9100']),(9100,4))
+        self.assertEqual(self.ask(tasc.getMetricsPort,['']),(None,1))
+
+    def testOffloadWorkers(self):
+        self.assertEqual(self.ask(tasc.getOffloadWorkers,['abc','-1','0']),(0,3))
+        self.assertEqual(self.ask(tasc.getOffloadWorkers,['70000']),(70000,1))
+        self.assertEqual(self.ask(tasc.getOffloadWorkers,['']),(0,1))
+
+    def testCapturePort(self):
+        self.assertEqual(self.ask(tasc.getCapturePort,['abc','0','65536','443']),('443',4))
+        self.assertEqual(self.ask(tasc.getCapturePort,['']),('',1))
+
+if __name__ == '__main__':
+    unittest.main()